@@ -14,13 +14,14 @@
 """
 __author__ = 'alex'
 
+import asyncio
 import os
 import re
-from typing import List, Tuple
+from typing import List, Tuple, Dict, Any, AsyncIterator
 
 import httpx
 
-from core import translate
+from core import translate, settings
 from core.analyze import review
 from core.log import logger
 from core.utils import github
@@ -161,15 +162,31 @@ def is_significant_change(diff: str, file_file_extension: str) -> bool:
     return significant_changes >= 5 and (significant_changes / total_changes) > 0.2
 
 
+def need_review(file_detail: dict) -> bool:
+    file_extension = os.path.splitext(file_detail['filename'])[1]
+    if file_extension not in REVIEWS_FILES_EXTENSIONS:
+        return False
+    if file_detail['status'] not in ['added', 'modified']:
+        return False
+    return True
+
+
+async def get_review_contexts(repo_name: str, files: List[dict]) -> Dict[str, Dict[str, Any]]:
+    """
+    一次性获取所有需要审查的文件的上下文信息
+    """
+    patches = {file['filename']: review.get_review_patch(file['status'], file.get('patch', None))
+               for file in files if need_review(file)}
+    return await review.get_review_contexts(repo_name, patches)
+
+
 async def review_file(file_detail: dict, repo_name: str, commit_message: str, commit_sha: str,
-                      client: httpx.AsyncClient) -> str | None:
+                      client: httpx.AsyncClient, context: Dict[str, Any] | None = None) -> str | None:
     filename = file_detail['filename']
     file_patch = file_detail.get('patch', None)
     file_status = file_detail['status']
     file_extension = os.path.splitext(filename)[1]
-    if file_extension not in REVIEWS_FILES_EXTENSIONS:
-        return None
-    if file_status not in ['added', 'modified']:
+    if not need_review(file_detail):
         return None
     # if file_patch:
     #     if not is_significant_change(file_patch, file_extension):
@@ -177,18 +194,45 @@ async def review_file(file_detail: dict, repo_name: str, commit_message: str, co
     #         return None
     logger.info(f"Review file {filename}")
     file_content = await github.get_file_content(repo_name, filename, commit_sha, client)
-    review_result = await review.do_ai_review(filename, commit_message, file_status, file_content, file_patch, repo_name)
+    review_result = await review.do_ai_review(filename, commit_message, file_status, file_content, file_patch, repo_name,
+                                              context)
     return translate.wrap_magic(review_result)
 
 
+async def review_files(files: List[dict], repo_name: str, commit_message: str, commit_sha: str,
+                       client: httpx.AsyncClient) -> AsyncIterator[Tuple[dict, str | None]]:
+    """
+    并发审查多个文件, 并发数由settings.get_review_concurrency控制, 每次模型调用仍然经过api limiter
+    结果按文件原始顺序依次返回, 保证评论的提交顺序稳定
+    """
+    contexts = await get_review_contexts(repo_name, files)
+    semaphore = asyncio.Semaphore(settings.get_review_concurrency())
+
+    async def review_with_limit(file: dict) -> str | None:
+        async with semaphore:
+            return await review_file(file, repo_name, commit_message, commit_sha, client,
+                                     contexts.get(file['filename']))
+
+    tasks = [asyncio.create_task(review_with_limit(file)) for file in files]
+    try:
+        for file, task in zip(files, tasks):
+            yield file, await task
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+        # 等待取消完成, 释放正在进行的模型调用和限流额度, 同时取走未被消费的任务异常
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
 async def review_commit(repo_name, commit_sha):
     logger.info(f"Review commit {commit_sha} in {repo_name}")
-    async with httpx.AsyncClient() as client:
+    async with github.github_client() as client:
         commit_data = await github.get_commit(repo_name, commit_sha, client)
         logger.info(f"Get commit data: {commit_data}")
         commit_message = commit_data['commit']['message']
-        for file in commit_data['files']:
-            review_result = await review_file(file, repo_name, commit_message, commit_sha, client)
+        async for file, review_result in review_files(commit_data['files'], repo_name, commit_message, commit_sha,
+                                                      client):
             if not review_result:
                 continue
             # 提交评论
@@ -198,12 +242,11 @@ async def review_commit(repo_name, commit_sha):
 
 async def review_pull_request(repo_name, pr_number, commit_sha, commit_message):
     logger.info(f"Review pull request {pr_number} in {repo_name}")
-    async with httpx.AsyncClient() as client:
+    async with github.github_client() as client:
         # 获取PR文件
         files = await github.get_pr_files(repo_name, pr_number, client)
         logger.info(f"Get PR files: {files}")
-        for file in files:
-            review_result = await review_file(file, repo_name, commit_message, commit_sha, client)
+        async for file, review_result in review_files(files, repo_name, commit_message, commit_sha, client):
             if not review_result:
                 continue
             # 提交评论
@@ -8,48 +8,112 @@
 
 __author__ = 'alex'
 
+import asyncio
 import hashlib
-from typing import List
+import os
+import time
+from typing import List, Callable, Awaitable, Tuple, AsyncIterator
 
 from core import translate, models, settings
 from core.exception import GithubGraphQLException
 from core.log import logger
-from core.models import BaseDetail, Comment, Label
+from core.models import BaseDetail, Comment, Label, Review
 from core.utils import github
 from core.utils.github import RepoDetail
 
 
-async def update_issue_comment(comment: Comment, translated_body: str, original_body: str):
-    try:
-        await github.update_issue_comment(comment.id,
-                                          translate.wrap_magic(translated_body, original_body=original_body))
-        logger.info("Updated ok")
-    except GithubGraphQLException as e:
-        if e.is_forbidden():
-            logger.error(f"Warning!!! Ignore update comment {comment.id} failed, forbidden, {e.errors}")
-        else:
-            logger.exception(f"update_issue_comment failed, {e}")
-            raise e
+_translation_semaphore: Tuple[asyncio.AbstractEventLoop, asyncio.Semaphore] | None = None
 
 
-async def trans_comments(comments: List[Comment]) -> bool:
-    has_translated_by_gpt = False
-    for index, detail in enumerate(comments):
-        logger.info(f"===============Comment(#{index + 1})===============\n")
-        if translate.TRANS_MAGIC in detail.body:
-            has_translated_by_gpt = True
-            logger.info("Already translated, skip")
-            continue
-        logger.info("Translating...")
+def get_translation_semaphore() -> asyncio.Semaphore:
+    """
+    全局共享的评论翻译并发限制, 与当前事件循环绑定
+    """
+    global _translation_semaphore
+    loop = asyncio.get_running_loop()
+    if _translation_semaphore is None or _translation_semaphore[0] is not loop:
+        _translation_semaphore = (loop, asyncio.Semaphore(settings.get_translation_concurrency()))
+    return _translation_semaphore[1]
+
+
+def make_comment_updater(update_func: Callable[[str, str], Awaitable]):
+    """
+    生成评论的更新函数, 没有权限更新时忽略
+    """
+    async def update(comment_id: str, translated_body: str, original_body: str):
+        try:
+            await update_func(comment_id, translate.wrap_magic(translated_body, original_body=original_body))
+            logger.info(f"Updated {comment_id} ok")
+        except GithubGraphQLException as e:
+            if e.is_forbidden():
+                logger.error(f"Warning!!! Ignore update comment {comment_id} failed, forbidden, {e.errors}")
+            else:
+                logger.exception(f"update comment {comment_id} failed, {e}")
+                raise e
+
+    return update
+
+
+async def translate_and_update(title: str, comment_id: str, body: str,
+                               update: Callable[[str, str, str], Awaitable], check_english: bool = True) -> bool:
+    """
+    翻译单条评论并更新, 返回该评论是否已经被翻译过
+    """
+    if translate.TRANS_MAGIC in body:
+        logger.info(f"{title}: Already translated, skip")
+        return True
+    if check_english and translate.already_english(body):
+        logger.info(f"{title}: Body is already english, skip")
+        return False
+    async with get_translation_semaphore():
+        logger.info(f"{title}: Translating...")
         translator = translate.get_translator(settings.get_translator(),
                                               max_tokens=settings.TRANSLATION_MODEL.max_input_tokens)
-        translated_body, has_translated_by_gpt, real_translated = await translator.translate(detail.body)
+        translated_body, has_translated_by_gpt, real_translated = await translator.translate(body)
         if real_translated:
-            logger.info(f"Translated Body")
-            await update_issue_comment(detail, translated_body, detail.body)
+            logger.info(f"{title}: New Body:\n{translated_body}\n")
+            await update(comment_id, translated_body, body)
     return has_translated_by_gpt
 
 
+async def run_translation_tasks(pages: AsyncIterator[List[Tuple[str, str, str, Callable, bool]]]) -> bool:
+    """
+    并发翻译和更新多条评论, 每拿到一页任务就立即开始翻译, 后续页面在翻译的同时继续加载
+    并发数受全局并发限制, 每次模型调用仍然经过api limiter
+    所有任务结束后汇总has_translated_by_gpt, 如果有失败的任务或分页加载失败, 抛出第一个异常
+    """
+    futures = []
+    fetch_error = None
+    try:
+        async for tasks in pages:
+            futures.extend(asyncio.ensure_future(translate_and_update(*task)) for task in tasks)
+    except Exception as e:
+        logger.exception(f"Load comments failed, {e}")
+        fetch_error = e
+    results = await asyncio.gather(*futures, return_exceptions=True)
+    if fetch_error is not None:
+        raise fetch_error
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return any(results)
+
+
+async def trans_comments(pages: AsyncIterator[List[Comment]]) -> bool:
+    update = make_comment_updater(github.update_issue_comment)
+
+    async def iter_tasks():
+        index = 0
+        async for comments in pages:
+            tasks = []
+            for detail in comments:
+                index += 1
+                tasks.append((f"Comment(#{index}) {detail.id}", detail.id, detail.body, update, False))
+            yield tasks
+
+    return await run_translation_tasks(iter_tasks())
+
+
 async def update_detail(detail_type: str, detail_id: str, translated_title: str, translated_body: str,
                         original_title: str, original_body: str):
     if not translated_title and not translated_body:
@@ -84,13 +148,14 @@ async def update_detail(detail_type: str, detail_id: str, translated_title: str,
             raise e
 
 
-async def trans_comments_by_type(detail: BaseDetail) -> bool:
+async def trans_comments_by_type(detail: BaseDetail, repo_detail: RepoDetail) -> bool:
     if detail.model_type_text == models.DETAIL_TYPE_ISSUE:
-        return await trans_comments(detail.comments)
+        return await trans_comments(github.iter_issue_comments(repo_detail, detail))
     elif detail.model_type_text == models.DETAIL_TYPE_DISCUSSION:
-        return await trans_discussion_comments(detail.comments)
+        return await trans_discussion_comments(github.iter_discussion_comments(repo_detail, detail))
     elif detail.model_type_text == models.DETAIL_TYPE_PR:
-        return await trans_pr_comments(detail.comments, detail.reviews)
+        return await trans_pr_comments(github.iter_pullrequest_comments(repo_detail, detail),
+                                       github.iter_pullrequest_reviews(repo_detail, detail))
 
 
 async def trans_detail(detail: BaseDetail, repo_detail: RepoDetail):
@@ -137,7 +202,7 @@ async def trans_detail(detail: BaseDetail, repo_detail: RepoDetail):
     else:
         await update_detail(detail.model_type_text, detail.id, translated_title, translated_body,
                             detail.title, detail.body)
-    comment_has_translated_by_gpt = await trans_comments_by_type(detail)
+    comment_has_translated_by_gpt = await trans_comments_by_type(detail, repo_detail)
     translated_by_gpt = comment_has_translated_by_gpt or issue_has_translated_by_gpt
     if translated_by_gpt or has_gpt_label:
         logger.info("Label is already set, skip")
@@ -166,7 +231,7 @@ async def add_label(detail_id: str, repo_detail: RepoDetail, label: Label):
 async def trans_issues(issues_url):
     """
     :param issues_url:
-    :return:
+    :return: 是否成功, 查询失败时返回False, 翻译过程中的异常直接抛出
     """
     logger.info(f"run with issues: {issues_url}, use ai model: {settings.TRANSLATION_MODEL.model_name}")
     repo_detail = github.parse_issue_url(issues_url)
@@ -176,81 +241,34 @@ async def trans_issues(issues_url):
         logger.exception(f"query_issue failed, {e}")
         return False
     await trans_detail(issues_detail, repo_detail)
+    return True
 
 
-async def trans_discussion_comments(comments: List[Comment]) -> bool:
-    has_translated_by_gpt = False
-    for index, detail in enumerate(comments):
-        c_id = detail["id"]
-        c_author = detail["author"]["login"]
-        c_replies = detail["replies"]['totalCount']
-        c_url = detail["url"]
-        c_body = detail["body"]
-        logger.info("")
-        log_list = [f"===============Comment(#{index + 1})===============",
-                    f"ID: {c_id}",
-                    f"Author: {c_author}",
-                    f"Replies: {c_replies}",
-                    f"URL: {c_url}",
-                    f"Body:\n{c_body}\n"]
-        logger.info("\n".join(log_list))
-        if translate.TRANS_MAGIC in c_body:
-            has_translated_by_gpt = True
-            logger.info("Already translated, skip")
-        elif translate.already_english(c_body):
-            logger.info("Body is already english, skip")
-        else:
-            logger.info("Translating...")
-            translator = translate.get_translator(settings.get_translator(),
-                                                  max_tokens=settings.TRANSLATION_MODEL.max_input_tokens)
-            translated_body, has_translated_by_gpt, real_translated = await translator.translate(c_body)
-            if real_translated:
-                logger.info(f"New Body:\n{translated_body}\n")
-                try:
-                    await github.update_discussion_comment(c_id,
-                                                           translate.wrap_magic(translated_body, original_body=c_body))
-                    logger.info("Updated ok")
-                except GithubGraphQLException as e:
-                    if e.is_forbidden():
-                        logger.error(f"Warning!!! Ignore update comment {c_id} failed, forbidden, {e.errors}")
-                    else:
-                        logger.exception(f"update_discussion_comment failed, {e}")
-                        raise e
-        for position, reply_obj in enumerate(detail["replies"]["nodes"]):
-            reply_id = reply_obj["id"]
-            reply_author = reply_obj["author"]["login"]
-            reply_url = reply_obj["url"]
-            reply_body = reply_obj["body"]
-            logger.info(f"---------------Reply(#{position + 1})---------------")
-            logger.info(f"ID: {reply_id}")
-            logger.info(f"Author: {reply_author}")
-            logger.info(f"URL: {reply_url}")
-            logger.info(f"Body:\n{reply_body}\n")
-
-            if translate.TRANS_MAGIC in reply_body:
-                has_translated_by_gpt = True
-                logger.info("Already translated, skip")
-            elif translate.already_english(reply_body):
-                logger.info("Body is already english, skip")
-            else:
-                logger.info("Translating...")
-                translator = translate.get_translator(settings.get_translator(),
-                                                      max_tokens=settings.TRANSLATION_MODEL.max_input_tokens)
-                reply_body_trans, has_translated_by_gpt, real_translated = translator.translate(reply_body)
-                if real_translated:
-                    logger.info(f"New Body:\n{reply_body_trans}\n")
-                    await github.update_discussion_comment(reply_id,
-                                                           translate.wrap_magic(reply_body_trans,
-                                                                                original_body=reply_body))
-                    logger.info("Updated ok")
-    return has_translated_by_gpt
+async def trans_discussion_comments(pages: AsyncIterator[List[Comment]]) -> bool:
+    update = make_comment_updater(github.update_discussion_comment)
+
+    async def iter_tasks():
+        index = 0
+        async for comments in pages:
+            tasks = []
+            for detail in comments:
+                index += 1
+                logger.info(f"Comment(#{index}) ID: {detail.id}, Author: {detail.get_author()}, "
+                            f"Replies: {len(detail.replies)}, URL: {detail.url}")
+                tasks.append((f"Comment(#{index}) {detail.id}", detail.id, detail.body, update, True))
+                for position, reply_obj in enumerate(detail.replies):
+                    tasks.append((f"Comment(#{index}) Reply(#{position + 1}) {reply_obj.id}", reply_obj.id,
+                                  reply_obj.body, update, True))
+            yield tasks
+
+    return await run_translation_tasks(iter_tasks())
 
 
 async def trans_discussion(discussion_url):
     """
     Translate discussion
     :param discussion_url:
-    :return:
+    :return: 是否成功, 查询失败时返回False, 翻译过程中的异常直接抛出
     """
     logger.info(f"run with discussion: {discussion_url}, use ai model: {settings.TRANSLATION_MODEL.model_name}")
     repo_detail = github.parse_discussion_url(discussion_url)
@@ -260,102 +278,45 @@ async def trans_discussion(discussion_url):
         logger.exception(f"query_issue failed, {e}")
         return False
     await trans_detail(discussion_detail, repo_detail)
-
-
-async def trans_pr_comments(comments, reviews):
-    has_translated_by_gpt = False
-    for index, detail in enumerate(comments):
-        c_id = detail["id"]
-        c_url = detail["url"]
-        c_body = detail["body"]
-        logger.info("")
-        logger.info(f"===============Comment(#{index + 1})===============")
-        logger.info(f"ID: {c_id}")
-        logger.info(f"URL: {c_url}")
-        logger.info(f"Body:\n{c_body}\n")
-
-        if translate.TRANS_MAGIC in c_body:
-            has_translated_by_gpt = True
-            logger.info("Already translated, skip")
-        elif translate.already_english(c_body):
-            logger.info("Body is already english, skip")
-        else:
-            logger.info("Translating...")
-            translator = translate.get_translator(settings.get_translator(),
-                                                  max_tokens=settings.TRANSLATION_MODEL.max_input_tokens)
-            c_body_trans, has_translated_by_gpt, real_translated = await translator.translate(c_body)
-            if real_translated:
-                logger.info(f"New Body:\n{c_body_trans}\n")
-                try:
-                    await github.update_issue_comment(c_id,
-                                                      translate.wrap_magic(c_body_trans, original_body=c_body))
-                    logger.info("Updated ok")
-                except GithubGraphQLException as e:
-                    if e.is_forbidden():
-                        logger.error(f"Warning!!! Ignore update comment {c_id} failed, forbidden, {e.errors}")
-                    else:
-                        logger.exception(f"update_issue_comment failed, {e}")
-                        raise e
-        for position, review_obj in enumerate(reviews):
-            c_id = review_obj["id"]
-            c_comments = review_obj["comments"]['totalCount']
-            c_url = review_obj["url"]
-            c_body = review_obj["body"]
-            logger.info(f"===============Review(#{index + 1})===============")
-            logger.info(f"ID: {c_id}")
-            logger.info(f"Comments: {c_comments}")
-            logger.info(f"URL: {c_url}")
-            logger.info(f"Body:\n{c_body}\n")
-
-            if translate.TRANS_MAGIC in c_body:
-                has_translated_by_gpt = True
-                logger.info("Already translated, skip")
-            elif translate.already_english(c_body):
-                logger.info("Body is already english, skip")
-            else:
-                logger.info("Translating...")
-                translator = translate.get_translator(settings.get_translator(),
-                                                      max_tokens=settings.TRANSLATION_MODEL.max_input_tokens)
-                c_body_trans, has_translated_by_gpt, real_translated = await translator.translate(c_body)
-                if real_translated:
-                    logger.info(f"New Body:\n{c_body_trans}\n")
-                    await github.update_pullrequest_review(c_id,
-                                                           translate.wrap_magic(c_body_trans, original_body=c_body))
-                    logger.info("Updated ok")
-
-            for reply_position, review_reply_obj in enumerate(review_obj["comments"]["nodes"]):
-                reply_id = review_reply_obj["id"]
-                reply_url = review_reply_obj["url"]
-                reply_body = review_reply_obj["body"]
-                logger.info(f"---------------ReviewComment(#{reply_position + 1})---------------")
-                logger.info(f"ID: {reply_id}")
-                logger.info(f"URL: {reply_url}")
-                logger.info(f"Body:\n{reply_body}\n")
-
-                if translate.TRANS_MAGIC in reply_body:
-                    has_translated_by_gpt = True
-                    print("Already translated, skip")
-                elif translate.already_english(reply_body):
-                    print("Body is already english, skip")
-                else:
-                    logger.info("Translating...")
-                    translator = translate.get_translator(settings.get_translator(),
-                                                          max_tokens=settings.TRANSLATION_MODEL.max_input_tokens)
-                    reply_body_trans, has_translated_by_gpt, real_translated = await translator.translate(reply_body)
-                    if real_translated:
-                        logger.info(f"New Body:\n{reply_body_trans}\n")
-                        await github.update_pullrequest_review_comment(reply_id,
-                                                                       translate.wrap_magic(reply_body_trans,
-                                                                                            original_body=reply_body))
-                        logger.info("Updated ok")
-    return has_translated_by_gpt
+    return True
+
+
+async def trans_pr_comments(comment_pages: AsyncIterator[List[Comment]],
+                            review_pages: AsyncIterator[List[Review]]) -> bool:
+    update_comment = make_comment_updater(github.update_issue_comment)
+    update_review = make_comment_updater(github.update_pullrequest_review)
+    update_review_comment = make_comment_updater(github.update_pullrequest_review_comment)
+
+    async def iter_tasks():
+        index = 0
+        async for comments in comment_pages:
+            tasks = []
+            for detail in comments:
+                index += 1
+                tasks.append((f"Comment(#{index}) {detail.id}", detail.id, detail.body, update_comment, True))
+            yield tasks
+        position = 0
+        async for reviews in review_pages:
+            tasks = []
+            for review_obj in reviews:
+                position += 1
+                logger.info(f"Review(#{position}) ID: {review_obj.id}, "
+                            f"Comments: {len(review_obj.comments)}, URL: {review_obj.url}")
+                tasks.append((f"Review(#{position}) {review_obj.id}", review_obj.id, review_obj.body,
+                              update_review, True))
+                for reply_position, review_reply_obj in enumerate(review_obj.comments):
+                    tasks.append((f"Review(#{position}) ReviewComment(#{reply_position + 1}) {review_reply_obj.id}",
+                                  review_reply_obj.id, review_reply_obj.body, update_review_comment, True))
+            yield tasks
+
+    return await run_translation_tasks(iter_tasks())
 
 
 async def trans_pr(pr_url):
     """
     Translate pull request
     :param pr_url:
-    :return:
+    :return: 是否成功, 查询失败时返回False, 翻译过程中的异常直接抛出
     """
     logger.info(f"run with pull request: {pr_url}, use ai model: {settings.TRANSLATION_MODEL.model_name}")
     repo_detail = github.parse_pullrequest_url(pr_url)
@@ -365,55 +326,171 @@ async def trans_pr(pr_url):
         logger.exception(f"query_issue failed, {e}")
         return False
     await trans_detail(pr_detail, repo_detail)
+    return True
+
 
+class BatchCheckpoint:
+    """
+    批量翻译的进度文件, 每完成一个对象追加一行ID, 中断后再次运行时跳过
+    启动时加载到集合中, 只有存在重复或中断时写了一半的行时才重写一次
+    """
 
-async def batch_trans(input_url, query_filter, query_limit):
+    def __init__(self, repository: RepoDetail, query_filter: str):
+        filter_hash = hashlib.md5(query_filter.encode()).hexdigest()[:8]
+        self.path = os.path.join(settings.BASE_PATH, './data/.cache/batch_trans',
+                                 f"{repository.owner}_{repository.name}_{filter_hash}.log")
+        self.done = set()
+        self.file = None
+        if os.path.exists(self.path):
+            self.load()
+
+    def load(self):
+        lines = 0
+        need_compact = False
+        with open(self.path, 'r') as f:
+            for line in f:
+                if not line.endswith("\n"):
+                    # 中断时写了一半的行
+                    need_compact = True
+                    continue
+                item_id = line.strip()
+                if item_id:
+                    self.done.add(item_id)
+                    lines += 1
+        if need_compact or lines != len(self.done):
+            self.compact()
+
+    def is_done(self, item_id: str) -> bool:
+        return item_id in self.done
+
+    def mark_done(self, item_id: str):
+        if item_id in self.done:
+            return
+        self.done.add(item_id)
+        if self.file is None:
+            if not os.path.exists(os.path.dirname(self.path)):
+                os.makedirs(os.path.dirname(self.path))
+            self.file = open(self.path, 'a')
+        self.file.write(f"{item_id}\n")
+        self.file.flush()
+
+    def compact(self):
+        # 先写临时文件再替换, 避免中断时进度文件损坏
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.writelines(f"{item_id}\n" for item_id in sorted(self.done))
+        os.replace(tmp_path, self.path)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def get_llm_call_count() -> int:
+    limiter = settings.get_translation_api_limiter()
+    if limiter is None:
+        return 0
+    stats = limiter.get_stats()
+    return stats["requests"]["total_requests"] if "requests" in stats else stats["total_requests"]
+
+
+async def batch_trans(input_url, query_filter, query_limit, workers: int = 4):
+    """
+    批量翻译仓库中的issue/pr/discussion
+    :param input_url:
+    :param query_filter:
+    :param query_limit: 最多翻译的数量, 0表示不限制
+    :param workers: 同时翻译的对象数量
+    :return:
+    """
     if 'is:' not in query_filter:
         query_filter = f"is:{query_filter}"
     logs = []
     logs.append(f"repository: {input_url}")
     logs.append(f"query_filter: {query_filter}")
     logs.append(f"query_limit: {query_limit}")
+    logs.append(f"workers: {workers}")
     logger.info(f"run with {', '.join(logs)}, use ai model: {settings.TRANSLATION_MODEL.model_name}")
 
-    if query_limit <= 0 or query_limit > 100:
-        logger.error("query_limit should be in [1, 100]")
+    if query_limit < 0:
+        logger.error("query_limit should be >= 0")
+        return
+    if workers < 1:
+        logger.error("workers should be >= 1")
+        return
+    if 'issue' in query_filter:
+        trans_func = trans_issues
+    elif 'pr' in query_filter or 'pullrequest' in query_filter:
+        trans_func = trans_pr
+    elif 'discussion' in query_filter:
+        trans_func = trans_discussion
+    else:
+        logger.error("query_filter should be in [issue, pr, discussion]")
         return
 
     repository = github.parse_repository_url(input_url)
-    query_results = await github.search_issues(
-        repository.owner,
-        repository.name,
-        query_filter,
-        "",
-        [f"-label:{github.LABEL_TRANS.name}", f"-label:{github.LABEL_ENGLISH_NATIVE.name}"],
-        query_limit,
-    )
-
-    comments = 0
-    for issue in query_results:
-        comments += issue["comments"]["totalCount"]
-    logger.info(f"Start to translate {len(query_results)} objects, {comments} comments.")
-
-    for index, issue in enumerate(query_results):
+    checkpoint = BatchCheckpoint(repository, query_filter)
+    if checkpoint.done:
+        logger.info(f"Resume from checkpoint {checkpoint.path}, {len(checkpoint.done)} objects already translated")
+    queue = asyncio.Queue(maxsize=workers * 2)
+    stats = {"queued": 0, "skipped": 0, "translated": 0, "failed": 0, "comments": 0}
+
+    skip_labels = {github.LABEL_TRANS.name, github.LABEL_ENGLISH_NATIVE.name}
+
+    async def produce():
+        seen = set()
         try:
-            logger.info("\n\n\n\n\n\n")
-            logger.info(f"===============Object(#{index + 1})===============")
-            logger.info(f"ID: {issue['id']}")
-            logger.info(f"Title: {issue['title']}")
-            logger.info(f"URL: {issue['url']}")
-            if 'issue' in query_filter:
-                await trans_issues(issue["url"])
-            elif 'pr' in query_filter or 'pullrequest' in query_filter:
-                await trans_pr(issue["url"])
-            elif 'discussion' in query_filter:
-                await trans_discussion(issue["url"])
-            else:
-                logger.error("query_filter should be in [issue, pr, discussion]")
-                return
+            # 翻译后会添加标签, 标签不能作为搜索条件, 否则结果集在遍历期间变化, 基于偏移的游标会跳过未翻译的对象
+            async for nodes in github.iter_search_all_issues(repository.owner, repository.name, query_filter, []):
+                for issue in nodes:
+                    if not issue or issue['id'] in seen or checkpoint.is_done(issue['id']):
+                        continue
+                    seen.add(issue['id'])
+                    labels = {label['name'] for label in issue.get('labels', {}).get('nodes', [])}
+                    if labels & skip_labels:
+                        stats["skipped"] += 1
+                        continue
+                    await queue.put(issue)
+                    stats["queued"] += 1
+                    stats["comments"] += issue["comments"]["totalCount"]
+                    if query_limit and stats["queued"] >= query_limit:
+                        return
         except Exception as e:
-            logger.exception(f"Translate failed, {e}")
-            continue
+            logger.exception(f"Search {query_filter} failed, {e}")
+        finally:
+            for _ in range(workers):
+                await queue.put(None)
+
+    async def work():
+        while True:
+            issue = await queue.get()
+            if issue is None:
+                break
+            index = stats["translated"] + stats["failed"] + 1
+            try:
+                logger.info(f"===============Object(#{index}) ID: {issue['id']}, Title: {issue['title']}, "
+                            f"URL: {issue['url']}===============")
+                if not await trans_func(issue["url"]):
+                    stats["failed"] += 1
+                    continue
+                checkpoint.mark_done(issue['id'])
+                stats["translated"] += 1
+            except Exception as e:
+                stats["failed"] += 1
+                logger.exception(f"Translate {issue['url']} failed, {e}")
+
+    start_time = time.monotonic()
+    start_llm_calls = get_llm_call_count()
+    try:
+        await asyncio.gather(produce(), *[work() for _ in range(workers)])
+    finally:
+        checkpoint.close()
+    minutes = max(time.monotonic() - start_time, 1e-6) / 60
+    llm_calls = get_llm_call_count() - start_llm_calls
+    logger.info(f"Batch translation completed, {stats['translated']} objects translated, {stats['failed']} failed, "
+                f"{stats['skipped']} already labeled, {stats['comments']} comments, {minutes:.2f} minutes, "
+                f"{stats['translated'] / minutes:.2f} objects/min, {llm_calls / minutes:.2f} LLM calls/min")
 
 
 async def translate_text(text):
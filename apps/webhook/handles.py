@@ -5,6 +5,7 @@
 #  LICENSE file in the root of the source tree. All contributing project authors
 #  may be found in the AUTHORS file in the root of the source tree.
 #
+import asyncio
 from typing import List, Dict
 
 import httpx
@@ -12,20 +13,31 @@ from sanic.log import logger
 
 from apps import trans, review
 from core import translate, settings
+from core.analyze import remote, scheduler
 from core.analyze.base import CodeAnalyzer
+from core.db.webhook_journal import WebhookJournal
 from core.exception import GithubGraphQLException
 from core.translate.utils import CODE_COMMENTS_SUFFIX
 from core.utils import github
 
 TRANSLATE_BRANCH_PREFIX = "translate-comments-"
 
+_journal: WebhookJournal | None = None
+
+
+def get_webhook_journal() -> WebhookJournal:
+    global _journal
+    if _journal is None:
+        _journal = WebhookJournal(settings.get_webhook_journal_path())
+    return _journal
+
 
 async def handle_merged_pr(repo_name, pr_number):
     # 检查是否已经 fork 了仓库
     if not settings.get_github_username():
         logger.info(f"No github username, skip")
         return
-    async with httpx.AsyncClient(follow_redirects=True, timeout=30) as client:
+    async with github.github_client() as client:
         # 获取PR文件
         pr_files = await github.get_pr_files(repo_name, pr_number, client)
         logger.info(f"Get PR files: {pr_files}")
@@ -358,7 +370,7 @@ async def commit_handler(payload, event, delivery, headers):
             logger.exception(f"Thread: {delivery}: Error!!! Create Commit comment {url} failed, {e}")
     else:
         logger.info(f"Thread: {delivery}: No need to translate")
-    async with httpx.AsyncClient(follow_redirects=True, timeout=30) as client:
+    async with github.github_client() as client:
         try:
             repo_detail = await github.get_repo_detail(repo_name, client)
             base_branch = repo_detail['default_branch']
@@ -369,14 +381,17 @@ async def commit_handler(payload, event, delivery, headers):
             if branch == base_branch:
                 try:
                     if CodeAnalyzer.can_use(repo_name):
-                        logger.info(f"Thread: {delivery}: Start to analyze code")
-                        analyzer = CodeAnalyzer(repo_name, settings.get_milvus_uri())
-                        await analyzer.check_git_changes()
+                        # 在后台合并短时间内的多次push, 审查不等待索引更新
+                        logger.info(f"Thread: {delivery}: Schedule to reindex code")
+                        if settings.INDEX_SERVICE_ENABLED:
+                            await remote.call_index_service("schedule_reindex", timeout=30, repo_name=repo_name)
+                        else:
+                            scheduler.get_reindex_scheduler().schedule(repo_name)
                     else:
                         logger.info(
                             f"Thread: {delivery}: No need to analyze code, because you should make full index first")
                 except Exception as e:
-                    logger.exception(f"Thread: {delivery}: Error!!! Init analyzer failed, {e}")
+                    logger.exception(f"Thread: {delivery}: Error!!! Schedule reindex failed, {e}")
         except Exception as e:
             logger.exception(f"Thread: {delivery}: Error!!! Get repo detail failed, {e}")
     if not settings.REVIEW_MODEL.api_key:
@@ -416,3 +431,37 @@ async def handle_github_request(data, event, delivery, headers):
         logger.info(f"Thread: {delivery}: Ignore event {event}")
 
     logger.info(f"Thread: {delivery}: Done")
+
+
+async def handle_journaled_request(data, event, delivery, headers):
+    """
+    处理事件并在事件日志中记录处理状态
+    """
+    journal = get_webhook_journal()
+    journal.mark_running(delivery)
+    try:
+        await handle_github_request(data, event, delivery, headers)
+    except asyncio.CancelledError:
+        # 进程停止时被中断的事件保持running状态, 下次启动时重放
+        raise
+    except Exception as e:
+        journal.mark_failed(delivery, str(e))
+        raise e
+    journal.mark_done(delivery)
+
+
+async def replay_events(delivery_ids: List[str]):
+    """
+    按delivery id重新处理事件日志中的事件
+    """
+    journal = get_webhook_journal()
+    for delivery in delivery_ids:
+        entry = journal.get(delivery)
+        if entry is None:
+            logger.error(f"Webhook event {delivery} not found")
+            continue
+        logger.info(f"Replay {entry['event']} {delivery} of {entry['repo_key']}, status {entry['status']}")
+        try:
+            await handle_journaled_request(entry["payload"], entry["event"], delivery, entry["headers"])
+        except Exception as e:
+            logger.exception(f"Replay {delivery} failed, {e}")
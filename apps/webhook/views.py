@@ -6,16 +6,59 @@
 #  may be found in the AUTHORS file in the root of the source tree.
 #
 
+import asyncio
+from typing import List, Dict, Any
+
 from sanic import Sanic, response, Request
 from sanic.response import empty
 from apps.webhook import handles
 from core import settings
+from core.analyze import remote, warmup
 from core.log import logger
 from core.utils import github
+from core.utils.job_queue import JobQueue, Job, ENQUEUE_ACCEPTED
 
 app_instance = Sanic.get_app()
 
 
+async def handle_job(job: Job):
+    data, event, headers = job.payload
+    await handles.handle_journaled_request(data, event, job.job_id, headers)
+
+
+@app_instance.before_server_start
+async def start_job_queue(app: Sanic, _):
+    app.ctx.job_queue = JobQueue(handle_job, settings.get_webhook_queue_workers(),
+                                 settings.get_webhook_queue_size(), name="webhook")
+    app.ctx.job_queue.start()
+    # 重放上次停止时没有处理完的事件
+    journal = handles.get_webhook_journal()
+    journal.prune()
+    entries = journal.claim_unfinished()
+    if entries:
+        logger.info(f"Replay {len(entries)} unfinished webhook events")
+        app.add_task(replay_unfinished(app.ctx.job_queue, entries))
+
+
+async def replay_unfinished(job_queue: JobQueue, entries: List[Dict[str, Any]]):
+    """
+    将认领的事件按顺序放入队列, 队列满时等待空闲, 不丢弃任何事件
+    """
+    for entry in entries:
+        while job_queue.is_full():
+            await asyncio.sleep(1)
+        result = job_queue.put(Job(entry["delivery_id"], entry["repo_key"],
+                                   (entry["payload"], entry["event"], entry["headers"])))
+        if result != ENQUEUE_ACCEPTED:
+            logger.warning(f"{entry['delivery_id']}: replay {result}")
+
+
+@app_instance.before_server_stop
+async def stop_job_queue(app: Sanic, _):
+    await app.ctx.job_queue.stop()
+    handles.get_webhook_journal().close()
+
+
 @app_instance.post("/api/v1/hooks")
 async def github_hook(request: Request):
     secret_key = settings.get_secret_key()
@@ -38,8 +81,43 @@ async def github_hook(request: Request):
     logger.info(f"{request_delivery}: Get event={request_event}, hook={hook}, headers={request.headers}")
 
     if request_event in github.ALLOWED_EVENTS:
-        logger.info(f"{request_delivery}: handle {request_event}")
-        _ = app_instance.add_task(handles.handle_github_request(data, request_event, request_delivery, request.headers))
+        job_queue: JobQueue = request.app.ctx.job_queue
+        if job_queue.is_duplicate(request_delivery):
+            logger.info(f"{request_delivery}: duplicated, skip")
+            return empty(status=200)
+        if job_queue.is_full():
+            logger.warning(f"{request_delivery}: too many pending events({job_queue.size}), reject")
+            return response.json({"message": "too many pending events, retry later"}, status=503)
+        # 同一个仓库的事件按顺序处理, 没有仓库信息的事件单独处理
+        key = data['repository']['full_name'] if data.get('repository') else request_delivery
+        headers = dict(request.headers)
+        # 先写入事件日志再返回200, 进程重启后可以重放
+        if not handles.get_webhook_journal().record(request_delivery, request_event, key, data, headers):
+            logger.info(f"{request_delivery}: already in journal, skip")
+            return empty(status=200)
+        job_queue.put(Job(request_delivery, key, (data, request_event, headers)))
+        logger.info(f"{request_delivery}: queued, depth {job_queue.size}")
     else:
         logger.info(f"{request_delivery}: Ignore event {request_event}")
     return empty(status=200)
+
+
+@app_instance.get("/api/v1/hooks/stats")
+async def github_hook_stats(request: Request):
+    return response.json(request.app.ctx.job_queue.get_stats())
+
+
+@app_instance.get("/api/v1/health")
+async def health(request: Request):
+    """
+    就绪检查, 开启EMBEDDING_PRELOAD时, 向量模型和索引预热完成前返回503
+    """
+    if settings.INDEX_SERVICE_ENABLED:
+        try:
+            status = await remote.call_index_service("status", timeout=5)
+        except Exception as e:
+            status = {"ready": False, "error": str(e)}
+    else:
+        status = warmup.get_status()
+    status["queue_depth"] = request.app.ctx.job_queue.size
+    return response.json(status, status=200 if status["ready"] else 503)
@@ -15,10 +15,12 @@ __author__ = 'alex'
 import asyncio
 import glob
 import json
+import multiprocessing
 import os
 import re
 import shutil
-from typing import List, Dict, Any, Optional
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple
 
 import git
 from pymilvus import DataType, MilvusClient, FieldSchema, CollectionSchema, MilvusException
@@ -39,7 +41,57 @@ from core.utils import strings
 from core.utils.github import parse_repository_url
 
 embedding_model = EmbeddingModel()
-milvus_manager = MilvusManager(settings.get_milvus_uri(), "")
+milvus_manager = MilvusManager(settings.get_milvus_uri(), "", settings.get_milvus_flush_rows(),
+                               settings.get_milvus_flush_bytes())
+
+# 解析进程中使用的分析器, 由init_analyze_worker在每个进程中单独创建(clang的Index无法跨进程传递)
+_worker_analyzers: Dict[str, Any] = {}
+_worker_source_path = ""
+
+
+def create_analyzers(project_source_path: str) -> Dict[str, Any]:
+    return {
+        'python': PythonAnalyzer(project_source_path),
+        'cpp': CppAnalyzer(project_source_path),
+        'c': CppAnalyzer(project_source_path)  # We can use the same analyzer for C and C++
+    }
+
+
+def make_file_detail(analyzers: Dict[str, Any], project_source_path: str,
+                     file_path: str, content: str) -> FileDetails | None:
+    file_name_for_index = os.path.relpath(file_path, project_source_path)
+    code_hash = strings.get_content_hash(content)
+    language = utils.get_support_file_language(file_path)
+    analyzer = analyzers.get(language)
+    if not analyzer:
+        return None
+    code_elements = analyzer.extract_code_elements(file_path, content)
+    dependencies = analyzer.analyze_dependencies(file_path, content)
+    file_detail = index.FileDetails(
+        file_name=file_name_for_index,
+        code_hash=code_hash,
+        language=language,
+        file_path=file_path,
+        dependencies=dependencies,
+        code_elements=code_elements
+    )
+    return file_detail
+
+
+def load_file_detail(analyzers: Dict[str, Any], project_source_path: str, file_path: str) -> FileDetails | None:
+    with open(file_path, 'r', encoding='utf-8') as file:
+        content = file.read()
+    return make_file_detail(analyzers, project_source_path, file_path, content)
+
+
+def init_analyze_worker(project_source_path: str):
+    global _worker_analyzers, _worker_source_path
+    _worker_source_path = project_source_path
+    _worker_analyzers = create_analyzers(project_source_path)
+
+
+def analyze_file_in_worker(file_path: str) -> FileDetails | None:
+    return load_file_detail(_worker_analyzers, _worker_source_path, file_path)
 
 
 class CodeAnalyzer:
@@ -61,11 +113,7 @@ class CodeAnalyzer:
         self.init_lock = asyncio.Lock()
 
         # Initialize language-specific analyzers
-        self.analyzers = {
-            'python': PythonAnalyzer(self.project_source_path),
-            'cpp': CppAnalyzer(self.project_source_path),
-            'c': CppAnalyzer(self.project_source_path)  # We can use the same analyzer for C and C++
-        }
+        self.analyzers = create_analyzers(self.project_source_path)
         self.update_exclude_path(None)
 
     @staticmethod
@@ -213,15 +261,24 @@ class CodeAnalyzer:
             repo = git.Repo(self.project_source_path)
             repo.remotes.origin.pull()
 
-    async def make_full_index(self, exclude_dirs: List[str] = None):
+    async def make_full_index(self, exclude_dirs: List[str] = None, jobs: int = 1, incremental: bool = False):
         """
         创建完整的代码索引
+        :param exclude_dirs:
+        :param jobs: 解析代码文件使用的进程数, 大于1时使用进程池并行解析
+        :param incremental: 增量模式, 只重新分析有变化的文件, 并清理已删除的文件
         :return:
         """
         self.update_exclude_path(exclude_dirs)
         self.git_clone()
-        logger.info("Cleaning up the index")
-        self.index_manager.clean_index()
+        files = self.get_code_files()
+        if incremental:
+            files, deleted_files = self.get_changed_files(files)
+            logger.info(f"Incremental index: {len(files)} changed files, {len(deleted_files)} deleted files")
+            await self.delete_from_db(deleted_files)
+        else:
+            logger.info("Cleaning up the index")
+            self.index_manager.clean_index()
         summary = {
             "total_files": 0,
             "languages": {},
@@ -229,32 +286,25 @@ class CodeAnalyzer:
             "element_types": {},
             "dependencies": self.dependencies
         }
-        embedding_model.get_model()
-        logger.info("Analyzing code files")
+        if files:
+            embedding_model.get_model()
+        logger.info(f"Analyzing code files with {jobs} jobs")
         with Progress(transient=True) as progress:
-            files = self.get_code_files()
             task = progress.add_task("[cyan]Analyzing...", total=len(files), start=True)
-            for file_path in files:
-                with open(file_path, 'r', encoding='utf-8') as file:
-                    content = file.read()
-                    file_index_name = os.path.relpath(file_path, self.project_source_path)
-                    progress.update(task, advance=0, description=f"Analyzing {file_index_name}...")
-                    file_detail = self.get_file_detail(file_path, content)
-                    if file_detail:
-                        progress.update(task, advance=0, description=f"Make index[{len(file_detail.code_elements)}] for"
-                                                                     f" {file_index_name}...")
-                        self.index_manager.insert_or_update(file_detail)
-                        await self.save_to_db(file_detail)
-                    summary["total_files"] += 1
-                    summary["languages"][file_detail.language] = summary["languages"].get(file_detail.language, 0) + 1
-                    summary["total_code_elements"] += len(file_detail.code_elements)
-                    self.dependencies[file_detail.file_name] = file_detail.dependencies
-                    for element in file_detail.code_elements:
-                        element_type = element['type']
-                        summary["element_types"][element_type] = summary["element_types"].get(element_type, 0) + 1
-                progress.update(task, advance=1, description=f"Analyzed {file_index_name}")
+            # 解析阶段与向量化/入库阶段通过有界队列连接, 队列满时解析阶段会被阻塞
+            queue = asyncio.Queue(maxsize=max(jobs, 1) * 4)
+            producer = asyncio.create_task(self.produce_file_details(files, jobs, queue))
+            try:
+                await self.consume_file_details(queue, summary, progress, task)
+            finally:
+                if not producer.done():
+                    producer.cancel()
+                await asyncio.gather(producer, return_exceptions=True)
         if self.index_manager.make_structure(self.get_code_files()):
             self.index_manager.save_structure_to_json()
+        if incremental:
+            # 增量模式下统计信息不完整, 保留已有的项目摘要
+            return
 
         # 生成项目摘要
         summary = await self.generate_project_summary(summary)
@@ -269,24 +319,146 @@ class CodeAnalyzer:
                 with open(os.path.join(self.analyze_data_path, "project_overview.md"), "w") as f:
                     f.write(overview)
 
+    def get_changed_files(self, files: List[str]) -> Tuple[List[str], List[str]]:
+        """
+        对比索引找出需要重新分析的文件和已经删除的文件, 先比较修改时间, 修改时间不同时再比较内容hash
+        :param files: 当前所有代码文件
+        :return: (需要重新分析的文件路径, 已删除文件的索引名)
+        """
+        indexed = {item.file_name: item for item in self.index_manager.list_indexes()}
+        changed_files = []
+        current_files = set()
+        for file_path in files:
+            file_name_for_index = os.path.relpath(file_path, self.project_source_path)
+            current_files.add(file_name_for_index)
+            index_item = indexed.get(file_name_for_index)
+            if not index_item:
+                changed_files.append(file_path)
+                continue
+            last_modified = os.path.getmtime(file_path)
+            if index_item.last_modified == last_modified:
+                continue
+            with open(file_path, 'r', encoding='utf-8') as file:
+                code_hash = strings.get_content_hash(file.read())
+            if code_hash != index_item.code_hash:
+                changed_files.append(file_path)
+            else:
+                # 内容没有变化, 只更新修改时间, 下次可以直接跳过
+                index_item.last_modified = last_modified
+                self.index_manager.update_index_item(index_item)
+        deleted_files = [file_name for file_name in indexed if file_name not in current_files]
+        return changed_files, deleted_files
+
+    async def delete_from_db(self, file_names: List[str]):
+        """
+        从索引和数据库中删除文件
+        :param file_names: 文件的索引名
+        :return:
+        """
+        if not file_names:
+            return
+        await self.check_elements_collection()
+        for file_name in file_names:
+            logger.info(f"Deleting file {file_name}")
+            self.index_manager.delete(file_name)
+        await milvus_manager.buffered_delete(self.code_elements_collection, "file_path", file_names)
+
+    async def produce_file_details(self, files: List[str], jobs: int, queue: asyncio.Queue):
+        """
+        解析阶段: 读取并解析代码文件, 将结果放入队列, 结束时放入None
+        """
+        loop = asyncio.get_running_loop()
+        executor = None
+        if jobs > 1:
+            # 主进程已经加载了onnx模型, 使用spawn避免fork出带有推理线程状态的子进程
+            executor = ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context("spawn"),
+                                           initializer=init_analyze_worker, initargs=(self.project_source_path,))
+        semaphore = asyncio.Semaphore(max(jobs, 1) * 2)
+
+        async def analyze(file_path: str):
+            async with semaphore:
+                try:
+                    if executor:
+                        file_detail = await loop.run_in_executor(executor, analyze_file_in_worker, file_path)
+                    else:
+                        file_detail = load_file_detail(self.analyzers, self.project_source_path, file_path)
+                except Exception as e:
+                    logger.error(f"Failed to analyze file {file_path}: {e}")
+                    file_detail = None
+                await queue.put((file_path, file_detail))
+
+        try:
+            await asyncio.gather(*[analyze(file_path) for file_path in files])
+            await queue.put(None)
+        finally:
+            if executor:
+                executor.shutdown(wait=False, cancel_futures=True)
+
+    async def consume_file_details(self, queue: asyncio.Queue, summary: Dict, progress: Progress, task):
+        """
+        向量化和入库阶段: 从队列中取出解析结果, 积攒多个文件的代码元素后再统一向量化并写入数据库
+        """
+        batch_size = settings.get_embedding_batch_size()
+        pending_details = []
+        pending_elements = 0
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            file_path, file_detail = item
+            file_index_name = os.path.relpath(file_path, self.project_source_path)
+            if file_detail:
+                progress.update(task, advance=0, description=f"Make index[{len(file_detail.code_elements)}] for"
+                                                             f" {file_index_name}...")
+                pending_details.append(file_detail)
+                pending_elements += len(file_detail.code_elements)
+                if pending_elements >= batch_size:
+                    self.index_manager.insert_or_update_many(pending_details)
+                    await self.save_batch_to_db(pending_details)
+                    pending_details = []
+                    pending_elements = 0
+                summary["total_files"] += 1
+                summary["languages"][file_detail.language] = summary["languages"].get(file_detail.language, 0) + 1
+                summary["total_code_elements"] += len(file_detail.code_elements)
+                self.dependencies[file_detail.file_name] = file_detail.dependencies
+                for element in file_detail.code_elements:
+                    element_type = element['type']
+                    summary["element_types"][element_type] = summary["element_types"].get(element_type, 0) + 1
+            progress.update(task, advance=1, description=f"Analyzed {file_index_name}")
+        if pending_details:
+            self.index_manager.insert_or_update_many(pending_details)
+            await self.save_batch_to_db(pending_details)
+        await self.flush_db()
+
     def get_file_detail(self, file_path: str, content: str) -> FileDetails | None:
-        file_name_for_index = os.path.relpath(file_path, self.project_source_path)
-        code_hash = strings.get_content_hash(content)
-        language = utils.get_support_file_language(file_path)
-        analyzer = self.analyzers.get(language)
-        if not analyzer:
-            return None
-        code_elements = analyzer.extract_code_elements(file_path, content)
-        dependencies = analyzer.analyze_dependencies(file_path, content)
-        file_detail = index.FileDetails(
-            file_name=file_name_for_index,
-            code_hash=code_hash,
-            language=language,
-            file_path=file_path,
-            dependencies=dependencies,
-            code_elements=code_elements
-        )
-        return file_detail
+        return make_file_detail(self.analyzers, self.project_source_path, file_path, content)
+
+    def get_db_rows(self, file_detail: FileDetails) -> List[Dict[str, Any]]:
+        """
+        生成文件需要写入数据库的代码元素, 不包含向量
+        :param file_detail:
+        :return:
+        """
+        added_set = set()
+        rows = []
+        # if len(file_detail.code_elements) > 60:
+        #     logger.info(f"Too many code elements in {file_detail.file_name}, only saving the first 60.")
+        exclude_types_list = [CodeElementType.CONSTANT, CodeElementType.VARIABLE]
+        for element in file_detail.code_elements:
+            if not element['name'] or len(element['name']) == 0:
+                continue
+            if element['type'] in exclude_types_list:
+                continue
+            if f'{element["type"]}_{element["name"]}' in added_set:
+                continue
+            rows.append({
+                "file_path": file_detail.file_name,
+                "language": file_detail.language,
+                "element_type": element['type'],
+                "element_name": element['name'],
+                "content": element['content'][:18000],
+            })
+        return rows
 
     async def save_to_db(self, file_detail: FileDetails):
         """
@@ -294,36 +466,29 @@ class CodeAnalyzer:
         :param file_detail:
         :return:
         """
-        added_set = set()
+        await self.save_batch_to_db([file_detail])
+
+    async def save_batch_to_db(self, file_details: List[FileDetails]):
+        """
+        批量保存文件详情到数据库, 所有文件的代码元素合并为一次批量向量化
+        :param file_details:
+        :return:
+        """
         try:
-            # 删除此文件的旧向量
             await self.check_elements_collection()
-            await milvus_manager.delete(collection_name=self.code_elements_collection,
-                                        filter=f"file_path == '{file_detail.file_name}'"
-                                        )
-            # 插入新向量
             data = []
-            # if len(file_detail.code_elements) > 60:
-            #     logger.info(f"Too many code elements in {file_detail.file_name}, only saving the first 60.")
-            exclude_types_list = [CodeElementType.CONSTANT, CodeElementType.VARIABLE]
-            for element in file_detail.code_elements:
-                if not element['name'] or len(element['name']) == 0:
-                    continue
-                if element['type'] in exclude_types_list:
-                    continue
-                if f'{element["type"]}_{element["name"]}' in added_set:
-                    continue
-                embedding = await embedding_model.async_encode_text(element['name'])
-                data.append({
-                    "file_path": file_detail.file_name,
-                    "language": file_detail.language,
-                    "element_type": element['type'],
-                    "element_name": element['name'],
-                    "content": element['content'][:18000],
-                    "embedding": embedding.tolist()
-                })
-
-            await milvus_manager.insert(collection_name=self.code_elements_collection, data=data)
+            for file_detail in file_details:
+                data.extend(self.get_db_rows(file_detail))
+            # 删除这些文件的旧向量, 写入缓冲区, flush时合并为一次删除
+            await milvus_manager.buffered_delete(self.code_elements_collection, "file_path",
+                                                 [file_detail.file_name for file_detail in file_details])
+            if not data:
+                return
+            # 插入新向量
+            embeddings = await embedding_model.async_encode_texts([row["element_name"] for row in data])
+            for row, embedding in zip(data, embeddings):
+                row["embedding"] = embedding.tolist()
+            await milvus_manager.buffered_insert(self.code_elements_collection, data)
         except MilvusException as e:
             logger.error(f"Failed to save file details to the database: {e}")
             await milvus_manager.release_client()
@@ -331,6 +496,17 @@ class CodeAnalyzer:
             logger.error(f"Failed to save file details to the database: {e}", exc_info=True, stack_info=True)
             await milvus_manager.release_client()
 
+    async def flush_db(self):
+        """
+        将缓冲的向量写入数据库, 失败时未写入的数据保留在缓冲区中, 并向调用者抛出异常
+        """
+        try:
+            await milvus_manager.flush(self.code_elements_collection)
+        except Exception as e:
+            logger.error(f"Failed to flush file details to the database: {e}")
+            await milvus_manager.release_client()
+            raise e
+
     async def analyze_code(self, file_path: str, file_content: str, is_delete: bool):
         """
         分析单个文件
@@ -341,9 +517,7 @@ class CodeAnalyzer:
             logger.info(f"Deleting file {file_name_for_index}")
             self.index_manager.delete(file_name_for_index)
             await self.check_elements_collection()
-            await milvus_manager.delete(collection_name=self.code_elements_collection,
-                                        filter=f"file_path == '{file_name_for_index}'"
-                                        )
+            await milvus_manager.buffered_delete(self.code_elements_collection, "file_path", [file_name_for_index])
         code_hash = strings.get_content_hash(file_content)
         index_detail = self.index_manager.get_index(file_name_for_index)
         # 检查文件是否有变化
@@ -389,6 +563,7 @@ class CodeAnalyzer:
                 with open(file_path, 'r', encoding='utf-8') as f:
                     content = f.read()
                     await self.analyze_code(file_path, content, is_delete)
+        await self.flush_db()
 
     async def get_db_count(self):
         """
@@ -458,11 +633,10 @@ class CodeAnalyzer:
                 cleaned_patch.append(line)
         return '\n'.join(cleaned_patch)
 
-    async def get_review_context(self, filename: str, patch_content: str) -> Dict[str, Any]:
+    def get_patch_query_elements(self, filename: str, patch_content: str) -> Tuple[List[str], int]:
         """
-        审查所需要的上下文信息
+        提取补丁中用于向量检索的代码元素以及每个元素的检索数量
         """
-        patch_embedding = []
         patch_content = self.clean_patch(patch_content)
         language = utils.get_support_file_language(filename)
         analyzer = self.analyzers.get(language)
@@ -474,44 +648,74 @@ class CodeAnalyzer:
         if limit < 1:
             limit = 1
             code_elements = code_elements[:20]
-        for element in code_elements:
-            element_v = await embedding_model.async_encode_text(element)
-            patch_embedding.append(element_v.tolist())
+        return code_elements, limit
+
+    async def get_review_context(self, filename: str, patch_content: str) -> Dict[str, Any]:
+        """
+        审查所需要的上下文信息
+        """
+        contexts = await self.get_review_contexts({filename: patch_content})
+        if filename not in contexts:
+            raise ValueError(f"Failed to get review context for {filename}")
+        return contexts[filename]
+
+    async def get_review_contexts(self, patches: Dict[str, str]) -> Dict[str, Dict[str, Any]]:
+        """
+        批量获取多个文件审查所需要的上下文信息
+        所有文件的代码元素合并为一次向量化和一次多向量检索, 再按文件拆分结果
+        :param patches: 文件名 -> 补丁内容
+        :return: 文件名 -> 上下文信息, 无法提取代码元素的文件不会出现在结果中
+        """
+        queries = []
+        for filename, patch_content in patches.items():
+            try:
+                code_elements, limit = self.get_patch_query_elements(filename, patch_content)
+            except Exception as e:
+                logger.error(f"Failed to extract code elements from {filename}: {e}")
+                continue
+            queries.append((filename, code_elements, limit))
+        if not queries:
+            return {}
+        all_elements = [element for _, code_elements, _ in queries for element in code_elements]
+        embeddings = await embedding_model.async_encode_texts(all_elements)
         search_params = {"metric_type": "IP", "params": {"nprobe": 10}}
         await self.check_elements_collection()
         results = await milvus_manager.search(
             collection_name=self.code_elements_collection,
-            # filter="element_name in ['" + "','".join(code_elements) + "']",
-            # filter="element_name != ''",
-            data=patch_embedding,
+            data=[embedding.tolist() for embedding in embeddings],
             anns_field="embedding",
             search_params=search_params,
-            limit=limit,
+            limit=max(limit for _, _, limit in queries),
             output_fields=["file_path", "language", "element_type", "element_name", "content"]
         )
-        related_elements = []
-        for result in results:
-            if isinstance(result, dict):
-                continue
-            for code_element in result:
-                related_elements.append(code_element)
-
-        # 获取相关元素的上下文信息
-        context_info = self.get_context_info(related_elements)
-        # 分析补丁中的依赖关系
-        patch_dependencies = self.get_dependencies(filename)
-        logger.info("Dependencies: %s", patch_dependencies)
+        results = list(results)
         # 项目的概述 "project_overview.md"
         project_overview = ""
         overview_path = os.path.join(self.analyze_data_path, "project_overview.md")
         if os.path.exists(overview_path):
             with open(overview_path, 'r') as f:
                 project_overview = f.read()
-        return {
-            "context_info": context_info,
-            "dependencies": patch_dependencies,
-            "overview": project_overview
-        }
+        contexts = {}
+        offset = 0
+        for filename, code_elements, limit in queries:
+            related_elements = []
+            for result in results[offset:offset + len(code_elements)]:
+                if isinstance(result, dict):
+                    continue
+                for code_element in list(result)[:limit]:
+                    related_elements.append(code_element)
+            offset += len(code_elements)
+            # 获取相关元素的上下文信息
+            context_info = self.get_context_info(related_elements)
+            # 分析补丁中的依赖关系
+            patch_dependencies = self.get_dependencies(filename)
+            logger.info("Dependencies: %s", patch_dependencies)
+            contexts[filename] = {
+                "context_info": context_info,
+                "dependencies": patch_dependencies,
+                "overview": project_overview
+            }
+        return contexts
 
     def get_context_info(self, related_elements: List[Dict[str, Any]]) -> Dict[str, Any]:
         """
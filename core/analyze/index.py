@@ -12,16 +12,21 @@
 """
 __author__ = 'alex'
 
-import hashlib
 import json
 import os
-from typing import List, Dict, Any
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Tuple
 
 import pydantic
 
+from core import settings
+from core.log import logger
 from core.utils.decorators import SingletonDict
 
 MANAGER_DICT = SingletonDict()
+MANAGER_LOCK = threading.Lock()
 
 
 class FileDetails(pydantic.BaseModel):
@@ -43,6 +48,9 @@ class IndexItem(pydantic.BaseModel):
 
 
 INDEX_PATH_PREFIX = '.index'
+INDEX_DB_NAME = 'index.db'
+UPSERT_SQL = "INSERT OR REPLACE INTO file_index (file_name, code_hash, language, last_modified, dependencies) " \
+             "VALUES (?, ?, ?, ?, ?)"
 STRUCTURE_PATH_PREFIX = '.structure'
 
 
@@ -50,6 +58,24 @@ def get_index_path(repo_fullname: str, base_path: str) -> str:
     return os.path.join(base_path, f'{INDEX_PATH_PREFIX}/{repo_fullname}')
 
 
+def list_indexed_repos(base_path: str) -> List[str]:
+    """
+    获取已经建立索引的仓库, 索引目录为.index/owner/name
+    """
+    index_root = os.path.join(base_path, INDEX_PATH_PREFIX)
+    if not os.path.isdir(index_root):
+        return []
+    repos = []
+    for owner in sorted(os.listdir(index_root)):
+        owner_path = os.path.join(index_root, owner)
+        if not os.path.isdir(owner_path):
+            continue
+        for name in sorted(os.listdir(owner_path)):
+            if os.path.isdir(os.path.join(owner_path, name)):
+                repos.append(f"{owner}/{name}")
+    return repos
+
+
 def get_structure_path(repo_fullname: str, base_path: str) -> str:
     return os.path.join(base_path, f'{STRUCTURE_PATH_PREFIX}/{repo_fullname}.json')
 
@@ -60,35 +86,99 @@ class IndexManager:
         self.base_path = base_path
         self.source_path = source_path
         self.index_path = get_index_path(repo_fullname, base_path)
+        self.index_db_path = os.path.join(self.index_path, INDEX_DB_NAME)
         self.structure_path = get_structure_path(repo_fullname, base_path)
         self.structure = {}
+        # 索引数据全部加载到内存, file_name -> (code_hash, language, last_modified, dependencies_json)
+        self.rows: Dict[str, Tuple[str, str, float, str]] = {}
+        self.data_version = None
+        # 已解析的IndexItem的LRU缓存, 缓存命中时直接返回共享的对象, 避免重复解析依赖列表的json
+        self.item_cache: OrderedDict[str, IndexItem] = OrderedDict()
+        self.item_cache_size = settings.get_index_cache_size()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.lock = threading.RLock()
         self.check_index_exist()
+        self.conn = sqlite3.connect(self.index_db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS file_index (
+                file_name TEXT PRIMARY KEY,
+                code_hash TEXT NOT NULL,
+                language TEXT NOT NULL,
+                last_modified REAL NOT NULL,
+                dependencies TEXT NOT NULL
+            )
+        """)
+        self.conn.commit()
+        self.migrate_json_index()
+        self.load_index()
         self.load_structure_from_json()
 
     def make_full_index(self):
         pass
 
+    def migrate_json_index(self):
+        """
+        将旧版本每个文件一个json的索引迁移到sqlite中, 迁移完成后删除json文件
+        """
+        json_files = [file for file in os.listdir(self.index_path) if file.endswith('.json')]
+        if not json_files:
+            return
+        logger.info(f"Migrating {len(json_files)} index files of {self.repo_fullname} to {self.index_db_path}")
+        items = []
+        for file in json_files:
+            try:
+                with open(os.path.join(self.index_path, file), 'r') as f:
+                    items.append(IndexItem.parse_raw(f.read()))
+            except Exception as e:
+                logger.error(f"Failed to migrate index file {file}: {e}")
+        with self.lock, self.conn:
+            self.conn.executemany(UPSERT_SQL, [self._item_to_row(item) for item in items])
+        for file in json_files:
+            os.remove(os.path.join(self.index_path, file))
+
+    def load_index(self):
+        """
+        从sqlite中批量加载所有索引
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT file_name, code_hash, language, last_modified, dependencies FROM file_index").fetchall()
+            self.rows = {row[0]: row[1:] for row in rows}
+            self.item_cache.clear()
+            self.data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def check_reload(self):
+        """
+        其他进程(例如命令行重建索引)修改了数据库时重新加载
+        """
+        with self.lock:
+            data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+            if data_version != self.data_version:
+                self.load_index()
+
     def clean_index(self):
         """
-        清空索引,删除索引文件
+        清空索引
         :return:
         """
-        if os.path.exists(self.index_path):
-            # 删除目录下所有文件
-            for file in os.listdir(self.index_path):
-                os.remove(os.path.join(self.index_path, file))
-
-    def get_index_file_name(self, file_name: str) -> str:
-        file_name_hash = hashlib.sha256(file_name.encode()).hexdigest()
-        return os.path.join(self.index_path, f"{file_name_hash}.json")
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM file_index")
+            self.rows.clear()
+            self.item_cache.clear()
 
     def check_index_exist(self):
         if not os.path.exists(self.index_path):
             os.makedirs(self.index_path)
 
-    def insert_or_update(self, file_detail: FileDetails):
-        index_file_name = self.get_index_file_name(file_detail.file_name)
-        index_item = IndexItem(
+    @staticmethod
+    def _item_to_row(index_item: IndexItem) -> Tuple[str, str, str, float, str]:
+        return (index_item.file_name, index_item.code_hash, index_item.language, index_item.last_modified,
+                json.dumps(index_item.dependencies))
+
+    def make_index_item(self, file_detail: FileDetails) -> IndexItem:
+        return IndexItem(
             file_name=file_detail.file_name,
             code_hash=file_detail.code_hash,
             language=file_detail.language,
@@ -96,22 +186,86 @@ class IndexManager:
             dependencies=file_detail.dependencies,
             # code_elements=file_detail.code_elements
         )
-        with open(index_file_name, 'w') as f:
-            f.write(index_item.json())
-        self.insert_structure_item(file_detail.file_name)
+
+    def insert_or_update(self, file_detail: FileDetails):
+        self.insert_or_update_many([file_detail])
+
+    def insert_or_update_many(self, file_details: List[FileDetails]):
+        """
+        在一个事务中批量写入索引
+        """
+        rows = [self._item_to_row(self.make_index_item(file_detail)) for file_detail in file_details]
+        with self.lock, self.conn:
+            self.conn.executemany(UPSERT_SQL, rows)
+            for row in rows:
+                self.rows[row[0]] = row[1:]
+                self.item_cache.pop(row[0], None)
+        for file_detail in file_details:
+            self.insert_structure_item(file_detail.file_name)
+
+    def update_index_item(self, index_item: IndexItem):
+        row = self._item_to_row(index_item)
+        with self.lock, self.conn:
+            self.conn.execute(UPSERT_SQL, row)
+            self.rows[row[0]] = row[1:]
+            self.item_cache.pop(row[0], None)
 
     def delete(self, file_name: str):
-        index_file_name = self.get_index_file_name(file_name)
-        if os.path.exists(index_file_name):
-            os.remove(index_file_name)
+        with self.lock, self.conn:
+            cursor = self.conn.execute("DELETE FROM file_index WHERE file_name = ?", (file_name,))
+            self.rows.pop(file_name, None)
+            self.item_cache.pop(file_name, None)
+        if cursor.rowcount > 0:
             self.delete_structure_item(file_name)
 
     def get_index(self, file_name) -> IndexItem | None:
-        index_file_name = self.get_index_file_name(file_name)
-        if os.path.exists(index_file_name):
-            with open(index_file_name, 'r') as f:
-                return IndexItem.parse_raw(f.read())
-        return None
+        """
+        获取文件的索引项, 返回的对象与缓存共享, 调用者只能读取, 不能修改
+        需要修改时先model_copy(deep=True), 再通过update_index_item写回
+        """
+        self.check_reload()
+        with self.lock:
+            index_item = self.item_cache.get(file_name)
+            if index_item is not None:
+                self.item_cache.move_to_end(file_name)
+                self.cache_hits += 1
+                return index_item
+            self.cache_misses += 1
+            row = self.rows.get(file_name)
+            if row is None:
+                return None
+            index_item = IndexItem(file_name=file_name, code_hash=row[0], language=row[1], last_modified=row[2],
+                                   dependencies=json.loads(row[3]))
+            if self.item_cache_size > 0:
+                self.item_cache[file_name] = index_item
+                if len(self.item_cache) > self.item_cache_size:
+                    self.item_cache.popitem(last=False)
+            return index_item
+
+    def get_cache_stats(self) -> Dict[str, int]:
+        """
+        获取索引缓存的命中统计
+        """
+        return {
+            "size": len(self.item_cache),
+            "max_size": self.item_cache_size,
+            "hits": self.cache_hits,
+            "misses": self.cache_misses,
+        }
+
+    def list_indexes(self) -> List[IndexItem]:
+        """
+        获取所有的索引项
+        """
+        self.check_reload()
+        with self.lock:
+            # 全量遍历不经过LRU缓存, 避免冲掉热点数据
+            return [IndexItem(file_name=file_name, code_hash=row[0], language=row[1], last_modified=row[2],
+                              dependencies=json.loads(row[3])) for file_name, row in self.rows.items()]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
 
     def make_structure(self, files: List[str]):
         """
@@ -202,5 +356,8 @@ class IndexManager:
 
 def get_index_manager(repo_fullname: str, base_path: str, source_path: str) -> IndexManager:
     if repo_fullname not in MANAGER_DICT:
-        MANAGER_DICT[repo_fullname] = IndexManager(repo_fullname, base_path, source_path)
+        # 预热时在线程池中创建, 加锁避免同一个仓库的索引被重复加载
+        with MANAGER_LOCK:
+            if repo_fullname not in MANAGER_DICT:
+                MANAGER_DICT[repo_fullname] = IndexManager(repo_fullname, base_path, source_path)
     return MANAGER_DICT[repo_fullname]
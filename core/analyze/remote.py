@@ -0,0 +1,47 @@
+# -*- coding:utf-8 -*-
+#  Copyright (c) 2016-present The ZLMediaKit project authors. All Rights Reserved.
+#  This file is part of ZLMediaKit(https://github.com/ZLMediaKit/Github-AI-Assistant).
+#  Use of this source code is governed by MIT-like license that can be found in the
+#  LICENSE file in the root of the source tree. All contributing project authors
+#  may be found in the AUTHORS file in the root of the source tree.
+#
+"""
+多worker模式下, 向量模型和索引只在独立的索引进程中加载, 其他进程通过本地unix socket调用
+协议为一行一个json, 请求为{"method": ..., "params": {...}}, 响应为{"result": ...}或{"error": ...}
+"""
+__author__ = 'alex'
+
+import asyncio
+import json
+from typing import Any
+
+from core import settings
+from core.exception import IndexServiceException
+
+# 单条消息的最大长度, 审查上下文中包含依赖文件的全文
+MESSAGE_LIMIT = 64 * 1024 * 1024
+
+
+async def call_index_service(method: str, timeout: float | None = None, **params) -> Any:
+    """
+    调用索引进程的方法
+    :param method: get_review_contexts/schedule_reindex/status/ping
+    :param timeout: 等待响应的超时时间, 为空时一直等待
+    """
+    try:
+        reader, writer = await asyncio.open_unix_connection(settings.get_index_socket_path(), limit=MESSAGE_LIMIT)
+    except OSError as e:
+        raise IndexServiceException(f"Failed to connect index service, {e}")
+    try:
+        writer.write(json.dumps({"method": method, "params": params}).encode() + b"\n")
+        await writer.drain()
+        line = await asyncio.wait_for(reader.readline(), timeout)
+    finally:
+        writer.close()
+        await writer.wait_closed()
+    if not line:
+        raise IndexServiceException(f"Index service closed the connection while calling {method}")
+    response = json.loads(line)
+    if "error" in response:
+        raise IndexServiceException(f"Index service {method} failed, {response['error']}")
+    return response["result"]
@@ -13,8 +13,10 @@
 __author__ = 'alex'
 
 import json
+from typing import Dict, Any
 
 from core import settings, llm
+from core.analyze import remote
 from core.analyze.base import CodeAnalyzer
 from core.log import logger
 
@@ -256,18 +258,46 @@ Please review the above code according to the provided guidelines. Focus on [spe
 """
 
 
+def get_review_patch(file_status: str, file_patch: str | None) -> str:
+    """
+    获取用于审查的补丁内容, 新增文件不使用补丁
+    """
+    if file_status == "added" or file_patch is None:
+        return ""
+    return file_patch
+
+
+async def get_review_contexts(repo_name: str, patches: Dict[str, str]) -> Dict[str, Dict[str, Any]]:
+    """
+    批量获取一次审查中所有文件的上下文信息
+    :param repo_name:
+    :param patches: 文件名 -> 补丁内容(get_review_patch的返回值)
+    :return: 文件名 -> 上下文信息, 获取失败时返回空字典
+    """
+    if not patches or not CodeAnalyzer.can_use(repo_name):
+        return {}
+    try:
+        if settings.INDEX_SERVICE_ENABLED:
+            return await remote.call_index_service("get_review_contexts", timeout=300, repo_name=repo_name,
+                                                   patches=patches)
+        analyzer = CodeAnalyzer(repo_name, settings.get_milvus_uri())
+        return await analyzer.get_review_contexts(patches)
+    except Exception as e:
+        logger.error(f"Error in batch code analysis: {e}")
+        return {}
+
+
 async def do_ai_review(filename: str, commit_message: str, file_status: str,
-                       code_content: str, file_patch: str, repo_name: str = ""):
+                       code_content: str, file_patch: str, repo_name: str = "",
+                       context: Dict[str, Any] | None = None):
     if file_status == "added":
         review_type = "New File"
-        file_patch = ""
     else:
         if file_patch:
             review_type = "Patch"
         else:
             review_type = "New File"
-    if file_patch is None:
-        file_patch = ""
+    file_patch = get_review_patch(file_status, file_patch)
     if code_content is None:
         code_content = ""
     if repo_name:
@@ -276,10 +306,15 @@ async def do_ai_review(filename: str, commit_message: str, file_status: str,
     else:
         project_name = ""
         project_url = ""
-    if CodeAnalyzer.can_use(repo_name):
+    use_context = CodeAnalyzer.can_use(repo_name)
+    if use_context and context is None and settings.INDEX_SERVICE_ENABLED:
+        # 多worker模式下只有索引进程加载向量模型和索引, 获取上下文失败时不在worker中回退到本地分析
+        use_context = False
+    if use_context:
         try:
-            analyzer = CodeAnalyzer(repo_name, settings.get_milvus_uri())
-            context = await analyzer.get_review_context(filename, file_patch)
+            if context is None:
+                analyzer = CodeAnalyzer(repo_name, settings.get_milvus_uri())
+                context = await analyzer.get_review_context(filename, file_patch)
             related_context = context.get("context_info", "")
             if related_context:
                 related_context = json.dumps(related_context, indent=2, ensure_ascii=False)
@@ -321,7 +356,18 @@ async def do_ai_review(filename: str, commit_message: str, file_status: str,
     full_response = ""
 
     while True:
-        chunk = await llm.call_ai_api(system_prompt, messages, settings.REVIEW_MODEL, 0.2, 40, 0.85)
+        chunk = ""
+        # 流式读取, 一旦出现[CONTINUED]就结束本轮读取并请求继续
+        stream = llm.stream_ai_api(system_prompt, messages, settings.REVIEW_MODEL, 0.2, 40, 0.85)
+        try:
+            async for text in stream:
+                chunk += text
+                if "[CONTINUED]" in chunk:
+                    break
+        finally:
+            await stream.aclose()
+        # 与非流式接口一致, 清理拼接后的文本
+        chunk = llm.clean_response(chunk, strip_quotes=settings.REVIEW_MODEL.provider != 'gemini')
 
         full_response += chunk.strip()
 
@@ -0,0 +1,122 @@
+# -*- coding:utf-8 -*-
+#  Copyright (c) 2016-present The ZLMediaKit project authors. All Rights Reserved.
+#  This file is part of ZLMediaKit(https://github.com/ZLMediaKit/Github-AI-Assistant).
+#  Use of this source code is governed by MIT-like license that can be found in the
+#  LICENSE file in the root of the source tree. All contributing project authors
+#  may be found in the AUTHORS file in the root of the source tree.
+#
+__author__ = 'alex'
+
+import asyncio
+from typing import Awaitable, Callable, Dict, Set
+
+from core import settings
+from core.analyze.base import CodeAnalyzer
+from core.log import logger
+
+
+class ReindexScheduler:
+    """
+    按仓库合并的后台增量索引调度器
+    收到push后等待window秒再执行一次git pull和增量索引, 等待期间的push合并到这一次中
+    每个仓库同时只有一个索引任务, 执行期间又收到push时, 结束后再执行一次
+    停止时只取消还在等待的任务, 正在执行的索引在限定时间内执行完, 避免关闭时留下写了一半的增量索引
+    """
+
+    def __init__(self, run_func: Callable[[str], Awaitable], window: float = 30):
+        self.run_func = run_func
+        self.window = window
+        self.tasks: Dict[str, asyncio.Task] = {}
+        # 任务已经开始执行后又收到push的仓库
+        self.dirty: Set[str] = set()
+        # 正在执行run_func的仓库
+        self.running: Set[str] = set()
+        self.stopping = False
+        self.total_requested = 0
+        self.total_runs = 0
+        self.total_failed = 0
+
+    def schedule(self, repo_name: str):
+        """
+        请求重建仓库的索引, 立即返回
+        """
+        if self.stopping:
+            logger.warning(f"Reindex scheduler is stopping, skip {repo_name}")
+            return
+        self.total_requested += 1
+        if repo_name in self.tasks:
+            self.dirty.add(repo_name)
+            logger.info(f"Reindex of {repo_name} is already scheduled, coalesced")
+            return
+        self.tasks[repo_name] = asyncio.create_task(self._run(repo_name))
+        logger.info(f"Reindex of {repo_name} scheduled in {self.window}s")
+
+    async def _run(self, repo_name: str):
+        try:
+            while True:
+                await asyncio.sleep(self.window)
+                # 在此之前的push都会包含在这一次pull中
+                self.dirty.discard(repo_name)
+                self.total_runs += 1
+                self.running.add(repo_name)
+                try:
+                    logger.info(f"Start to reindex {repo_name}")
+                    await self.run_func(repo_name)
+                    logger.info(f"Reindex {repo_name} done")
+                except Exception as e:
+                    self.total_failed += 1
+                    logger.exception(f"Reindex {repo_name} failed, {e}")
+                finally:
+                    self.running.discard(repo_name)
+                if self.stopping or repo_name not in self.dirty:
+                    break
+        finally:
+            self.tasks.pop(repo_name, None)
+            self.dirty.discard(repo_name)
+
+    async def stop(self, grace: float = 60):
+        """
+        停止调度, 还在等待窗口中的任务直接取消, 正在执行的索引最多等待grace秒, 超时后再取消
+        """
+        self.stopping = True
+        running = []
+        for repo_name, task in list(self.tasks.items()):
+            if repo_name in self.running:
+                running.append(task)
+            else:
+                task.cancel()
+        if running:
+            logger.info(f"Waiting for {len(running)} running reindex tasks to finish")
+            _, pending = await asyncio.wait(running, timeout=grace)
+            for task in pending:
+                logger.warning(f"Reindex is still running after {grace}s, cancel it")
+                task.cancel()
+        await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+        # 还没开始执行就被取消的任务不会进入_run的finally
+        self.tasks.clear()
+        self.dirty.clear()
+
+    def get_stats(self) -> dict:
+        return {
+            "window": self.window,
+            "scheduled": list(self.tasks.keys()),
+            "running": list(self.running),
+            "requested": self.total_requested,
+            "runs": self.total_runs,
+            "failed": self.total_failed,
+        }
+
+
+async def check_git_changes(repo_name: str):
+    analyzer = CodeAnalyzer(repo_name, settings.get_milvus_uri())
+    await analyzer.check_git_changes()
+
+
+_scheduler: ReindexScheduler | None = None
+
+
+def get_reindex_scheduler() -> ReindexScheduler:
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = ReindexScheduler(check_git_changes, settings.get_reindex_window())
+    return _scheduler
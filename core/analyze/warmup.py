@@ -0,0 +1,69 @@
+# -*- coding:utf-8 -*-
+#  Copyright (c) 2016-present The ZLMediaKit project authors. All Rights Reserved.
+#  This file is part of ZLMediaKit(https://github.com/ZLMediaKit/Github-AI-Assistant).
+#  Use of this source code is governed by MIT-like license that can be found in the
+#  LICENSE file in the root of the source tree. All contributing project authors
+#  may be found in the AUTHORS file in the root of the source tree.
+#
+__author__ = 'alex'
+
+import asyncio
+import os
+import time
+from typing import Any, Dict
+
+from core import settings
+from core.analyze import index
+from core.analyze.base import CodeAnalyzer, embedding_model, milvus_manager
+from core.log import logger
+
+STATE_IDLE = "idle"
+STATE_WARMING = "warming"
+STATE_READY = "ready"
+STATE_FAILED = "failed"
+
+_status: Dict[str, Any] = {"state": STATE_IDLE, "repos": [], "duration": 0.0, "error": None}
+
+
+async def preload_repo(repo_name: str):
+    # 创建CodeAnalyzer时会同步加载并缓存该仓库的索引数据, 放到线程池中执行, 避免预热期间阻塞事件循环
+    analyzer = await embedding_model.executor.run_in_thread(CodeAnalyzer, repo_name, settings.get_milvus_uri())
+    if await milvus_manager.has_collection(analyzer.code_elements_collection):
+        await milvus_manager.load_collection(analyzer.code_elements_collection)
+
+
+async def warm_up():
+    """
+    预加载向量模型并执行一次推理, 加载所有已建立索引的仓库的索引数据和Milvus集合
+    任务被取消时会等待正在加载的仓库完成后再退出, 调用者等待任务结束后即可安全关闭Milvus
+    """
+    start = time.monotonic()
+    _status.update(state=STATE_WARMING, repos=[], error=None)
+    try:
+        logger.info("Warming up embedding model")
+        await embedding_model.executor.run_in_thread(embedding_model.warm_up)
+        for repo_name in index.list_indexed_repos(os.path.join(settings.BASE_PATH, './data')):
+            step = asyncio.ensure_future(preload_repo(repo_name))
+            try:
+                await asyncio.shield(step)
+                _status["repos"].append(repo_name)
+                logger.info(f"Preloaded index of {repo_name}")
+            except asyncio.CancelledError:
+                await asyncio.gather(step, return_exceptions=True)
+                raise
+            except Exception as e:
+                logger.exception(f"Preload index of {repo_name} failed, {e}")
+        _status.update(state=STATE_READY, duration=time.monotonic() - start)
+        logger.info(f"Warm up done in {_status['duration']:.1f}s")
+    except Exception as e:
+        _status.update(state=STATE_FAILED, duration=time.monotonic() - start, error=str(e))
+        logger.exception(f"Warm up failed, {e}")
+
+
+def get_status() -> Dict[str, Any]:
+    """
+    预加载的状态, 没有开启预加载时视为就绪
+    """
+    status = dict(_status)
+    status["ready"] = not settings.get_embedding_preload() or status["state"] == STATE_READY
+    return status
@@ -12,6 +12,7 @@ __author__ = 'alex'
 # Model used for translation
 ENV_TRANSLATION_MODEL = "TRANSLATION_MODEL"
 ENV_TRANSLATION_API_REQUEST_LIMIT = "TRANSLATION_API_REQUEST_LIMIT"
+ENV_TRANSLATION_API_TOKEN_LIMIT = "TRANSLATION_API_TOKEN_LIMIT"
 ENV_TRANSLATION_API_KEY = "TRANSLATION_API_KEY"
 ENV_TRANSLATION_API_URL = "TRANSLATION_API_URL"
 ENV_TRANSLATION_API_MAX_INPUT_TOKENS = "TRANSLATION_API_MAX_INPUT_TOKENS"
@@ -20,12 +21,17 @@ ENV_TRANSLATION_API_MAX_OUTPUT_TOKENS = "TRANSLATION_API_MAX_OUTPUT_TOKENS"
 # Model used for review
 ENV_REVIEW_MODEL = "REVIEW_MODEL"
 ENV_REVIEW_API_REQUEST_LIMIT = "REVIEW_API_REQUEST_LIMIT"
+ENV_REVIEW_API_TOKEN_LIMIT = "REVIEW_API_TOKEN_LIMIT"
 ENV_REVIEW_API_KEY = "REVIEW_API_KEY"
 ENV_REVIEW_API_URL = "REVIEW_API_URL"
 ENV_REVIEW_API_MAX_INPUT_TOKENS = "REVIEW_API_MAX_INPUT_TOKENS"
 ENV_REVIEW_API_MAX_OUTPUT_TOKENS = "REVIEW_API_MAX_OUTPUT_TOKENS"
+ENV_REVIEW_CONCURRENCY = "REVIEW_CONCURRENCY"
 
 ENV_TRANSLATION_TARGET_LANG = "TRANSLATION_TARGET_LANG"
+ENV_TRANSLATION_CACHE_SIZE = "TRANSLATION_CACHE_SIZE"
+ENV_TRANSLATION_CACHE_TTL = "TRANSLATION_CACHE_TTL"
+ENV_TRANSLATION_CONCURRENCY = "TRANSLATION_CONCURRENCY"
 ENV_TRANSLATOR = "TRANSLATOR"
 ENV_GITHUB_TOKEN = "GITHUB_TOKEN"
 ENV_GITHUB_USERNAME = "GITHUB_USERNAME"
@@ -34,6 +40,13 @@ ENV_DEBUG = "DEBUG"
 
 ENV_EMBEDDING_MODEL = "EMBEDDING_MODEL"
 ENV_MILVUS_URI = "MILVUS_URI"
+ENV_EMBEDDING_BATCH_SIZE = "EMBEDDING_BATCH_SIZE"
+ENV_EMBEDDING_CACHE_SIZE = "EMBEDDING_CACHE_SIZE"
+ENV_EMBEDDING_PRELOAD = "EMBEDDING_PRELOAD"
+ENV_INDEX_CACHE_SIZE = "INDEX_CACHE_SIZE"
+ENV_MILVUS_FLUSH_ROWS = "MILVUS_FLUSH_ROWS"
+ENV_MILVUS_FLUSH_BYTES = "MILVUS_FLUSH_BYTES"
+ENV_REINDEX_WINDOW = "REINDEX_WINDOW"
 
 ENV_AUTO_RELOAD = "AUTO_RELOAD"
 ENV_PROXY_URL = "PROXY_URL"
@@ -41,3 +54,6 @@ ENV_WEB_HOOK_LISTEN_HOST = "WEB_HOOK_LISTEN_HOST"
 ENV_WEB_HOOK_LISTEN_PORT = "WEB_HOOK_LISTEN_PORT"
 ENV_WEB_HOOK_WORKERS = "WEB_HOOK_WORKERS"
 ENV_WEB_HOOK_ACCESS_LOG = "WEB_HOOK_ACCESS_LOG"
+ENV_WEB_HOOK_QUEUE_WORKERS = "WEB_HOOK_QUEUE_WORKERS"
+ENV_WEB_HOOK_QUEUE_SIZE = "WEB_HOOK_QUEUE_SIZE"
+ENV_INDEX_SERVICE_SOCKET = "INDEX_SERVICE_SOCKET"
@@ -0,0 +1,136 @@
+# -*- coding:utf-8 -*-
+#  Copyright (c) 2016-present The ZLMediaKit project authors. All Rights Reserved.
+#  This file is part of ZLMediaKit(https://github.com/ZLMediaKit/Github-AI-Assistant).
+#  Use of this source code is governed by MIT-like license that can be found in the
+#  LICENSE file in the root of the source tree. All contributing project authors
+#  may be found in the AUTHORS file in the root of the source tree.
+#
+"""
+@author:alex
+@date:2024/9/21
+@time:下午3:12
+"""
+__author__ = 'alex'
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from core.log import logger
+
+
+class EmbeddingCache:
+    """
+    基于SQLite的向量缓存, 以(模型名称, chunk_size和文本的sha256)为键, 超过max_entries时按最近访问时间淘汰
+    命中时只在内存中记录访问时间, 在put_many/close时或距离上次写入超过touch_interval秒时批量写回
+    """
+
+    def __init__(self, db_path: str, model_name: str, max_entries: int = 200000, touch_interval: float = 60):
+        self.db_path = db_path
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.touch_interval = touch_interval
+        self.lock = threading.Lock()
+        # text_hash -> 尚未写入数据库的最近访问时间
+        self.pending_touches: Dict[str, float] = {}
+        self.last_touch_flush = time.monotonic()
+        if not os.path.exists(os.path.dirname(db_path)):
+            os.makedirs(os.path.dirname(db_path))
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS embedding_cache (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_embedding_cache_access ON embedding_cache (last_access)")
+        self.conn.commit()
+        self.size = self.conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+
+    @staticmethod
+    def get_text_hash(text: str, chunk_size: int) -> str:
+        # 超长文本按chunk_size分块后取平均, 不同的chunk_size得到的向量不同
+        return hashlib.sha256(f"{chunk_size}:{text}".encode()).hexdigest()
+
+    def get(self, text: str, chunk_size: int) -> np.ndarray | None:
+        return self.get_many([text], chunk_size).get(text)
+
+    def get_many(self, texts: List[str], chunk_size: int) -> Dict[str, np.ndarray]:
+        """
+        批量查询缓存, 返回命中的 文本->向量
+        """
+        result = {}
+        if not texts:
+            return result
+        hashes = {self.get_text_hash(text, chunk_size): text for text in texts}
+        hash_list = list(hashes.keys())
+        with self.lock:
+            # SQLite默认最多支持999个参数, 分批查询
+            for i in range(0, len(hash_list), 500):
+                batch = hash_list[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self.conn.execute(
+                    f"SELECT text_hash, vector FROM embedding_cache WHERE model = ? AND text_hash IN ({placeholders})",
+                    [self.model_name, *batch]).fetchall()
+                now = time.time()
+                for text_hash, vector in rows:
+                    result[hashes[text_hash]] = np.frombuffer(vector, dtype=np.float32)
+                    self.pending_touches[text_hash] = now
+            if self.pending_touches and time.monotonic() - self.last_touch_flush >= self.touch_interval:
+                self._flush_touches()
+                self.conn.commit()
+        return result
+
+    def put(self, text: str, vector: np.ndarray, chunk_size: int):
+        self.put_many({text: vector}, chunk_size)
+
+    def put_many(self, vectors: Dict[str, np.ndarray], chunk_size: int):
+        if not vectors:
+            return
+        now = time.time()
+        rows = [(self.model_name, self.get_text_hash(text, chunk_size),
+                 np.asarray(vector, dtype=np.float32).tobytes(), now)
+                for text, vector in vectors.items()]
+        with self.lock:
+            # 淘汰前写回访问时间, 避免刚命中的向量被当作冷数据淘汰
+            self._flush_touches()
+            before = self.conn.total_changes
+            self.conn.executemany("INSERT OR IGNORE INTO embedding_cache (model, text_hash, vector, last_access) "
+                                  "VALUES (?, ?, ?, ?)", rows)
+            self.size += self.conn.total_changes - before
+            if self.max_entries and self.size > self.max_entries:
+                self._evict()
+            self.conn.commit()
+
+    def _flush_touches(self):
+        self.last_touch_flush = time.monotonic()
+        if not self.pending_touches:
+            return
+        self.conn.executemany("UPDATE embedding_cache SET last_access = ? WHERE model = ? AND text_hash = ?",
+                              [(last_access, self.model_name, text_hash)
+                               for text_hash, last_access in self.pending_touches.items()])
+        self.pending_touches.clear()
+
+    def _evict(self):
+        # 一次多淘汰10%, 避免每次插入都触发淘汰
+        overflow = self.size - self.max_entries + self.max_entries // 10
+        self.conn.execute("DELETE FROM embedding_cache WHERE rowid IN "
+                          "(SELECT rowid FROM embedding_cache ORDER BY last_access ASC LIMIT ?)", (overflow,))
+        self.size = self.conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+        logger.info(f"Embedding cache evicted, {self.size} entries left")
+
+    def close(self):
+        with self.lock:
+            self._flush_touches()
+            self.conn.commit()
+            self.conn.close()
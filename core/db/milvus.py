@@ -13,7 +13,8 @@
 __author__ = 'alex'
 
 import asyncio
-from typing import Union, Dict, List, Optional
+import json
+from typing import Union, Dict, List, Optional, Any
 
 from pymilvus import MilvusClient, CollectionSchema
 from pymilvus.milvus_client import IndexParams
@@ -23,9 +24,43 @@ from core.thread import get_backend_thread_pool
 from core.utils.decorators import singleton_adv
 
 
+# 合并删除时每个filter中最多包含的值的数量, 避免表达式过长
+DELETE_FILTER_CHUNK_SIZE = 1000
+
+
+def estimate_row_size(row: Dict[str, Any]) -> int:
+    """
+    估算一行数据序列化后的字节数, 向量按float32计算
+    """
+    size = 0
+    for value in row.values():
+        if isinstance(value, (list, tuple)):
+            size += len(value) * 4
+        elif isinstance(value, str):
+            size += len(value.encode())
+        else:
+            size += 8
+    return size
+
+
+class WriteBuffer:
+    """
+    单个集合的写缓冲区, 删除操作按字段合并, 插入操作按行累积
+    """
+
+    def __init__(self):
+        self.rows: List[Dict] = []
+        self.bytes = 0
+        self.deletes: Dict[str, set] = {}
+        self.lock = asyncio.Lock()
+
+    def is_empty(self) -> bool:
+        return not self.rows and not self.deletes
+
+
 @singleton_adv
 class MilvusManager:
-    def __init__(self, uri, token):
+    def __init__(self, uri, token, flush_rows: int = 2000, flush_bytes: int = 16 * 1024 * 1024):
         self.client = None
         self.uri = uri
         self.token = token
@@ -33,6 +68,9 @@ class MilvusManager:
         self.collection_locks = {}
         self.init_lock = asyncio.Lock()
         self.executor = get_backend_thread_pool()
+        self.flush_rows = flush_rows
+        self.flush_bytes = flush_bytes
+        self.write_buffers: Dict[str, WriteBuffer] = {}
 
     async def get_client(self, collection_name):
         if not self.client:
@@ -68,6 +106,95 @@ class MilvusManager:
         client = await self.get_client(collection_name)
         return await self.executor.run_in_thread(client.delete, collection_name, ids, timeout, filter)
 
+    def get_write_buffer(self, collection_name: str) -> WriteBuffer:
+        if collection_name not in self.write_buffers:
+            self.write_buffers[collection_name] = WriteBuffer()
+        return self.write_buffers[collection_name]
+
+    async def buffered_delete(self, collection_name: str, field_name: str, values: List[Any]):
+        """
+        缓冲删除操作, 同一字段的删除在flush时合并为一个 field in [...] 的filter
+        缓冲区中尚未写入的同值数据会被直接丢弃
+        """
+        if not values:
+            return
+        buffer = self.get_write_buffer(collection_name)
+        values = set(values)
+        if buffer.rows:
+            buffer.rows = [row for row in buffer.rows if row.get(field_name) not in values]
+            buffer.bytes = sum(estimate_row_size(row) for row in buffer.rows)
+        buffer.deletes.setdefault(field_name, set()).update(values)
+        if sum(len(v) for v in buffer.deletes.values()) >= self.flush_rows:
+            await self.flush(collection_name)
+
+    async def buffered_insert(self, collection_name: str, data: List[Dict]):
+        """
+        缓冲插入操作, 累积的行数或字节数超过阈值时自动flush
+        """
+        if not data:
+            return
+        buffer = self.get_write_buffer(collection_name)
+        buffer.rows.extend(data)
+        buffer.bytes += sum(estimate_row_size(row) for row in data)
+        if len(buffer.rows) >= self.flush_rows or buffer.bytes >= self.flush_bytes:
+            await self.flush(collection_name)
+
+    async def flush(self, collection_name: str):
+        """
+        将缓冲区写入数据库, 先执行合并后的删除再分批插入
+        """
+        buffer = self.write_buffers.get(collection_name)
+        if not buffer or buffer.is_empty():
+            return
+        async with buffer.lock:
+            rows, deletes = buffer.rows, buffer.deletes
+            buffer.rows, buffer.bytes, buffer.deletes = [], 0, {}
+            if not rows and not deletes:
+                return
+            # 尚未执行的删除和插入, 写入失败时放回缓冲区
+            remaining_deletes = {field_name: set(values) for field_name, values in deletes.items()}
+            inserted = 0
+            try:
+                client = await self.get_client(collection_name)
+                for field_name, values in deletes.items():
+                    values = list(values)
+                    for i in range(0, len(values), DELETE_FILTER_CHUNK_SIZE):
+                        chunk = values[i:i + DELETE_FILTER_CHUNK_SIZE]
+                        await self.executor.run_in_thread(client.delete, collection_name, None, None,
+                                                          f"{field_name} in {json.dumps(chunk, ensure_ascii=False)}")
+                        remaining_deletes[field_name].difference_update(chunk)
+                for i in range(0, len(rows), self.flush_rows):
+                    await self.executor.run_in_thread(client.insert, collection_name, rows[i:i + self.flush_rows])
+                    inserted = min(i + self.flush_rows, len(rows))
+            except BaseException:
+                self.restore_buffer(buffer, rows[inserted:], remaining_deletes)
+                raise
+            logger.debug(f"Flushed {len(rows)} rows and {sum(len(v) for v in deletes.values())} deletes "
+                         f"to {collection_name}")
+
+    @staticmethod
+    def restore_buffer(buffer: WriteBuffer, rows: List[Dict], deletes: Dict[str, set]):
+        """
+        将写入失败的数据放回缓冲区, 由下一次flush重试
+        放回的数据比flush期间新缓冲的数据更早, 已经被新的删除覆盖的行直接丢弃
+        """
+        rows = [row for row in rows
+                if not any(row.get(field_name) in values for field_name, values in buffer.deletes.items())]
+        for field_name, values in deletes.items():
+            if values:
+                buffer.deletes.setdefault(field_name, set()).update(values)
+        buffer.rows = rows + buffer.rows
+        buffer.bytes = sum(estimate_row_size(row) for row in buffer.rows)
+        logger.warning(f"Flush failed, {len(rows)} rows and {sum(len(v) for v in deletes.values())} deletes "
+                       f"are kept in the buffer for retry")
+
+    async def flush_all(self):
+        for collection_name in list(self.write_buffers.keys()):
+            try:
+                await self.flush(collection_name)
+            except Exception as e:
+                logger.error(f"Error flushing collection {collection_name}: {e}")
+
     async def search(self, collection_name: str,
                      data: Union[List[list], list],
                      filter: str = "",
@@ -177,6 +304,10 @@ class MilvusManager:
     async def __aenter__(self):
         return self
 
-    async def __aexit__(self, exc_type, exc_val, exc_tb):
+    async def close(self):
+        await self.flush_all()
         await self.release_client()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
         self.executor.shutdown(wait=True)
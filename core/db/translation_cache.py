@@ -0,0 +1,143 @@
+# -*- coding:utf-8 -*-
+#  Copyright (c) 2016-present The ZLMediaKit project authors. All Rights Reserved.
+#  This file is part of ZLMediaKit(https://github.com/ZLMediaKit/Github-AI-Assistant).
+#  Use of this source code is governed by MIT-like license that can be found in the
+#  LICENSE file in the root of the source tree. All contributing project authors
+#  may be found in the AUTHORS file in the root of the source tree.
+#
+"""
+@author:alex
+@date:2024/9/22
+@time:上午10:26
+"""
+__author__ = 'alex'
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict
+
+from core.log import logger
+
+
+class TranslationCache:
+    """
+    基于SQLite的翻译缓存, 以(模型, 目标语言, 提示词版本, 规范化后文本的sha256)为键
+    超过ttl的记录视为失效, 超过max_entries时按最近访问时间淘汰
+    命中时只在内存中记录访问时间, 在put/close时或距离上次写入超过touch_interval秒时批量写回
+    """
+
+    def __init__(self, db_path: str, max_entries: int = 50000, ttl: int = 30 * 24 * 3600,
+                 touch_interval: float = 60):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.touch_interval = touch_interval
+        self.lock = threading.Lock()
+        # 缓存键 -> 尚未写入数据库的最近访问时间
+        self.pending_touches: Dict[tuple, float] = {}
+        self.last_touch_flush = time.monotonic()
+        if not os.path.exists(os.path.dirname(db_path)):
+            os.makedirs(os.path.dirname(db_path))
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS translation_cache (
+                model TEXT NOT NULL,
+                target_lang TEXT NOT NULL,
+                prompt_hash TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                translated TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (model, target_lang, prompt_hash, text_hash)
+            )
+        """)
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_translation_cache_access ON translation_cache (last_access)")
+        self.conn.commit()
+        self.size = self.conn.execute("SELECT COUNT(*) FROM translation_cache").fetchone()[0]
+
+    @staticmethod
+    def get_hash(text: str) -> str:
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    @staticmethod
+    def normalize_text(text: str) -> str:
+        """
+        统一换行符并去掉首尾空白, 避免同一内容因为格式差异重复翻译
+        """
+        return text.replace('\r\n', '\n').strip()
+
+    def make_key(self, model: str, target_lang: str, prompt: str, text: str) -> tuple:
+        return model, target_lang, self.get_hash(prompt or ""), self.get_hash(self.normalize_text(text))
+
+    def get(self, model: str, target_lang: str, prompt: str, text: str) -> str | None:
+        key = self.make_key(model, target_lang, prompt, text)
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT translated, created_at FROM translation_cache "
+                "WHERE model = ? AND target_lang = ? AND prompt_hash = ? AND text_hash = ?", key).fetchone()
+            if row is None:
+                return None
+            if self.ttl and now - row[1] > self.ttl:
+                self.conn.execute("DELETE FROM translation_cache "
+                                  "WHERE model = ? AND target_lang = ? AND prompt_hash = ? AND text_hash = ?", key)
+                self.pending_touches.pop(key, None)
+                self.conn.commit()
+                self.size -= 1
+                return None
+            self.pending_touches[key] = now
+            if time.monotonic() - self.last_touch_flush >= self.touch_interval:
+                self._flush_touches()
+                self.conn.commit()
+        return row[0]
+
+    def put(self, model: str, target_lang: str, prompt: str, text: str, translated: str):
+        key = self.make_key(model, target_lang, prompt, text)
+        now = time.time()
+        with self.lock:
+            # 淘汰前写回访问时间, 避免刚命中的翻译被当作冷数据淘汰
+            self._flush_touches()
+            exists = self.conn.execute(
+                "SELECT 1 FROM translation_cache "
+                "WHERE model = ? AND target_lang = ? AND prompt_hash = ? AND text_hash = ?", key).fetchone()
+            self.conn.execute("INSERT OR REPLACE INTO translation_cache "
+                              "(model, target_lang, prompt_hash, text_hash, translated, created_at, last_access) "
+                              "VALUES (?, ?, ?, ?, ?, ?, ?)", (*key, translated, now, now))
+            if not exists:
+                self.size += 1
+            if self.max_entries and self.size > self.max_entries:
+                self._evict()
+            self.conn.commit()
+
+    def _flush_touches(self):
+        self.last_touch_flush = time.monotonic()
+        if not self.pending_touches:
+            return
+        self.conn.executemany("UPDATE translation_cache SET last_access = ? "
+                              "WHERE model = ? AND target_lang = ? AND prompt_hash = ? AND text_hash = ?",
+                              [(last_access, *key) for key, last_access in self.pending_touches.items()])
+        self.pending_touches.clear()
+
+    def _evict(self):
+        # 先清理过期的记录, 仍然超出时一次多淘汰10%
+        if self.ttl:
+            self.conn.execute("DELETE FROM translation_cache WHERE created_at < ?", (time.time() - self.ttl,))
+        self.size = self.conn.execute("SELECT COUNT(*) FROM translation_cache").fetchone()[0]
+        if self.size > self.max_entries:
+            overflow = self.size - self.max_entries + self.max_entries // 10
+            self.conn.execute("DELETE FROM translation_cache WHERE rowid IN "
+                              "(SELECT rowid FROM translation_cache ORDER BY last_access ASC LIMIT ?)", (overflow,))
+            self.size = self.conn.execute("SELECT COUNT(*) FROM translation_cache").fetchone()[0]
+        logger.info(f"Translation cache evicted, {self.size} entries left")
+
+    def close(self):
+        with self.lock:
+            self._flush_touches()
+            self.conn.commit()
+            self.conn.close()
@@ -0,0 +1,210 @@
+# -*- coding:utf-8 -*-
+#  Copyright (c) 2016-present The ZLMediaKit project authors. All Rights Reserved.
+#  This file is part of ZLMediaKit(https://github.com/ZLMediaKit/Github-AI-Assistant).
+#  Use of this source code is governed by MIT-like license that can be found in the
+#  LICENSE file in the root of the source tree. All contributing project authors
+#  may be found in the AUTHORS file in the root of the source tree.
+#
+__author__ = 'alex'
+
+import fcntl
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import List, Dict, Any
+
+from core.log import logger
+
+STATUS_PENDING = "pending"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+UNFINISHED_STATUS = (STATUS_PENDING, STATUS_RUNNING)
+EVENT_FIELDS = "delivery_id, event, repo_key, payload, headers, status, attempts, owner, error, created_at, updated_at"
+
+
+class WebhookJournal:
+    """
+    基于SQLite的webhook事件日志, 事件在返回200之前写入, 处理完成后标记为done
+    进程重启后由replay重新处理未完成的事件, owner记录正在处理事件的实例, 避免多个进程重复处理
+    每个实例启动时生成随机id, 并在运行期间对以该id命名的租约文件持有flock, 进程退出后锁自动释放
+    判断owner是否存活只看租约文件能否加锁, 不依赖可能被复用的PID
+    """
+
+    def __init__(self, db_path: str, max_attempts: int = 3, retention: int = 7 * 24 * 3600):
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        self.retention = retention
+        self.lock = threading.Lock()
+        if not os.path.exists(os.path.dirname(db_path)):
+            os.makedirs(os.path.dirname(db_path))
+        self.lease_path = os.path.join(os.path.dirname(db_path), "webhook_leases")
+        os.makedirs(self.lease_path, exist_ok=True)
+        self.instance_id = uuid.uuid4().hex
+        self.lease_fd = os.open(self.get_lease_file(self.instance_id), os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self.lease_fd, fcntl.LOCK_EX)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA busy_timeout=5000")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS webhook_events (
+                delivery_id TEXT PRIMARY KEY,
+                event TEXT NOT NULL,
+                repo_key TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                headers TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                owner TEXT NOT NULL,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_webhook_events_status ON webhook_events (status)")
+
+    def get_lease_file(self, owner: str) -> str:
+        return os.path.join(self.lease_path, f"{owner}.lock")
+
+    def is_owner_alive(self, owner) -> bool:
+        """
+        owner的租约文件仍被加锁时视为存活, 旧版本记录的PID没有租约文件, 视为已退出
+        """
+        owner = str(owner)
+        if owner == self.instance_id:
+            return True
+        lease_file = self.get_lease_file(owner)
+        if not os.path.exists(lease_file):
+            return False
+        fd = os.open(lease_file, os.O_RDWR)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        finally:
+            os.close(fd)
+        # 能加锁说明持有者已经退出, 删除遗留的租约文件
+        try:
+            os.remove(lease_file)
+        except FileNotFoundError:
+            pass
+        return False
+
+    @staticmethod
+    def _row_to_dict(row) -> Dict[str, Any]:
+        keys = [key.strip() for key in EVENT_FIELDS.split(",")]
+        entry = dict(zip(keys, row))
+        entry["payload"] = json.loads(entry["payload"])
+        entry["headers"] = json.loads(entry["headers"])
+        return entry
+
+    def record(self, delivery_id: str, event: str, repo_key: str, payload: dict, headers: dict) -> bool:
+        """
+        记录新收到的事件, 已经存在时返回False
+        """
+        now = time.time()
+        with self.lock:
+            cursor = self.conn.execute(
+                f"INSERT OR IGNORE INTO webhook_events ({EVENT_FIELDS}) VALUES (?, ?, ?, ?, ?, ?, 0, ?, NULL, ?, ?)",
+                (delivery_id, event, repo_key, json.dumps(payload), json.dumps(headers), STATUS_PENDING,
+                 self.instance_id, now, now))
+            return cursor.rowcount > 0
+
+    def _update_status(self, delivery_id: str, status: str, error: str = None, attempt: bool = False):
+        with self.lock:
+            self.conn.execute(
+                f"UPDATE webhook_events SET status = ?, error = ?, updated_at = ?, owner = ?"
+                f"{', attempts = attempts + 1' if attempt else ''} WHERE delivery_id = ?",
+                (status, error, time.time(), self.instance_id, delivery_id))
+
+    def mark_running(self, delivery_id: str):
+        self._update_status(delivery_id, STATUS_RUNNING, attempt=True)
+
+    def mark_done(self, delivery_id: str):
+        self._update_status(delivery_id, STATUS_DONE)
+
+    def mark_failed(self, delivery_id: str, error: str):
+        self._update_status(delivery_id, STATUS_FAILED, error=error)
+
+    def get(self, delivery_id: str) -> Dict[str, Any] | None:
+        with self.lock:
+            row = self.conn.execute(f"SELECT {EVENT_FIELDS} FROM webhook_events WHERE delivery_id = ?",
+                                    (delivery_id,)).fetchone()
+        return self._row_to_dict(row) if row else None
+
+    def list_events(self, status: str = None, limit: int = 50) -> List[Dict[str, Any]]:
+        """
+        按接收时间倒序列出事件
+        """
+        sql = f"SELECT {EVENT_FIELDS} FROM webhook_events"
+        params = []
+        if status:
+            sql += " WHERE status = ?"
+            params.append(status)
+        sql += " ORDER BY created_at DESC LIMIT ?"
+        params.append(limit)
+        with self.lock:
+            rows = self.conn.execute(sql, params).fetchall()
+        return [self._row_to_dict(row) for row in rows]
+
+    def claim_unfinished(self) -> List[Dict[str, Any]]:
+        """
+        认领已经退出的进程遗留的未完成事件, 按接收顺序返回
+        超过最大尝试次数的事件标记为failed, 避免反复导致进程崩溃的事件无限重放
+        """
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self.conn.execute(
+                    f"SELECT {EVENT_FIELDS} FROM webhook_events WHERE status IN (?, ?) ORDER BY created_at",
+                    UNFINISHED_STATUS).fetchall()
+                alive = {}
+                claimed = []
+                for row in rows:
+                    entry = self._row_to_dict(row)
+                    owner = entry["owner"]
+                    if owner not in alive:
+                        alive[owner] = self.is_owner_alive(owner)
+                    if alive[owner]:
+                        continue
+                    if entry["attempts"] >= self.max_attempts:
+                        self.conn.execute(
+                            "UPDATE webhook_events SET status = ?, error = ?, updated_at = ? WHERE delivery_id = ?",
+                            (STATUS_FAILED, "too many attempts", now, entry["delivery_id"]))
+                        logger.warning(f"Webhook event {entry['delivery_id']} failed {entry['attempts']} times, "
+                                       f"give up")
+                        continue
+                    self.conn.execute(
+                        "UPDATE webhook_events SET status = ?, owner = ?, updated_at = ? WHERE delivery_id = ?",
+                        (STATUS_PENDING, self.instance_id, now, entry["delivery_id"]))
+                    claimed.append(entry)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return claimed
+
+    def prune(self):
+        """
+        删除超过保留时间的已完成和已失败事件
+        """
+        if not self.retention:
+            return
+        with self.lock:
+            cursor = self.conn.execute("DELETE FROM webhook_events WHERE status IN (?, ?) AND updated_at < ?",
+                                       (STATUS_DONE, STATUS_FAILED, time.time() - self.retention))
+        if cursor.rowcount:
+            logger.info(f"Pruned {cursor.rowcount} finished or failed webhook events")
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+            if self.lease_fd is not None:
+                os.close(self.lease_fd)
+                self.lease_fd = None
+                os.remove(self.get_lease_file(self.instance_id))
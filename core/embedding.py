@@ -22,6 +22,7 @@ import numpy as np
 from fastembed import TextEmbedding
 
 from core import settings
+from core.db.embedding_cache import EmbeddingCache
 from core.log import logger
 from core.thread import get_backend_thread_pool
 from core.utils.decorators import singleton_adv
@@ -34,6 +35,7 @@ class EmbeddingModel:
         # 线程锁
         self.lock = threading.Lock()
         self.executor = get_backend_thread_pool()
+        self.cache = None
 
     def load(self):
         with self.lock:
@@ -54,11 +56,25 @@ class EmbeddingModel:
                     local_files_only=local_files_only
                 )
 
+    def warm_up(self):
+        """
+        加载模型并执行一次推理, 不经过缓存, 让首次请求的耗时和稳定状态一致
+        """
+        list(self.get_model().embed(["warm up"]))
+
     def get_model(self) -> TextEmbedding:
         if self.embedding_model is None:
             self.load()
         return self.embedding_model
 
+    def get_cache(self) -> EmbeddingCache | None:
+        if self.cache is None and settings.get_embedding_cache_size() > 0:
+            with self.lock:
+                if self.cache is None:
+                    self.cache = EmbeddingCache(settings.get_embedding_cache_path(), settings.get_embedding_model(),
+                                                settings.get_embedding_cache_size())
+        return self.cache
+
     def normalize_vector(self, vector: np.ndarray) -> np.ndarray:
         """对向量进行L2归一化"""
         norm = np.linalg.norm(vector)
@@ -73,8 +89,13 @@ class EmbeddingModel:
 
     def encode_text(self, text: str, chunk_size: int = 1000) -> np.ndarray:
         """
-        根据文本大小自适应地选择处理方式
+        根据文本大小自适应地选择处理方式, 优先从缓存中读取
         """
+        cache = self.get_cache()
+        if cache:
+            cached = cache.get(text, chunk_size)
+            if cached is not None:
+                return cached
         try:
             model = self.get_model()
             if len(text.split()) <= chunk_size:
@@ -88,10 +109,48 @@ class EmbeddingModel:
                     gc.collect()  # Force garbage collection after each chunk
                 embeddings = np.mean(embeddings, axis=0)
             gc.collect()
-            return self.normalize_vector(embeddings)
+            embeddings = self.normalize_vector(embeddings)
         except Exception as e:
             logger.error(f"Failed to encode text: {e}")
             return np.zeros(model.dim)  # Use the dimension from the model
+        if cache:
+            cache.put(text, embeddings, chunk_size)
+        return embeddings
+
+    def encode_texts(self, texts: List[str], batch_size: int | None = None, chunk_size: int = 1000) -> List[np.ndarray]:
+        """
+        批量编码文本, 短文本按batch_size合并为一次推理, 超长文本仍然走分块编码, 已缓存的文本不再推理
+        """
+        if not texts:
+            return []
+        if not batch_size:
+            batch_size = settings.get_embedding_batch_size()
+        cache = self.get_cache()
+        cached = cache.get_many(texts, chunk_size) if cache else {}
+        embeddings: List[np.ndarray | None] = [cached.get(text) for text in texts]
+        short_indexes = []
+        for i, text in enumerate(texts):
+            if embeddings[i] is not None:
+                continue
+            if len(text.split()) <= chunk_size:
+                short_indexes.append(i)
+            else:
+                embeddings[i] = self.encode_text(text, chunk_size)
+        if short_indexes:
+            try:
+                model = self.get_model()
+                short_texts = [texts[i] for i in short_indexes]
+                for i, embedding in zip(short_indexes, model.embed(short_texts, batch_size=batch_size)):
+                    embeddings[i] = self.normalize_vector(embedding)
+                gc.collect()
+                if cache:
+                    cache.put_many({texts[i]: embeddings[i] for i in short_indexes}, chunk_size)
+            except Exception as e:
+                logger.error(f"Failed to encode texts in batch, fallback to one by one: {e}")
+                for i in short_indexes:
+                    if embeddings[i] is None:
+                        embeddings[i] = self.encode_text(texts[i], chunk_size)
+        return embeddings
 
     def encode_large_document(self, document: str, chunk_size: int = 1000) -> Generator[np.ndarray, None, None]:
         chunks = self.chunk_text(document, chunk_size)
@@ -112,8 +171,14 @@ class EmbeddingModel:
     async def async_encode_text(self, text: str, chunk_size: int = 1000) -> np.ndarray:
         return await self.executor.run_in_thread(self.encode_text, text, chunk_size)
 
+    async def async_encode_texts(self, texts: List[str], batch_size: int | None = None,
+                                 chunk_size: int = 1000) -> List[np.ndarray]:
+        return await self.executor.run_in_thread(self.encode_texts, texts, batch_size, chunk_size)
+
     async def async_process_large_document(self, document: str, chunk_size: int = 1000) -> np.ndarray:
         return await self.executor.run_in_thread(self.process_large_document, document, chunk_size)
 
     def close(self):
         self.executor.shutdown()
+        if self.cache:
+            self.cache.close()
@@ -38,3 +38,7 @@ class GithubApiException(Exception):
         self.response = response
         self.error_code = -1
         self.error_message = None
+
+
+class IndexServiceException(Exception):
+    pass
@@ -6,7 +6,10 @@
 #  may be found in the AUTHORS file in the root of the source tree.
 #
 #
+import asyncio
+import json
 import logging
+from typing import Dict, Tuple, Any, AsyncIterator, Callable
 
 import httpx
 import tenacity
@@ -15,27 +18,62 @@ from openai import AsyncClient
 from core import settings
 from core.log import logger
 from core.models import ModelSettings
+from core.utils.asyncio_utls import RateLimiter, ModelLimiter
 
+LLM_MAX_CONNECTIONS = 100
+LLM_MAX_KEEPALIVE_CONNECTIONS = 20
 
+# (provider, base_url, api_key, proxy) -> (事件循环, 客户端), 同一配置的请求复用同一个连接池
+_client_registry: Dict[Tuple[str, str, str, str], Tuple[asyncio.AbstractEventLoop, Any]] = {}
 
 
-@tenacity.retry(
-    retry=tenacity.retry_if_exception_type(Exception),
-    wait=tenacity.wait_exponential(multiplier=1, min=2, max=5),
-    stop=tenacity.stop_after_attempt(3),
-    before_sleep=tenacity.before_sleep_log(logger, logging.INFO)
-)
-async def call_gemini_api(prompt: str, messages, model: ModelSettings, temperature: float = 0, top_k: float = 1,
-                          top_p: float = 1):
+def create_http_client(proxy: str | None) -> httpx.AsyncClient:
+    return httpx.AsyncClient(timeout=30, proxy=proxy,
+                             limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS,
+                                                 max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS))
+
+
+def get_llm_client(provider: str, base_url: str | None, api_key: str | None) -> Any:
     """
-    call google gemini api
-    :param top_p:
-    :param top_k:
-    :param temperature:
-    :param model:
-    :param prompt:
-    :param messages:
-    :return:
+    获取复用的客户端, openai类接口返回openai.AsyncClient, 其他返回httpx.AsyncClient
+    客户端与创建时的事件循环绑定, 事件循环变化时(例如命令行中多次asyncio.run)重新创建
+    """
+    proxy = settings.get_proxy_url()
+    key = (provider, base_url, api_key, proxy)
+    loop = asyncio.get_running_loop()
+    entry = _client_registry.get(key)
+    if entry is not None and entry[0] is loop:
+        return entry[1]
+    if provider == 'gemini':
+        client = create_http_client(proxy)
+    else:
+        client = AsyncClient(api_key=api_key, base_url=base_url, http_client=create_http_client(proxy))
+    _client_registry[key] = (loop, client)
+    return client
+
+
+async def close_llm_clients():
+    """
+    关闭所有复用的客户端
+    """
+    entries = list(_client_registry.values())
+    _client_registry.clear()
+    for loop, client in entries:
+        if loop.is_closed():
+            continue
+        try:
+            if isinstance(client, httpx.AsyncClient):
+                await client.aclose()
+            else:
+                await client.close()
+        except Exception as e:
+            logger.error(f"Failed to close llm client: {e}")
+
+
+def make_gemini_request(prompt: str, messages, model: ModelSettings, temperature: float, top_k: float, top_p: float,
+                        method: str = "generateContent") -> Tuple[str, str, Dict, Dict]:
+    """
+    构造gemini请求的url, headers和body
     """
     gemini_key = model.api_key
     gemini_model = model.model_name
@@ -43,7 +81,7 @@ async def call_gemini_api(prompt: str, messages, model: ModelSettings, temperatu
         base_url = model.api_url
     else:
         base_url = "https://generativelanguage.googleapis.com"
-    url = f"{base_url}/v1beta/models/{gemini_model}:generateContent?key={gemini_key}"
+    url = f"{base_url}/v1beta/models/{gemini_model}:{method}?key={gemini_key}"
     data = {
         "system_instruction": {
             "parts": {"text": prompt}
@@ -87,26 +125,99 @@ async def call_gemini_api(prompt: str, messages, model: ModelSettings, temperatu
         "Content-Type": "application/json",
         "x-goog-api-key": gemini_key
     }
-    async with httpx.AsyncClient(proxy=settings.get_proxy_url()) as client:
-        response = await client.post(url, headers=headers, json=data, timeout=30)
-        if response.status_code != 200:
-            raise Exception(f"gemini request failed, code={response.status_code}, text={response.text}")
-        result_json = response.json()
-        root = result_json["candidates"][0]
-        if "content" not in root and root["finishReason"] == "SAFETY":
-            logger.error("gemini response: %s", root)
-            return ""
-        translated = root['content']["parts"][0]["text"]
-        lines = translated.split('\n')
-        if len(lines) > 0 and 'maintain' in lines[-1] and 'markdown structure' in lines[-1]:
-            translated = '\n'.join(lines[:-1])
-        return translated
+    return base_url, url, headers, data
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估算文本的token数, 英文约4个字符一个token, 非ASCII字符(例如中文)按每个字符一个token计算
+    """
+    if not text:
+        return 0
+    ascii_count = len(text.encode('ascii', 'ignore'))
+    return ascii_count // 4 + (len(text) - ascii_count) + 1
+
+
+def estimate_request_tokens(prompt: str, messages) -> int:
+    tokens = estimate_tokens(prompt)
+    for message in messages:
+        tokens += estimate_tokens(message.get('content', ''))
+    return tokens
+
+
+async def acquire_limiter(limiter: RateLimiter | ModelLimiter | None, estimated: int):
+    """
+    按预估的token数获取请求额度, 同时受RPM和TPM限制
+    """
+    if limiter is None:
+        return
+    if isinstance(limiter, ModelLimiter):
+        await limiter.acquire(estimated)
+    else:
+        await limiter.acquire()
+
+
+def reconcile_limiter(limiter: RateLimiter | ModelLimiter | None, estimated: int, actual: int | None):
+    if isinstance(limiter, ModelLimiter):
+        limiter.reconcile(estimated, actual)
+
+
+# 非流式接口和流式接口建立连接时共用的重试策略
+RETRY_POLICY = dict(
+    retry=tenacity.retry_if_exception_type(Exception),
+    wait=tenacity.wait_exponential(multiplier=1, min=2, max=5),
+    stop=tenacity.stop_after_attempt(3),
+    before_sleep=tenacity.before_sleep_log(logger, logging.INFO)
+)
+
+
+def clean_response(text: str, strip_quotes: bool = True) -> str:
+    """
+    清理模型的回复: 去掉openai兼容接口包裹在外层的引号, 以及最后一行重复的"maintain markdown structure"提示
+    流式接口返回的文本需要在拼接完整后再调用
+    """
+    if strip_quotes:
+        text = text.strip('\'"')
+    lines = text.split('\n')
+    if len(lines) > 0 and 'maintain' in lines[-1] and 'markdown structure' in lines[-1]:
+        text = '\n'.join(lines[:-1])
+    return text
+
+
+@tenacity.retry(**RETRY_POLICY)
+async def call_gemini_api(prompt: str, messages, model: ModelSettings, temperature: float = 0, top_k: float = 1,
+                          top_p: float = 1, usage: Dict | None = None):
+    """
+    call google gemini api
+    :param usage: 用于返回接口报告的token用量
+    :param top_p:
+    :param top_k:
+    :param temperature:
+    :param model:
+    :param prompt:
+    :param messages:
+    :return:
+    """
+    base_url, url, headers, data = make_gemini_request(prompt, messages, model, temperature, top_k, top_p)
+    client = get_llm_client('gemini', base_url, model.api_key)
+    response = await client.post(url, headers=headers, json=data, timeout=30)
+    if response.status_code != 200:
+        raise Exception(f"gemini request failed, code={response.status_code}, text={response.text}")
+    result_json = response.json()
+    if usage is not None and "usageMetadata" in result_json:
+        usage["total_tokens"] = result_json["usageMetadata"].get("totalTokenCount")
+    root = result_json["candidates"][0]
+    if "content" not in root and root["finishReason"] == "SAFETY":
+        logger.error("gemini response: %s", root)
+        return ""
+    return clean_response(root['content']["parts"][0]["text"], strip_quotes=False)
 
 
 async def call_openai_api(prompt: str, messages, model: ModelSettings, api_base_url=None, temperature: float = 0,
-                          top_k: float = 1, top_p: float = 1):
+                          top_k: float = 1, top_p: float = 1, usage: Dict | None = None):
     """
     call openai api
+    :param usage: 用于返回接口报告的token用量
     :param top_p:
     :param top_k:
     :param temperature:
@@ -121,18 +232,68 @@ async def call_openai_api(prompt: str, messages, model: ModelSettings, api_base_
         prompts.insert(0, {"role": "system", "content": prompt})
     if not api_base_url:
         api_base_url = model.api_url
-    client = AsyncClient(
-        api_key=model.api_key,
-        base_url=api_base_url,
-        http_client=httpx.AsyncClient(timeout=30, proxy=settings.get_proxy_url())
-    )
+    client = get_llm_client(model.provider, api_base_url, model.api_key)
     completion = await client.chat.completions.create(model=model.model_name, messages=prompts,
                                                       temperature=temperature, top_p=top_p)
-    translated = completion.choices[0].message.content.strip('\'"')
-    lines = translated.split('\n')
-    if len(lines) > 0 and 'maintain' in lines[-1] and 'markdown structure' in lines[-1]:
-        translated = '\n'.join(lines[:-1])
-    return translated
+    if usage is not None and completion.usage:
+        usage["total_tokens"] = completion.usage.total_tokens
+    return clean_response(completion.choices[0].message.content)
+
+
+async def stream_gemini_api(prompt: str, messages, model: ModelSettings, temperature: float = 0, top_k: float = 1,
+                            top_p: float = 1, usage: Dict | None = None) -> AsyncIterator[str]:
+    """
+    以流式(SSE)调用google gemini api, 逐段返回生成的文本
+    """
+    base_url, url, headers, data = make_gemini_request(prompt, messages, model, temperature, top_k, top_p,
+                                                       "streamGenerateContent")
+    url = f"{url}&alt=sse"
+    client = get_llm_client('gemini', base_url, model.api_key)
+    async with client.stream("POST", url, headers=headers, json=data, timeout=30) as response:
+        if response.status_code != 200:
+            text = (await response.aread()).decode(errors="ignore")
+            raise Exception(f"gemini request failed, code={response.status_code}, text={text}")
+        async for line in response.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            result_json = json.loads(line[5:])
+            if usage is not None and "usageMetadata" in result_json:
+                usage["total_tokens"] = result_json["usageMetadata"].get("totalTokenCount")
+            root = result_json["candidates"][0]
+            if "content" not in root:
+                if root.get("finishReason") == "SAFETY":
+                    logger.error("gemini response: %s", root)
+                continue
+            for part in root['content'].get("parts", []):
+                if part.get("text"):
+                    yield part["text"]
+
+
+async def stream_openai_api(prompt: str, messages, model: ModelSettings, api_base_url=None, temperature: float = 0,
+                            top_k: float = 1, top_p: float = 1, usage: Dict | None = None) -> AsyncIterator[str]:
+    """
+    以流式调用openai api, 逐段返回生成的文本
+    """
+    prompts = messages.copy()
+    if prompt is not None:
+        prompts.insert(0, {"role": "system", "content": prompt})
+    if not api_base_url:
+        api_base_url = model.api_url
+    client = get_llm_client(model.provider, api_base_url, model.api_key)
+    kwargs = {}
+    if model.provider == 'openai':
+        # 只有官方接口确定支持在流的最后返回用量
+        kwargs["stream_options"] = {"include_usage": True}
+    stream = await client.chat.completions.create(model=model.model_name, messages=prompts,
+                                                  temperature=temperature, top_p=top_p, stream=True, **kwargs)
+    try:
+        async for chunk in stream:
+            if usage is not None and getattr(chunk, "usage", None):
+                usage["total_tokens"] = chunk.usage.total_tokens
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        await stream.close()
 
 
 async def call_ai_api(prompt: str, messages, model: ModelSettings, temperature: float = 0,
@@ -147,17 +308,90 @@ async def call_ai_api(prompt: str, messages, model: ModelSettings, temperature:
     :param top_p:
     :return:
     """
-    await settings.get_api_limiter(model.api_key).acquire()
-    if model.provider == 'openai':
-        return await call_openai_api(prompt, messages, model, temperature, top_k, top_p)
-    elif model.provider == 'gemini':
-        return await call_gemini_api(prompt, messages, model)
-    elif model.provider == 'groq':
-        return await call_openai_api(prompt, messages, model, "https://api.groq.com/openai/v1", 0.1)
-    elif model.provider == 'openai_like':
-        return await call_openai_api(prompt, messages, model, None, 0.1)
-    else:
+    limiter = settings.get_api_limiter(model.api_key)
+    estimated = estimate_request_tokens(prompt, messages)
+    await acquire_limiter(limiter, estimated)
+    usage = {}
+    try:
+        if model.provider == 'openai':
+            return await call_openai_api(prompt, messages, model, temperature=temperature, top_k=top_k, top_p=top_p,
+                                         usage=usage)
+        elif model.provider == 'gemini':
+            return await call_gemini_api(prompt, messages, model, usage=usage)
+        elif model.provider == 'groq':
+            return await call_openai_api(prompt, messages, model, api_base_url="https://api.groq.com/openai/v1",
+                                         temperature=0.1, usage=usage)
+        elif model.provider == 'openai_like':
+            return await call_openai_api(prompt, messages, model, temperature=0.1, usage=usage)
+        else:
+            raise Exception(f"unknown provider {model.provider}")
+    finally:
+        reconcile_limiter(limiter, estimated, usage.get("total_tokens"))
+
+
+async def stream_ai_api(prompt: str, messages, model: ModelSettings, temperature: float = 0,
+                        top_k: float = 1, top_p: float = 1) -> AsyncIterator[str]:
+    """
+    call_ai_api的流式版本, 以异步迭代器逐段返回生成的文本
+    :param prompt:
+    :param messages:
+    :param model:
+    :param temperature:
+    :param top_k:
+    :param top_p:
+    :return:
+    """
+    if model.provider not in ('openai', 'gemini', 'groq', 'openai_like'):
         raise Exception(f"unknown provider {model.provider}")
+    limiter = settings.get_api_limiter(model.api_key)
+    estimated = estimate_request_tokens(prompt, messages)
+    await acquire_limiter(limiter, estimated)
+    usage = {}
+
+    def make_stream() -> AsyncIterator[str]:
+        if model.provider == 'openai':
+            return stream_openai_api(prompt, messages, model, temperature=temperature, top_k=top_k, top_p=top_p,
+                                     usage=usage)
+        elif model.provider == 'gemini':
+            return stream_gemini_api(prompt, messages, model, usage=usage)
+        elif model.provider == 'groq':
+            return stream_openai_api(prompt, messages, model, api_base_url="https://api.groq.com/openai/v1",
+                                     temperature=0.1, usage=usage)
+        return stream_openai_api(prompt, messages, model, temperature=0.1, usage=usage)
+
+    stream = None
+    output_tokens = 0
+    try:
+        stream, first_chunk = await open_stream(make_stream)
+        if first_chunk is not None:
+            output_tokens += estimate_tokens(first_chunk)
+            yield first_chunk
+            async for chunk in stream:
+                output_tokens += estimate_tokens(chunk)
+                yield chunk
+    finally:
+        if stream is not None:
+            await stream.aclose()
+        # 流式接口不一定返回用量, 此时按输入和已输出的文本估算
+        reconcile_limiter(limiter, estimated, usage.get("total_tokens", estimated + output_tokens))
+
+
+async def open_stream(make_stream: Callable[[], AsyncIterator[str]]) -> Tuple[AsyncIterator[str], str | None]:
+    """
+    建立流式请求并读取第一段文本, 429/5xx等错误通常在此阶段出现, 按RETRY_POLICY重试
+    已经开始输出之后的错误不再重试, 避免重复输出
+    :return: (流, 第一段文本), 流为空时第一段文本为None
+    """
+    async for attempt in tenacity.AsyncRetrying(reraise=True, **RETRY_POLICY):
+        with attempt:
+            stream = make_stream()
+            try:
+                return stream, await stream.__anext__()
+            except StopAsyncIteration:
+                return stream, None
+            except BaseException:
+                await stream.aclose()
+                raise
 
 
 async def do_ai_translate(system_prompt: str, messages):
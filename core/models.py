@@ -28,6 +28,8 @@ class Comment(BaseModel):
     url: str
     body: str
     author: Optional[dict] = None
+    # 讨论评论的回复
+    replies: List['Comment'] = []
 
     def get_author(self):
         return self.author.get("login", "Unknown")
@@ -52,6 +54,8 @@ class BaseDetail(BaseModel):
     url: str
     labels: List[Label]
     comments: List[Comment]
+    # 评论第一页之后的分页游标, 为空表示没有更多评论
+    comments_cursor: Optional[str] = None
     model_type_text: str
 
     def get_detail_text(self):
@@ -77,6 +81,7 @@ class DiscussionDetail(BaseDetail):
 class PullRequestDetail(BaseDetail):
     model_type_text: str = DETAIL_TYPE_PR
     reviews: List[Review]
+    reviews_cursor: Optional[str] = None
 
 
 class PullRequest(BaseModel):
@@ -101,6 +106,7 @@ class ModelSettings:
     model_name: str = "custom_model"
     api_key: str = None
     api_request_limit: int = 10
+    api_token_limit: int = 0
     max_input_tokens: int = 1024 * 8
     max_output_tokens: int = 1024 * 8
     provider: str = "openai_rest"
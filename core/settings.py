@@ -25,6 +25,8 @@ DEBUG = env.get_env(constants.ENV_DEBUG, True)
 AUTO_RELOAD = env.get_env(constants.ENV_AUTO_RELOAD, DEBUG)
 WEB_HOOK_WORKERS = env.get_env(constants.ENV_WEB_HOOK_WORKERS, 1)
 WEB_HOOK_ACCESS_LOG = env.get_env(constants.ENV_WEB_HOOK_ACCESS_LOG, DEBUG)
+# 多worker模式下由webhook进程开启, 向量检索和索引交给独立的索引进程处理
+INDEX_SERVICE_ENABLED = False
 
 MEDIA_ROOT = os.path.join(BASE_PATH, '../media')
 MEDIA_URL = '/media/'
@@ -68,6 +70,22 @@ def get_target_lang():
     return get_setting_from_cache(constants.ENV_TRANSLATION_TARGET_LANG, "English")
 
 
+def get_translation_cache_size():
+    return get_setting_from_cache(constants.ENV_TRANSLATION_CACHE_SIZE, 50000)
+
+
+def get_translation_cache_ttl():
+    return get_setting_from_cache(constants.ENV_TRANSLATION_CACHE_TTL, 30 * 24 * 3600)
+
+
+def get_translation_cache_path():
+    return os.path.join(BASE_PATH, './data/.cache/translation_cache.db')
+
+
+def get_translation_concurrency():
+    return get_setting_from_cache(constants.ENV_TRANSLATION_CONCURRENCY, 8)
+
+
 def get_github_token():
     return get_setting_from_cache(constants.ENV_GITHUB_TOKEN)
 
@@ -88,6 +106,32 @@ def get_webhook_listen_port():
     return env.get_env(constants.ENV_WEB_HOOK_LISTEN_PORT, 8000)
 
 
+def get_webhook_queue_workers():
+    """
+    每个webhook进程中处理事件的worker数量
+    """
+    return get_setting_from_cache(constants.ENV_WEB_HOOK_QUEUE_WORKERS, 4)
+
+
+def get_index_socket_path():
+    return get_setting_from_cache(constants.ENV_INDEX_SERVICE_SOCKET, "/tmp/translation/run/index.sock")
+
+
+def get_shared_limiter_path():
+    return "/tmp/translation/run/limiter"
+
+
+def get_webhook_journal_path():
+    return os.path.join(BASE_PATH, './data/.cache/webhook_journal.db')
+
+
+def get_webhook_queue_size():
+    """
+    等待处理的事件上限, 超过后拒绝新的事件
+    """
+    return get_setting_from_cache(constants.ENV_WEB_HOOK_QUEUE_SIZE, 1000)
+
+
 def get_translator():
     return get_setting_from_cache(constants.ENV_TRANSLATOR, "AdvancedGFMTranslator")
 
@@ -104,14 +148,62 @@ def get_api_limiter(key: str):
     return API_LIMITER.get_limiter(key)
 
 
+def get_review_concurrency():
+    """
+    同时审查的文件数量, 不超过审查模型每分钟的请求限制
+    """
+    concurrency = get_setting_from_cache(constants.ENV_REVIEW_CONCURRENCY, 4)
+    if REVIEW_MODEL.api_request_limit:
+        concurrency = min(concurrency, REVIEW_MODEL.api_request_limit)
+    return max(concurrency, 1)
+
+
 def get_embedding_model():
     return get_setting_from_cache(constants.ENV_EMBEDDING_MODEL, "jinaai/jina-embeddings-v2-base-code")
 
 
+def get_embedding_batch_size():
+    return get_setting_from_cache(constants.ENV_EMBEDDING_BATCH_SIZE, 64)
+
+
+def get_embedding_cache_size():
+    return get_setting_from_cache(constants.ENV_EMBEDDING_CACHE_SIZE, 200000)
+
+
+def get_embedding_preload():
+    """
+    webhook启动时是否预加载向量模型和已建立索引的仓库
+    """
+    return get_setting_from_cache(constants.ENV_EMBEDDING_PRELOAD, False)
+
+
+def get_embedding_cache_path():
+    return os.path.join(BASE_PATH, './data/.cache/embedding_cache.db')
+
+
+def get_index_cache_size():
+    return get_setting_from_cache(constants.ENV_INDEX_CACHE_SIZE, 1024)
+
+
 def get_milvus_uri():
     return get_setting_from_cache(constants.ENV_MILVUS_URI, os.path.join(BASE_PATH, './data/milvus.db'))
 
 
+def get_milvus_flush_rows():
+    return get_setting_from_cache(constants.ENV_MILVUS_FLUSH_ROWS, 2000)
+
+
+def get_milvus_flush_bytes():
+    return get_setting_from_cache(constants.ENV_MILVUS_FLUSH_BYTES, 16 * 1024 * 1024)
+
+
+def get_reindex_window():
+    """
+    收到push后等待的秒数, 期间的push合并为一次增量索引
+    """
+    return get_setting_from_cache(constants.ENV_REINDEX_WINDOW, 30)
+
+
 def init_translation_model(need_model=False):
     translation_model = get_setting_from_cache(constants.ENV_TRANSLATION_MODEL, "gemini/gemini-1.5-flash")
     model_info = MODELS.get(translation_model, None)
@@ -125,6 +217,7 @@ def init_translation_model(need_model=False):
     TRANSLATION_MODEL.api_key = get_setting_from_cache(constants.ENV_TRANSLATION_API_KEY)
     TRANSLATION_MODEL.api_url = get_setting_from_cache(constants.ENV_TRANSLATION_API_URL)
     TRANSLATION_MODEL.api_request_limit = get_setting_from_cache(constants.ENV_TRANSLATION_API_REQUEST_LIMIT, 10)
+    TRANSLATION_MODEL.api_token_limit = get_setting_from_cache(constants.ENV_TRANSLATION_API_TOKEN_LIMIT, 0)
     TRANSLATION_MODEL.max_input_tokens = get_setting_from_cache(constants.ENV_TRANSLATION_API_MAX_INPUT_TOKENS,
                                                                 model_info.get("max_input_tokens", 1024 * 4))
     TRANSLATION_MODEL.max_output_tokens = get_setting_from_cache(constants.ENV_TRANSLATION_API_MAX_OUTPUT_TOKENS,
@@ -134,7 +227,8 @@ def init_translation_model(need_model=False):
     if not TRANSLATION_MODEL.api_key:
         console.print(f"Warning: {constants.ENV_TRANSLATION_API_KEY} is not set", style="bold red")
         return False
-    API_LIMITER.add_limiter_by_limit(TRANSLATION_MODEL.api_key, TRANSLATION_MODEL.api_request_limit)
+    API_LIMITER.add_limiter_by_limit(TRANSLATION_MODEL.api_key, TRANSLATION_MODEL.api_request_limit,
+                                     token_limit=TRANSLATION_MODEL.api_token_limit)
 
 
 def init_review_model(need_model=False):
@@ -150,6 +244,7 @@ def init_review_model(need_model=False):
     REVIEW_MODEL.api_key = get_setting_from_cache(constants.ENV_REVIEW_API_KEY)
     REVIEW_MODEL.api_url = get_setting_from_cache(constants.ENV_REVIEW_API_URL)
     REVIEW_MODEL.api_request_limit = get_setting_from_cache(constants.ENV_REVIEW_API_REQUEST_LIMIT, 10)
+    REVIEW_MODEL.api_token_limit = get_setting_from_cache(constants.ENV_REVIEW_API_TOKEN_LIMIT, 0)
     REVIEW_MODEL.max_input_tokens = get_setting_from_cache(constants.ENV_REVIEW_API_MAX_INPUT_TOKENS,
                                                            model_info.get("max_input_tokens", 1024 * 4))
     REVIEW_MODEL.max_output_tokens = get_setting_from_cache(constants.ENV_REVIEW_API_MAX_OUTPUT_TOKENS,
@@ -159,7 +254,8 @@ def init_review_model(need_model=False):
     if not REVIEW_MODEL.api_key:
         console.print(f"Warning: {constants.ENV_REVIEW_API_KEY} is not set", style="bold red")
         return False
-    API_LIMITER.add_limiter_by_limit(REVIEW_MODEL.api_key, REVIEW_MODEL.api_request_limit)
+    API_LIMITER.add_limiter_by_limit(REVIEW_MODEL.api_key, REVIEW_MODEL.api_request_limit,
+                                     token_limit=REVIEW_MODEL.api_token_limit)
 
 
 def setup_translation_env(github_token: str, model_name: str, api_key: str, api_url=None, proxy_url=None):
@@ -5,13 +5,19 @@
 #  LICENSE file in the root of the source tree. All contributing project authors
 #  may be found in the AUTHORS file in the root of the source tree.
 #
+from typing import Dict
+
+from core import settings
 from .backend import SimpleSplitGFMTranslator, AdvancedGFMTranslator, BaseGFMTranslator
 from .utils import wrap_magic, clean_body, already_english, TRANS_MAGIC, TRANS_DELIMITER, TRANS_DELIMITER_PR, \
     TRANSLATION_MARK, BATCH_SIZE, find_cpp_files, extract_comments, is_already_translated, format_translated_comment,\
     validate_code
 
 
-def get_translator(translator_type: str, **kwargs) -> BaseGFMTranslator:
+_TRANSLATORS: Dict[tuple, BaseGFMTranslator] = {}
+
+
+def create_translator(translator_type: str, **kwargs) -> BaseGFMTranslator:
     if translator_type == "SimpleSplitGFMTranslator":
         return SimpleSplitGFMTranslator(**kwargs)
     elif translator_type == "AdvancedGFMTranslator":
@@ -19,3 +25,16 @@ def get_translator(translator_type: str, **kwargs) -> BaseGFMTranslator:
     else:
         return SimpleSplitGFMTranslator(**kwargs)
 
+
+def get_translator(translator_type: str, **kwargs) -> BaseGFMTranslator:
+    """
+    获取翻译器, 相同配置(翻译器类型, max_tokens, 目标语言)的翻译器只创建一次
+    翻译器实例不保存翻译过程中的状态, 可以在并发任务之间共享
+    """
+    key = (translator_type, settings.get_target_lang(), tuple(sorted(kwargs.items())))
+    translator = _TRANSLATORS.get(key)
+    if translator is None:
+        translator = create_translator(translator_type, **kwargs)
+        _TRANSLATORS[key] = translator
+    return translator
+
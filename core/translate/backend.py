@@ -10,6 +10,8 @@ import asyncio
 import json
 import os.path
 import re
+import threading
+import time
 from typing import Dict, Tuple, List
 
 import emoji
@@ -19,11 +21,113 @@ from mistletoe.block_token import BlockToken, Paragraph, SetextHeading, Heading
 from mistletoe.span_token import RawText, Strong, LineBreak
 
 from core import settings
+from core.db.translation_cache import TranslationCache
 from core.llm import do_ai_translate
 from core.log import logger
 from core.translate.utils import clean_body, TRANS_MAGIC
 
 
+class PresetTranslations:
+    """
+    预设翻译, 所有词条编译为一个正则, 一次扫描完成替换
+    按长度从长到短排列候选项, 同一位置优先匹配最长的词条
+    文件修改后自动重新加载
+    """
+    # 检查文件是否修改的最小间隔(秒)
+    CHECK_INTERVAL = 1
+
+    def __init__(self, preset_file: str):
+        self.preset_file = preset_file
+        self.translations: Dict[str, str] = {}
+        self.pattern: re.Pattern | None = None
+        self.mtime = None
+        self.last_check = 0
+        self.lock = threading.Lock()
+        self.check_reload(force=True)
+
+    def _get_mtime(self):
+        try:
+            return os.path.getmtime(self.preset_file)
+        except OSError:
+            return None
+
+    def check_reload(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.last_check < self.CHECK_INTERVAL:
+            return
+        self.last_check = now
+        mtime = self._get_mtime()
+        if not force and mtime == self.mtime:
+            return
+        with self.lock:
+            try:
+                with open(self.preset_file, 'r', encoding='utf-8') as f:
+                    translations = json.load(f)
+            except FileNotFoundError:
+                translations = {}
+            except json.JSONDecodeError as e:
+                logger.error(f"Failed to load preset translations {self.preset_file}: {e}")
+                return
+            self.compile(translations)
+            self.mtime = mtime
+
+    def compile(self, translations: Dict[str, str]):
+        translations = {original: translation for original, translation in translations.items() if original}
+        if translations:
+            keys = sorted(translations.keys(), key=len, reverse=True)
+            self.pattern = re.compile("|".join(re.escape(key) for key in keys))
+        else:
+            self.pattern = None
+        self.translations = translations
+
+    def translate(self, markdown: str) -> str:
+        self.check_reload()
+        pattern, translations = self.pattern, self.translations
+        if pattern is None:
+            return markdown
+        return pattern.sub(lambda match: translations[match.group(0)], markdown)
+
+    def save(self, translations: Dict[str, str]):
+        with self.lock:
+            with open(self.preset_file, 'w', encoding='utf-8') as f:
+                json.dump(translations, f, ensure_ascii=False, indent=2)
+            self.compile(translations)
+            self.mtime = self._get_mtime()
+
+
+_preset_translations: Dict[str, PresetTranslations] = {}
+_preset_translations_lock = threading.Lock()
+
+
+def get_preset_translations(preset_file: str) -> PresetTranslations:
+    """
+    同一个预设文件在所有翻译器实例之间共享
+    """
+    if preset_file not in _preset_translations:
+        with _preset_translations_lock:
+            if preset_file not in _preset_translations:
+                _preset_translations[preset_file] = PresetTranslations(preset_file)
+    return _preset_translations[preset_file]
+
+
+_translation_cache: TranslationCache | None = None
+_translation_cache_lock = threading.Lock()
+
+
+def get_translation_cache() -> TranslationCache | None:
+    """
+    获取全局共享的翻译缓存, TRANSLATION_CACHE_SIZE为0时不使用缓存
+    """
+    global _translation_cache
+    if _translation_cache is None and settings.get_translation_cache_size() > 0:
+        with _translation_cache_lock:
+            if _translation_cache is None:
+                _translation_cache = TranslationCache(settings.get_translation_cache_path(),
+                                                      settings.get_translation_cache_size(),
+                                                      settings.get_translation_cache_ttl())
+    return _translation_cache
+
+
 def get_translator_prompt(to_language: str) -> str:
     translator_prompt = (
         "You are a translation engine, you can only translate text and cannot interpret it, and do not explain. "
@@ -65,19 +169,18 @@ class BaseGFMTranslator(abc.ABC):
     def __init__(self, max_tokens=4000, preset_file='preset_translations.json'):
         self.max_tokens = max_tokens
         self.preset_file = os.path.join(settings.BASE_PATH, f"./data/{preset_file}")
-        self.placeholder_counter = 0
-        self.preset_translations = self.load_preset_translations()
+        self.presets = get_preset_translations(self.preset_file)
+
+    @property
+    def preset_translations(self) -> Dict[str, str]:
+        return self.presets.translations
 
     def load_preset_translations(self) -> Dict[str, str]:
-        try:
-            with open(self.preset_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except FileNotFoundError:
-            return {}
+        self.presets.check_reload(force=True)
+        return self.presets.translations
 
     def save_preset_translations(self, cache: Dict[str, str]):
-        with open(self.preset_file, 'w', encoding='utf-8') as f:
-            json.dump(cache, f, ensure_ascii=False, indent=2)
+        self.presets.save(cache)
 
     def check_english(self, text: str) -> bool:
         for c in text:
@@ -86,9 +189,7 @@ class BaseGFMTranslator(abc.ABC):
         return True
 
     def do_preset_translation(self, markdown: str) -> str:
-        for original, translation in self.preset_translations.items():
-            markdown = markdown.replace(original, translation)
-        return markdown
+        return self.presets.translate(markdown)
 
     async def translate(self, markdown: str, is_markdown=True) -> tuple[None, bool, bool] | tuple[str, bool, bool]:
         if self.check_english(markdown):
@@ -99,6 +200,24 @@ class BaseGFMTranslator(abc.ABC):
         return await self.do_translate(markdown, is_markdown)
 
     async def do_gpt_translate(self, system_prompt: str, messages: List[Dict[str, str]]) -> tuple[str, bool]:
+        """
+        调用模型翻译, 相同的内容优先从翻译缓存中读取
+        """
+        cache = get_translation_cache()
+        text = "\n".join(message['content'] for message in messages)
+        model_name = settings.TRANSLATION_MODEL.model_name
+        target_lang = settings.get_target_lang()
+        if cache:
+            cached = cache.get(model_name, target_lang, system_prompt, text)
+            if cached is not None:
+                logger.info("Translation cache hit")
+                return cached, True
+        translated, trans_success = await self.request_gpt_translate(system_prompt, messages)
+        if cache and trans_success and translated:
+            cache.put(model_name, target_lang, system_prompt, text, translated)
+        return translated, trans_success
+
+    async def request_gpt_translate(self, system_prompt: str, messages: List[Dict[str, str]]) -> tuple[str, bool]:
         retry = 3
         translated = None
         for i in range(retry):
@@ -296,8 +415,8 @@ class AdvancedGFMTranslator(BaseGFMTranslator):
 
     def _replace_and_extract(self, pattern: str, md: str, extracts: Dict[str, str], desc: str) -> str:
         def repl(match):
-            self.placeholder_counter += 1
-            placeholder = f"__PLACEHOLDER_{self.placeholder_counter}_{desc}__"
+            # 占位符的序号取自本次调用的extracts, 实例中不保存可变状态, 便于在并发任务间共享
+            placeholder = f"__PLACEHOLDER_{len(extracts) + 1}_{desc}__"
             extracts[placeholder] = match.group(0)
             return placeholder
 
@@ -313,8 +432,7 @@ class AdvancedGFMTranslator(BaseGFMTranslator):
 
             # Only replace the content if it contains no more HTML tags
             if not re.search(pattern, content):
-                self.placeholder_counter += 1
-                placeholder = f"__PLACEHOLDER_{self.placeholder_counter}_{desc}__"
+                placeholder = f"__PLACEHOLDER_{len(extracts) + 1}_{desc}__"
                 extracts[placeholder] = f"<{tag}>{content}</{tag.split()[0]}>"
                 return placeholder
             else:
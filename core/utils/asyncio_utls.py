@@ -8,8 +8,12 @@
 __author__ = 'alex'
 
 import asyncio
+import fcntl
+import hashlib
+import json
+import os
 import time
-from asyncio import Queue
+from collections import deque
 
 
 def use_uvloop():
@@ -30,51 +34,224 @@ def use_uvloop():
 
 
 class RateLimiter:
-    def __init__(self, rate_limit, time_unit=60):
+    """
+    基于单调时钟的令牌桶, 每time_unit秒补充rate_limit个令牌, 桶容量默认等于rate_limit
+    等待者按FIFO顺序获取令牌, 每次只需按缺少的令牌数精确休眠一次
+    """
+
+    def __init__(self, rate_limit, time_unit=60, capacity=None):
         self.rate_limit = rate_limit
         self.time_unit = time_unit
-        self.token_bucket = Queue()
+        self.capacity = capacity or rate_limit
+        self.tokens = float(self.capacity)
         self.last_check = time.monotonic()
+        self.lock = None
+        self.lock_loop = None
+        # 最近一个time_unit内的获取记录(时间, 令牌数), 用于统计当前速率
+        self.history = deque()
+        self.total_acquired = 0
+        self.total_requests = 0
+        self.total_wait_time = 0.0
+
+    @property
+    def fill_rate(self) -> float:
+        return self.rate_limit / self.time_unit
 
-    async def add_token(self):
+    def _refill(self):
         now = time.monotonic()
-        time_passed = now - self.last_check
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_check) * self.fill_rate)
         self.last_check = now
 
-        tokens_to_add = time_passed * (self.rate_limit / self.time_unit)
-        for _ in range(int(tokens_to_add)):
-            await self.token_bucket.put(1)
+    def _get_lock(self) -> asyncio.Lock:
+        # asyncio.Lock与事件循环绑定, 命令行中可能多次asyncio.run
+        loop = asyncio.get_running_loop()
+        if self.lock is None or self.lock_loop is not loop:
+            self.lock = asyncio.Lock()
+            self.lock_loop = loop
+        return self.lock
+
+    async def acquire(self, n=1):
+        """
+        获取n个令牌, 令牌不足时休眠到足够的时刻
+        n大于桶容量时, 只需等到桶满即可获取, 超出的部分记为欠账, 由后续的补充抵扣
+        """
+        start = time.monotonic()
+        # asyncio.Lock按FIFO顺序唤醒等待者, 保证先来的请求先获取令牌
+        async with self._get_lock():
+            need = min(n, self.capacity)
+            while (wait := self._take(need, n)) > 0:
+                await asyncio.sleep(wait)
+        now = time.monotonic()
+        self.total_acquired += n
+        self.total_requests += 1
+        self.total_wait_time += now - start
+        self.history.append((now, n))
+        self._prune_history(now)
+
+    def _take(self, need, n) -> float:
+        """
+        令牌数不少于need时扣除n个令牌并返回0, 否则返回需要等待的秒数
+        """
+        self._refill()
+        if self.tokens >= need:
+            self.tokens -= n
+            return 0
+        return (need - self.tokens) / self.fill_rate
+
+    def adjust(self, n):
+        """
+        修正已获取的令牌数, n为正数时追加扣除, 为负数时归还
+        """
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - n)
+        self.total_acquired += n
+        self.history.append((time.monotonic(), n))
+
+    def _prune_history(self, now: float):
+        while self.history and now - self.history[0][0] > self.time_unit:
+            self.history.popleft()
+
+    def get_current_rate(self) -> float:
+        """
+        最近一个time_unit内获取的令牌数
+        """
+        self._prune_history(time.monotonic())
+        return sum(n for _, n in self.history)
+
+    def get_stats(self) -> dict:
+        self._refill()
+        return {
+            "rate_limit": self.rate_limit,
+            "time_unit": self.time_unit,
+            "available_tokens": self.tokens,
+            "current_rate": self.get_current_rate(),
+            "total_acquired": self.total_acquired,
+            "total_requests": self.total_requests,
+            "average_wait_time": self.total_wait_time / self.total_requests if self.total_requests else 0.0,
+        }
+
+
+class SharedRateLimiter(RateLimiter):
+    """
+    多进程共享的令牌桶, 桶的状态保存在state_path文件中, 通过文件锁保证各进程之间的扣除是原子的
+    进程内仍然通过asyncio.Lock保证FIFO, 统计信息只包含当前进程
+    """
 
-        if self.token_bucket.qsize() > self.rate_limit:
-            self.token_bucket = Queue()
-            for _ in range(self.rate_limit):
-                await self.token_bucket.put(1)
+    def __init__(self, rate_limit, state_path: str, time_unit=60, capacity=None):
+        super().__init__(rate_limit, time_unit, capacity)
+        self.state_path = state_path
+        if not os.path.exists(os.path.dirname(state_path)):
+            os.makedirs(os.path.dirname(state_path), exist_ok=True)
 
-    async def acquire(self):
-        while self.token_bucket.empty():
-            await self.add_token()
-            if self.token_bucket.empty():
-                await asyncio.sleep(1 / (self.rate_limit / self.time_unit))
-        await self.token_bucket.get()
+    def _update_state(self, update) -> float:
+        """
+        在文件锁内读取并补充令牌, 调用update(tokens) -> (tokens, result)后写回, 返回result
+        多个进程使用同一个系统时钟, 所以用time.time()记录上次补充的时间
+        """
+        fd = os.open(self.state_path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            raw = os.read(fd, 1024)
+            now = time.time()
+            tokens = float(self.capacity)
+            if raw:
+                state = json.loads(raw)
+                tokens = min(self.capacity, state["tokens"] + max(now - state["last_check"], 0) * self.fill_rate)
+            tokens, result = update(tokens)
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.ftruncate(fd, 0)
+            os.write(fd, json.dumps({"tokens": tokens, "last_check": now}).encode())
+            self.tokens = tokens
+            return result
+        finally:
+            # 关闭文件时释放锁
+            os.close(fd)
+
+    def _refill(self):
+        self._update_state(lambda tokens: (tokens, 0))
+
+    def _take(self, need, n) -> float:
+        def update(tokens):
+            if tokens >= need:
+                return tokens - n, 0
+            return tokens, (need - tokens) / self.fill_rate
+
+        return self._update_state(update)
+
+    def adjust(self, n):
+        self._update_state(lambda tokens: (min(self.capacity, tokens - n), 0))
+        self.total_acquired += n
+        self.history.append((time.monotonic(), n))
+
+
+class ModelLimiter:
+    """
+    同时限制每分钟请求数(RPM)和每分钟token数(TPM)的限流器, token_limit为0时只限制请求数
+    acquire时按预估的token数扣除, 请求完成后通过reconcile按实际用量修正
+    """
+
+    def __init__(self, rate_limit, token_limit=0, time_unit=60, state_path: str = None):
+        if state_path:
+            # 多进程共享额度
+            self.request_limiter = SharedRateLimiter(rate_limit, f"{state_path}.requests", time_unit)
+            self.token_limiter = SharedRateLimiter(token_limit, f"{state_path}.tokens",
+                                                   time_unit) if token_limit else None
+        else:
+            self.request_limiter = RateLimiter(rate_limit, time_unit)
+            self.token_limiter = RateLimiter(token_limit, time_unit) if token_limit else None
+
+    async def acquire(self, n=0):
+        """
+        获取一次请求的额度
+        :param n: 预估消耗的token数
+        """
+        await self.request_limiter.acquire()
+        if self.token_limiter and n > 0:
+            await self.token_limiter.acquire(n)
+
+    def reconcile(self, estimated, actual):
+        """
+        根据接口返回的实际用量修正token额度
+        """
+        if self.token_limiter and actual is not None:
+            self.token_limiter.adjust(actual - estimated)
+
+    def get_stats(self) -> dict:
+        stats = {"requests": self.request_limiter.get_stats()}
+        if self.token_limiter:
+            stats["tokens"] = self.token_limiter.get_stats()
+        return stats
 
 
 class ApiLimiter:
     def __init__(self):
-        self.limiters: dict[str, RateLimiter] = {}
+        self.limiters: dict[str, RateLimiter | ModelLimiter] = {}
+        # 设置后新建的限流器在多个进程之间共享额度
+        self.shared_path = None
+
+    def enable_shared(self, shared_path: str):
+        self.shared_path = shared_path
 
-    def add_limiter(self, key: str, limiter: RateLimiter):
+    def add_limiter(self, key: str, limiter: RateLimiter | ModelLimiter):
         self.limiters[key] = limiter
 
-    def add_limiter_by_limit(self, key: str, rate_limit: int, time_unit: int = 60):
-        limiter = RateLimiter(rate_limit, time_unit)
+    def add_limiter_by_limit(self, key: str, rate_limit: int, time_unit: int = 60, token_limit: int = 0):
+        state_path = None
+        if self.shared_path:
+            # 以api key为键, 文件名中不能出现明文
+            state_path = os.path.join(self.shared_path, hashlib.md5(key.encode()).hexdigest())
+        limiter = ModelLimiter(rate_limit, token_limit, time_unit, state_path)
         self.limiters[key] = limiter
 
-    def get_limiter(self, key: str) -> RateLimiter:
+    def get_limiter(self, key: str) -> RateLimiter | ModelLimiter:
         return self.limiters.get(key, None)
 
-    def get_limiters(self) -> dict[str, RateLimiter]:
+    def get_limiters(self) -> dict[str, RateLimiter | ModelLimiter]:
         return self.limiters
 
+    def get_stats(self) -> dict[str, dict]:
+        return {key: limiter.get_stats() for key, limiter in self.limiters.items()}
+
     def remove_limiter(self, key: str):
         self.limiters.pop(key, None)
 
@@ -11,7 +11,8 @@ import base64
 import hashlib
 import hmac
 import logging
-from typing import Optional
+from contextlib import asynccontextmanager
+from typing import Optional, AsyncIterator, List
 from urllib.parse import urlparse
 
 import httpx
@@ -20,7 +21,7 @@ from pydantic import BaseModel
 
 from core import settings
 from core.exception import GithubGraphQLException, GithubApiException
-from core.models import IssueDetail, DiscussionDetail, PullRequestDetail, Label
+from core.models import IssueDetail, DiscussionDetail, PullRequestDetail, Label, Comment, Review
 
 ALLOWED_EVENTS = ['pull_request', 'pull_request_review', 'pull_request_review_comment', 'issues', 'issue_comment',
                   'discussion', 'discussion_comment', 'commit_comment', "push"]
@@ -30,13 +31,67 @@ LABEL_ENGLISH_NATIVE = Label(name="EnglishNative", color="C3A138", description="
 IGNORE_LOGIN = 'dependabot'
 GITHUB_REST_API = "https://api.github.com"
 
+GITHUB_MAX_CONNECTIONS = 100
+GITHUB_MAX_KEEPALIVE_CONNECTIONS = 20
+GITHUB_KEEPALIVE_EXPIRY = 60
+# GraphQL connection单页最多返回100条
+GRAPHQL_PAGE_SIZE = 100
+# 单次搜索最多能翻页获取的结果数量
+SEARCH_RESULT_LIMIT = 1000
+
 logger = logging.getLogger(__name__)
 
+# 进程内共享的GitHub客户端, 由webhook服务启动时创建, 停止时关闭
+_shared_client: httpx.AsyncClient | None = None
+
 
 def custom_retry_condition(exception):
     return not isinstance(exception, GithubApiException)
 
 
+def create_github_client() -> httpx.AsyncClient:
+    """
+    创建带连接池的GitHub客户端, 安装了h2时启用HTTP/2
+    """
+    try:
+        import h2  # noqa: F401
+        http2 = True
+    except ImportError:
+        http2 = False
+    return httpx.AsyncClient(timeout=30, follow_redirects=True, http2=http2,
+                             limits=httpx.Limits(max_connections=GITHUB_MAX_CONNECTIONS,
+                                                 max_keepalive_connections=GITHUB_MAX_KEEPALIVE_CONNECTIONS,
+                                                 keepalive_expiry=GITHUB_KEEPALIVE_EXPIRY))
+
+
+def init_github_client() -> httpx.AsyncClient:
+    global _shared_client
+    if _shared_client is None:
+        _shared_client = create_github_client()
+    return _shared_client
+
+
+async def close_github_client():
+    global _shared_client
+    if _shared_client is not None:
+        client, _shared_client = _shared_client, None
+        await client.aclose()
+
+
+@asynccontextmanager
+async def github_client(http_client: httpx.AsyncClient = None) -> AsyncIterator[httpx.AsyncClient]:
+    """
+    获取GitHub客户端, 优先使用传入的客户端, 其次使用共享客户端, 都没有时(例如命令行)创建临时客户端
+    """
+    if http_client:
+        yield http_client
+    elif _shared_client is not None:
+        yield _shared_client
+    else:
+        async with create_github_client() as client:
+            yield client
+
+
 class RepoDetail(BaseModel):
     url: str
     owner: str
@@ -123,8 +178,8 @@ def parse_commit_comment_url(url: str) -> RepoDetail:
     return RepoDetail(url=url, owner=url_path_list[1], name=url_path_list[2], number=int(url_path_list[4]))
 
 
-async def do_post_requests(json_data):
-    async with httpx.AsyncClient(timeout=30, follow_redirects=True) as client:
+async def do_post_requests(json_data, http_client: httpx.AsyncClient = None):
+    async with github_client(http_client) as client:
         response = await client.post('https://api.github.com/graphql',
                                      json=json_data,
                                      headers=get_graphql_headers())
@@ -136,8 +191,8 @@ async def do_post_requests(json_data):
         return result
 
 
-async def do_rest_path_requests(path, json_data):
-    async with httpx.AsyncClient(timeout=30, follow_redirects=True) as client:
+async def do_rest_path_requests(path, json_data, http_client: httpx.AsyncClient = None):
+    async with github_client(http_client) as client:
         response = await client.patch(get_github_rest_api_endpoint(path),
                                       json=json_data,
                                       headers=get_rest_headers())
@@ -148,15 +203,7 @@ async def do_rest_path_requests(path, json_data):
 
 
 async def do_rest_put_requests(path, json_data, http_client: httpx.AsyncClient = None):
-    if http_client:
-        response = await http_client.put(get_github_rest_api_endpoint(path),
-                                         json=json_data,
-                                         headers=get_rest_headers())
-        if response.status_code not in [201, 200]:
-            raise GithubApiException(f"request failed, code={response.status_code}, text={response.text}", response)
-        result = response.json()
-        return result
-    async with httpx.AsyncClient(timeout=30, follow_redirects=True) as client:
+    async with github_client(http_client) as client:
         response = await client.put(get_github_rest_api_endpoint(path),
                                     json=json_data,
                                     headers=get_rest_headers())
@@ -167,15 +214,7 @@ async def do_rest_put_requests(path, json_data, http_client: httpx.AsyncClient =
 
 
 async def do_rest_post_requests(path, json_data, http_client: httpx.AsyncClient = None):
-    if http_client:
-        response = await http_client.post(get_github_rest_api_endpoint(path),
-                                          json=json_data,
-                                          headers=get_rest_headers())
-        if response.status_code not in [201, 200]:
-            raise GithubApiException(f"request failed, code={response.status_code}, text={response.text}", response)
-        result = response.json()
-        return result
-    async with httpx.AsyncClient(timeout=30, follow_redirects=True) as client:
+    async with github_client(http_client) as client:
         response = await client.post(get_github_rest_api_endpoint(path),
                                      json=json_data,
                                      headers=get_rest_headers())
@@ -191,12 +230,7 @@ async def do_rest_post_requests(path, json_data, http_client: httpx.AsyncClient
     before_sleep=tenacity.before_sleep_log(logger, logging.WARNING)
 )
 async def do_rest_get_requests(path, http_client: httpx.AsyncClient = None):
-    if http_client:
-        response = await http_client.get(get_github_rest_api_endpoint(path), headers=get_rest_headers())
-        if response.status_code != 200:
-            raise GithubApiException(f"request failed, code={response.status_code}, text={response.text}", response)
-        return response.json()
-    async with httpx.AsyncClient(timeout=30, follow_redirects=True) as client:
+    async with github_client(http_client) as client:
         response = await client.get(get_github_rest_api_endpoint(path), headers=get_rest_headers())
         if response.status_code != 200:
             raise GithubApiException(f"request failed, code={response.status_code}, text={response.text}", response)
@@ -227,12 +261,7 @@ async def get_file_content(repo_name: str, file_path: str, ref: str, http_client
 
 
 async def get_file_content_by_raw_url(url: str, http_client: httpx.AsyncClient = None) -> str:
-    if http_client:
-        response = await http_client.get(url)
-        if response.status_code != 200:
-            raise GithubApiException(f"request failed, code={response.status_code}, text={response.text}", response)
-        return response.text
-    async with httpx.AsyncClient(timeout=30, follow_redirects=True) as client:
+    async with github_client(http_client) as client:
         response = await client.get(url)
         if response.status_code != 200:
             raise GithubApiException(f"request failed, code={response.status_code}, text={response.text}", response)
@@ -259,147 +288,253 @@ async def get_pr_files(repo_name: str, pr_number: int, http_client: httpx.AsyncC
     return await do_rest_get_requests(path, http_client)
 
 
+COMMENT_FIELDS = '''
+                  id
+                  author {
+                    login
+                  }
+                  url
+                  body
+'''
+PAGE_INFO_FIELDS = '''
+                pageInfo {
+                  hasNextPage
+                  endCursor
+                }
+'''
+
+
+def get_next_cursor(connection: dict) -> str | None:
+    """
+    获取connection下一页的游标, 没有下一页时返回None
+    """
+    page_info = connection['pageInfo']
+    return page_info['endCursor'] if page_info['hasNextPage'] else None
+
+
+def fix_ghost_author(nodes: list):
+    # See https://github.com/ghost
+    for node in nodes:
+        if 'author' not in node or node['author'] is None:
+            node['author'] = {'login': 'ghost'}
+
+
+async def iter_graphql_pages(query: str, variables: dict, path: list, after: str = None,
+                             page_size: int = GRAPHQL_PAGE_SIZE) -> AsyncIterator[list]:
+    """
+    按pageInfo游标分页执行GraphQL查询, 以异步生成器逐页返回path所指connection的nodes
+    :param query: 查询语句, 需要接收$first和$after参数, connection需要返回pageInfo
+    :param variables: 除分页外的查询参数
+    :param path: 从data到connection的字段路径
+    :param after: 起始游标, 为空时从第一页开始
+    :param page_size: 每页数量, 最大100
+    """
+    while True:
+        result = await do_post_requests({"query": query, "variables": {
+            **variables, "first": min(page_size, GRAPHQL_PAGE_SIZE), "after": after
+        }})
+        connection = result['data']
+        for key in path:
+            connection = connection[key] if connection else None
+        if not connection:
+            break
+        yield connection['nodes']
+        after = get_next_cursor(connection)
+        if after is None:
+            break
+
+
+def get_detail_variables(repo_model: RepoDetail) -> dict:
+    return {"owner": repo_model.owner, "name": repo_model.name, "number": repo_model.number}
+
+
 async def query_issue(repo_model: RepoDetail) -> IssueDetail:
-    query = '''
-        query ($owner: String!, $name: String!, $number: Int!) {
-          repository(name: $name, owner: $owner) {
-            issue(number: $number) {
+    """
+    查询issue及第一页评论, 后续评论通过iter_issue_comments分页获取
+    """
+    query = f'''
+        query ($owner: String!, $name: String!, $number: Int!) {{
+          repository(name: $name, owner: $owner) {{
+            issue(number: $number) {{
               id
               title
               body
-              labels(first: 100) {
+              labels(first: 100) {{
                 totalCount
-                nodes {
+                nodes {{
                   id
                   name
-                }
-              }
-              comments(first: 100) {
+                }}
+              }}
+              comments(first: {GRAPHQL_PAGE_SIZE}) {{
                 totalCount
-                nodes {
-                  id
-                  author {
-                    login
-                  }
-                  url
-                  body
-                }
-              }
-            }
-          }
-        }
+                nodes {{{COMMENT_FIELDS}                }}{PAGE_INFO_FIELDS}              }}
+            }}
+          }}
+        }}
     '''
 
-    result = await do_post_requests({"query": query, "variables": repo_model.dict()})
+    result = await do_post_requests({"query": query, "variables": get_detail_variables(repo_model)})
+    issue = result['data']['repository']['issue']
 
-    total_labels = result['data']['repository']['issue']['labels']['totalCount']
+    total_labels = issue['labels']['totalCount']
     if total_labels > 100:
         raise Exception(f"too many labels, count={total_labels} {result}")
 
-    total_comments = result['data']['repository']['issue']['comments']['totalCount']
-    if total_comments > 100:
-        raise Exception(f"too many comments, count={total_comments} {result}")
-
-    # See https://github.com/ghost
-    for c in result['data']['repository']['issue']['comments']['nodes']:
-        if 'author' not in c or c['author'] is None:
-            c['author'] = {'login': 'ghost'}
+    fix_ghost_author(issue['comments']['nodes'])
 
     result_data = {
-        'id': result['data']['repository']['issue']['id'],
-        'title': result['data']['repository']['issue']['title'],
-        'body': result['data']['repository']['issue']['body'],
-        'labels': result['data']['repository']['issue']['labels']['nodes'],
-        "comments": result['data']['repository']['issue']['comments']['nodes'],
+        'id': issue['id'],
+        'title': issue['title'],
+        'body': issue['body'],
+        'labels': issue['labels']['nodes'],
+        "comments": issue['comments']['nodes'],
+        "comments_cursor": get_next_cursor(issue['comments']),
         "url": repo_model.url
     }
     return IssueDetail(**result_data)
 
 
+async def iter_issue_comments(repo_model: RepoDetail, detail: IssueDetail) -> AsyncIterator[List[Comment]]:
+    """
+    逐页返回issue的评论, 第一页直接使用query_issue的结果, 后续页按游标请求
+    """
+    yield detail.comments
+    if detail.comments_cursor is None:
+        return
+    query = f'''
+        query ($owner: String!, $name: String!, $number: Int!, $first: Int!, $after: String) {{
+          repository(name: $name, owner: $owner) {{
+            issue(number: $number) {{
+              comments(first: $first, after: $after) {{
+                nodes {{{COMMENT_FIELDS}                }}{PAGE_INFO_FIELDS}              }}
+            }}
+          }}
+        }}
+    '''
+    async for nodes in iter_graphql_pages(query, get_detail_variables(repo_model),
+                                          ['repository', 'issue', 'comments'], after=detail.comments_cursor):
+        fix_ghost_author(nodes)
+        yield [Comment(**node) for node in nodes]
+
+
+async def fetch_remaining_nodes(node: dict, field: str, fragment: str, fields: str) -> list:
+    """
+    获取嵌套connection(例如讨论评论的回复)剩余的分页, 并合并到第一页的nodes中
+    :param node: 包含connection的父节点, 需要有id
+    :param field: connection字段名
+    :param fragment: 父节点的GraphQL类型, 例如DiscussionComment
+    :param fields: connection中nodes需要返回的字段
+    """
+    connection = node[field]
+    nodes = connection['nodes']
+    cursor = get_next_cursor(connection)
+    if cursor is None:
+        return nodes
+    query = f'''
+        query ($id: ID!, $first: Int!, $after: String) {{
+          node(id: $id) {{
+            ... on {fragment} {{
+              {field}(first: $first, after: $after) {{
+                nodes {{{fields}                }}{PAGE_INFO_FIELDS}              }}
+            }}
+          }}
+        }}
+    '''
+    async for page in iter_graphql_pages(query, {"id": node['id']}, ['node', field], after=cursor):
+        nodes.extend(page)
+    return nodes
+
+
 async def query_discussion(repo_model: RepoDetail) -> DiscussionDetail:
-    query = '''
-        query($name: String!, $owner: String!, $number: Int!) {
-          repository(name: $name, owner: $owner) {
-            discussion(number: $number) {
+    """
+    查询discussion及第一页评论, 后续评论通过iter_discussion_comments分页获取
+    """
+    query = f'''
+        query($name: String!, $owner: String!, $number: Int!) {{
+          repository(name: $name, owner: $owner) {{
+            discussion(number: $number) {{
               id
               body
               title
               number
-              labels(first: 100) {
+              labels(first: 100) {{
                 totalCount
-                nodes {
+                nodes {{
                   id
                   name
-                }
-              }
-              comments(first: 100) {
+                }}
+              }}
+              comments(first: {GRAPHQL_PAGE_SIZE}) {{
                 totalCount
-                nodes {
-                  id
-                  author {
-                    login
-                  }
-                  url
-                  body
-                  replies(first: 100) {
+                nodes {{{COMMENT_FIELDS}
+                  replies(first: {GRAPHQL_PAGE_SIZE}) {{
                     totalCount
-                    nodes {
-                      id
-                      author {
-                        login
-                      }
-                      url
-                      body
-                    }
-                    pageInfo {
-                      endCursor
-                      startCursor
-                    }
-                  }
-                }
-                pageInfo {
-                  endCursor
-                  startCursor
-                }
-              }
-            }
-          }
-        }
+                    nodes {{{COMMENT_FIELDS}                    }}{PAGE_INFO_FIELDS}                  }}
+                }}{PAGE_INFO_FIELDS}              }}
+            }}
+          }}
+        }}
     '''
-    result = await do_post_requests({"query": query, "variables": repo_model.dict()})
-    total_count = result['data']['repository']['discussion']['comments']['totalCount']
-    if total_count > 100:
-        raise Exception(f"comments.totalCount > 100, {total_count} of {result}")
+    result = await do_post_requests({"query": query, "variables": get_detail_variables(repo_model)})
+    discussion = result['data']['repository']['discussion']
 
-    total_count = result['data']['repository']['discussion']["labels"]['totalCount']
+    total_count = discussion["labels"]['totalCount']
     if total_count > 100:
         raise Exception(f"labels.totalCount > 100, {total_count} of {result}")
 
-    j_nodes = result['data']['repository']['discussion']['comments']['nodes']
-    for index, j_node in enumerate(j_nodes):
-        total_count = j_node["replies"]["totalCount"]
-        if total_count > 100:
-            raise Exception(f"comments[{index}].replies.totalCount > 100, {total_count} of {j_node}")
-
-    # See https://github.com/ghost
-    for c in result['data']['repository']['discussion']['comments']['nodes']:
-        if 'author' not in c or c['author'] is None:
-            c['author'] = {'login': 'ghost'}
-        for r in c['replies']['nodes']:
-            if r['author'] is None:
-                r['author'] = {'login': 'ghost'}
-
     result_data = {
-        'id': result['data']['repository']['discussion']['id'],
-        'title': result['data']['repository']['discussion']['title'],
-        'body': result['data']['repository']['discussion']['body'],
-        'labels': result['data']['repository']['discussion']['labels']['nodes'],
-        "comments": result['data']['repository']['discussion']['comments']['nodes'],
+        'id': discussion['id'],
+        'title': discussion['title'],
+        'body': discussion['body'],
+        'labels': discussion['labels']['nodes'],
+        "comments": await parse_discussion_comments(discussion['comments']['nodes']),
+        "comments_cursor": get_next_cursor(discussion['comments']),
         "url": repo_model.url
     }
     return DiscussionDetail(**result_data)
 
 
+async def parse_discussion_comments(nodes: list) -> List[Comment]:
+    """
+    将讨论评论转换为Comment, 超过一页的回复会继续分页获取
+    """
+    fix_ghost_author(nodes)
+    comments = []
+    for node in nodes:
+        replies = await fetch_remaining_nodes(node, 'replies', 'DiscussionComment', COMMENT_FIELDS)
+        fix_ghost_author(replies)
+        comments.append(Comment(id=node['id'], url=node['url'], body=node['body'], author=node['author'],
+                                replies=replies))
+    return comments
+
+
+async def iter_discussion_comments(repo_model: RepoDetail,
+                                   detail: DiscussionDetail) -> AsyncIterator[List[Comment]]:
+    """
+    逐页返回discussion的评论及其全部回复
+    """
+    yield detail.comments
+    if detail.comments_cursor is None:
+        return
+    query = f'''
+        query ($owner: String!, $name: String!, $number: Int!, $first: Int!, $after: String) {{
+          repository(name: $name, owner: $owner) {{
+            discussion(number: $number) {{
+              comments(first: $first, after: $after) {{
+                nodes {{{COMMENT_FIELDS}
+                  replies(first: {GRAPHQL_PAGE_SIZE}) {{
+                    nodes {{{COMMENT_FIELDS}                    }}{PAGE_INFO_FIELDS}                  }}
+                }}{PAGE_INFO_FIELDS}              }}
+            }}
+          }}
+        }}
+    '''
+    async for nodes in iter_graphql_pages(query, get_detail_variables(repo_model),
+                                          ['repository', 'discussion', 'comments'], after=detail.comments_cursor):
+        yield await parse_discussion_comments(nodes)
+
+
 async def update_issue_comment(issues_id, body):
     query = '''
         mutation ($id: ID!, $body:String!) {
@@ -522,80 +657,140 @@ async def query_label_id(owner, name, label):
         return None
 
 
+REVIEW_COMMENT_FIELDS = '''
+                      id
+                      url
+                      body
+'''
+
+
 async def query_pullrequest_all_in_one(repo_model: RepoDetail) -> PullRequestDetail:
-    query = '''
-        query ($name: String!, $owner: String!, $number: Int!) {
-          repository(name: $name, owner: $owner) {
-            pullRequest(number: $number) {
+    """
+    查询pull request及第一页评论和review, 后续分页通过iter_pullrequest_comments和iter_pullrequest_reviews获取
+    """
+    query = f'''
+        query ($name: String!, $owner: String!, $number: Int!) {{
+          repository(name: $name, owner: $owner) {{
+            pullRequest(number: $number) {{
               id
               title
               body
-              labels(first: 100) {
+              labels(first: 100) {{
                 totalCount
-                nodes {
+                nodes {{
                   id
                   name
-                }
-              }
-              comments(first: 100) {
+                }}
+              }}
+              comments(first: {GRAPHQL_PAGE_SIZE}) {{
                 totalCount
-                nodes {
+                nodes {{
                   id
                   url
                   body
-                }
-              }
-              reviews(first: 100) {
+                }}{PAGE_INFO_FIELDS}              }}
+              reviews(first: {GRAPHQL_PAGE_SIZE}) {{
                 totalCount
-                nodes {
+                nodes {{
                   id
                   url
                   body
-                  comments(first: 100) {
+                  comments(first: {GRAPHQL_PAGE_SIZE}) {{
                     totalCount
-                    nodes {
-                      id
-                      url
-                      body
-                    }
-                  }
-                }
-              }
-            }
-          }
-        }
+                    nodes {{{REVIEW_COMMENT_FIELDS}                    }}{PAGE_INFO_FIELDS}                  }}
+                }}{PAGE_INFO_FIELDS}              }}
+            }}
+          }}
+        }}
     '''
 
-    result = await do_post_requests({"query": query, "variables": repo_model.dict()})
-    total_labels = result['data']['repository']['pullRequest']['labels']['totalCount']
+    result = await do_post_requests({"query": query, "variables": get_detail_variables(repo_model)})
+    pull_request = result['data']['repository']['pullRequest']
+    total_labels = pull_request['labels']['totalCount']
     if total_labels > 100:
         raise Exception(f"too many labels, count={total_labels} {result}")
 
-    total_comments = result['data']['repository']['pullRequest']['comments']['totalCount']
-    if total_comments > 100:
-        raise Exception(f"too many comments, count={total_comments} {result}")
-
-    total_reviews = result['data']['repository']['pullRequest']['reviews']['totalCount']
-    if total_reviews > 100:
-        raise Exception(f"too many reviews, count={total_reviews} {result}")
-
-    for review in result['data']['repository']['pullRequest']['reviews']['nodes']:
-        total_review_comments = review['comments']['totalCount']
-        if total_review_comments > 100:
-            raise Exception(f"too many review comments, count={total_review_comments} {result}")
-
     result_data = {
-        "id": result['data']['repository']['pullRequest']['id'],
-        "title": result['data']['repository']['pullRequest']['title'],
-        "body": result['data']['repository']['pullRequest']['body'],
-        "labels": result['data']['repository']['pullRequest']["labels"]["nodes"],
-        "comments": result['data']['repository']['pullRequest']["comments"]["nodes"],
-        "reviews": result['data']['repository']['pullRequest']['reviews']['nodes'],
+        "id": pull_request['id'],
+        "title": pull_request['title'],
+        "body": pull_request['body'],
+        "labels": pull_request["labels"]["nodes"],
+        "comments": pull_request["comments"]["nodes"],
+        "comments_cursor": get_next_cursor(pull_request['comments']),
+        "reviews": await parse_pullrequest_reviews(pull_request['reviews']['nodes']),
+        "reviews_cursor": get_next_cursor(pull_request['reviews']),
         "url": repo_model.url
     }
     return PullRequestDetail(**result_data)
 
 
+async def parse_pullrequest_reviews(nodes: list) -> List[Review]:
+    """
+    将review转换为Review, 超过一页的review评论会继续分页获取
+    """
+    reviews = []
+    for node in nodes:
+        comments = await fetch_remaining_nodes(node, 'comments', 'PullRequestReview', REVIEW_COMMENT_FIELDS)
+        reviews.append(Review(id=node['id'], url=node['url'], body=node['body'], comments=comments))
+    return reviews
+
+
+async def iter_pullrequest_comments(repo_model: RepoDetail,
+                                    detail: PullRequestDetail) -> AsyncIterator[List[Comment]]:
+    """
+    逐页返回pull request的评论
+    """
+    yield detail.comments
+    if detail.comments_cursor is None:
+        return
+    query = f'''
+        query ($owner: String!, $name: String!, $number: Int!, $first: Int!, $after: String) {{
+          repository(name: $name, owner: $owner) {{
+            pullRequest(number: $number) {{
+              comments(first: $first, after: $after) {{
+                nodes {{
+                  id
+                  url
+                  body
+                }}{PAGE_INFO_FIELDS}              }}
+            }}
+          }}
+        }}
+    '''
+    async for nodes in iter_graphql_pages(query, get_detail_variables(repo_model),
+                                          ['repository', 'pullRequest', 'comments'], after=detail.comments_cursor):
+        yield [Comment(**node) for node in nodes]
+
+
+async def iter_pullrequest_reviews(repo_model: RepoDetail,
+                                   detail: PullRequestDetail) -> AsyncIterator[List[Review]]:
+    """
+    逐页返回pull request的review及其全部评论
+    """
+    yield detail.reviews
+    if detail.reviews_cursor is None:
+        return
+    query = f'''
+        query ($owner: String!, $name: String!, $number: Int!, $first: Int!, $after: String) {{
+          repository(name: $name, owner: $owner) {{
+            pullRequest(number: $number) {{
+              reviews(first: $first, after: $after) {{
+                nodes {{
+                  id
+                  url
+                  body
+                  comments(first: {GRAPHQL_PAGE_SIZE}) {{
+                    nodes {{{REVIEW_COMMENT_FIELDS}                    }}{PAGE_INFO_FIELDS}                  }}
+                }}{PAGE_INFO_FIELDS}              }}
+            }}
+          }}
+        }}
+    '''
+    async for nodes in iter_graphql_pages(query, get_detail_variables(repo_model),
+                                          ['repository', 'pullRequest', 'reviews'], after=detail.reviews_cursor):
+        yield await parse_pullrequest_reviews(nodes)
+
+
 async def update_pullrequest_review(pr_id, body):
     query = '''
         mutation ($id: ID!, $body: String!) {
@@ -778,6 +973,115 @@ async def search_issues(owner, name, isf, sort, labels, count):
     return result['data']['search']['nodes']
 
 
+async def iter_search_issues(owner, name, isf, sort, labels, page_size=100):
+    """
+    按游标分页搜索GitHub issues, 以异步生成器逐页返回
+    :param owner: For example, ossrs
+    :param name: For example, srs
+    :param isf: For example, is:issue is:pr is:discussion
+    :param sort: For example, sort:comments-desc
+    :param labels: For example, -label:TransByAI
+    :param page_size: 每页数量, 最大100
+    """
+    query = '''
+        query ($query: String!, $type:SearchType!, $first: Int!, $after: String) {
+          search(
+            query: $query
+            type: $type
+            first: $first
+            after: $after
+          ) {
+            issueCount
+            discussionCount
+            pageInfo {
+              hasNextPage
+              endCursor
+            }
+            nodes {
+              ... on Discussion {
+                id
+                title
+                url
+                createdAt
+                comments {
+                  totalCount
+                }
+                labels(first: 100) {
+                  nodes {
+                    name
+                  }
+                }
+              }
+              ... on Issue {
+                id
+                title
+                url
+                createdAt
+                comments {
+                  totalCount
+                }
+                labels(first: 100) {
+                  nodes {
+                    name
+                  }
+                }
+              }
+              ... on PullRequest {
+                id
+                title
+                url
+                createdAt
+                comments {
+                  totalCount
+                }
+                labels(first: 100) {
+                  nodes {
+                    name
+                  }
+                }
+              }
+            }
+          }
+        }
+    '''
+    search_type = 'ISSUE'
+    if 'discussion' in isf:
+        search_type = 'DISCUSSION'
+    query_filter = f"repo:{owner}/{name} {isf} {sort} {' '.join(labels)}"
+    async for nodes in iter_graphql_pages(query, {"query": query_filter, "type": search_type}, ['search'],
+                                          page_size=page_size):
+        yield nodes
+
+
+async def iter_search_all_issues(owner, name, isf, labels, page_size=100):
+    """
+    按创建时间升序遍历全部搜索结果, 不受单次搜索最多返回SEARCH_RESULT_LIMIT条的限制
+    每次搜索达到上限后, 以最后一条的创建时间作为下一次搜索的起点(created:>=), 边界上重复的结果需要调用者去重
+    结果集在遍历期间会变化的过滤条件(例如翻译后才添加的标签)不要放在labels中, 否则游标会跳过结果
+    :param labels: 附加的过滤条件, 例如 -label:TransByAI
+    """
+    since = None
+    while True:
+        filters = list(labels)
+        if since:
+            filters.append(f"created:>={since}")
+        count = 0
+        last_created = None
+        async for nodes in iter_search_issues(owner, name, isf, "sort:created-asc", filters, page_size):
+            count += len(nodes)
+            for node in nodes:
+                if node and node.get("createdAt"):
+                    last_created = node["createdAt"]
+            yield nodes
+        if count < SEARCH_RESULT_LIMIT or not last_created:
+            break
+        if last_created == since:
+            # 同一秒内创建的结果超过上限, 无法再按时间切分
+            logger.warning(f"More than {SEARCH_RESULT_LIMIT} results created at {since}, stop searching")
+            break
+        since = last_created
+
+
 async def query_repository_id(owner, name):
     query = '''
         query ($owner: String!, $name: String!) {
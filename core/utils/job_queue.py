@@ -0,0 +1,148 @@
+# -*- coding:utf-8 -*-
+#  Copyright (c) 2016-present The ZLMediaKit project authors. All Rights Reserved.
+#  This file is part of ZLMediaKit(https://github.com/ZLMediaKit/Github-AI-Assistant).
+#  Use of this source code is governed by MIT-like license that can be found in the
+#  LICENSE file in the root of the source tree. All contributing project authors
+#  may be found in the AUTHORS file in the root of the source tree.
+#
+__author__ = 'alex'
+
+import asyncio
+import dataclasses
+import time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List
+
+from core.log import logger
+
+# 入队结果
+ENQUEUE_ACCEPTED = "accepted"
+ENQUEUE_DUPLICATE = "duplicate"
+ENQUEUE_REJECTED = "rejected"
+
+
+@dataclasses.dataclass
+class Job:
+    job_id: str
+    key: str
+    payload: Any
+    enqueued_at: float = dataclasses.field(default_factory=time.monotonic)
+
+
+class JobQueue:
+    """
+    有界的异步任务队列, 由固定数量的worker处理
+    相同key的任务按入队顺序串行执行, 不同key之间并发执行, 任务按job_id去重, 队列满时拒绝新任务
+    """
+
+    def __init__(self, handler: Callable[[Job], Awaitable], workers: int = 4, max_size: int = 1000,
+                 dedup_size: int = 10000, name: str = "job"):
+        self.handler = handler
+        self.workers = max(workers, 1)
+        self.max_size = max_size
+        self.dedup_size = dedup_size
+        self.name = name
+        # key -> 等待执行的任务, key正在执行或在ready中排队时不会再次进入ready
+        self.pending: Dict[str, Deque[Job]] = {}
+        self.ready: asyncio.Queue | None = None
+        self.running: Dict[str, Job] = {}
+        # 最近见过的job_id, 用于去重
+        self.seen: OrderedDict[str, None] = OrderedDict()
+        self.tasks: List[asyncio.Task] = []
+        self.size = 0
+        self.max_depth = 0
+        self.total_accepted = 0
+        self.total_duplicated = 0
+        self.total_rejected = 0
+        self.total_processed = 0
+        self.total_failed = 0
+        self.total_wait_time = 0.0
+
+    def start(self):
+        self.ready = asyncio.Queue()
+        self.tasks = [asyncio.create_task(self.worker(i)) for i in range(self.workers)]
+        logger.info(f"{self.name} queue started with {self.workers} workers, max size {self.max_size}")
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        if self.size:
+            logger.warning(f"{self.name} queue stopped with {self.size} pending jobs")
+
+    def is_duplicate(self, job_id: str) -> bool:
+        return job_id in self.seen
+
+    def is_full(self) -> bool:
+        return bool(self.max_size) and self.size >= self.max_size
+
+    def put(self, job: Job) -> str:
+        """
+        任务入队, 不会阻塞, 返回ENQUEUE_ACCEPTED/ENQUEUE_DUPLICATE/ENQUEUE_REJECTED
+        """
+        if self.is_duplicate(job.job_id):
+            self.total_duplicated += 1
+            logger.info(f"{self.name} {job.job_id} is duplicated, skip")
+            return ENQUEUE_DUPLICATE
+        if self.is_full():
+            self.total_rejected += 1
+            logger.warning(f"{self.name} queue is full({self.size}), reject {job.job_id}")
+            return ENQUEUE_REJECTED
+        self.seen[job.job_id] = None
+        if len(self.seen) > self.dedup_size:
+            self.seen.popitem(last=False)
+        jobs = self.pending.get(job.key)
+        if jobs is None:
+            jobs = self.pending[job.key] = deque()
+            if job.key not in self.running:
+                self.ready.put_nowait(job.key)
+        jobs.append(job)
+        self.size += 1
+        self.max_depth = max(self.max_depth, self.size)
+        self.total_accepted += 1
+        return ENQUEUE_ACCEPTED
+
+    async def worker(self, index: int):
+        while True:
+            key = await self.ready.get()
+            jobs = self.pending[key]
+            job = jobs.popleft()
+            if not jobs:
+                del self.pending[key]
+            self.size -= 1
+            self.running[key] = job
+            self.total_wait_time += time.monotonic() - job.enqueued_at
+            try:
+                await self.handler(job)
+                self.total_processed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.total_failed += 1
+                logger.exception(f"{self.name} worker {index}: {job.job_id} failed, {e}")
+            finally:
+                del self.running[key]
+                # 同一个key后续的任务在当前任务完成后才能执行
+                if key in self.pending:
+                    self.ready.put_nowait(key)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        获取队列深度和处理统计
+        """
+        started = self.total_processed + self.total_failed
+        return {
+            "workers": self.workers,
+            "depth": self.size,
+            "max_size": self.max_size,
+            "max_depth": self.max_depth,
+            "running": len(self.running),
+            "pending_keys": len(self.pending),
+            "accepted": self.total_accepted,
+            "duplicated": self.total_duplicated,
+            "rejected": self.total_rejected,
+            "processed": self.total_processed,
+            "failed": self.total_failed,
+            "avg_wait_time": self.total_wait_time / started if started else 0,
+        }
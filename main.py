@@ -7,6 +7,8 @@
 #
 import asyncio
 import os.path
+import time
+from typing import List
 
 import typer
 from rich.progress import Progress
@@ -237,7 +239,10 @@ def batch_trans(input_url: Annotated[
                 query_filter: Annotated[
                     str, typer.Option(
                         help="The filter can be [issue, pr, pullrequest, discussion], for example, issue")],
-                query_limit: Annotated[int, typer.Option(help="Maximum quantity at a time, for example 10")] = 10,
+                query_limit: Annotated[int, typer.Option(
+                    help="Maximum number of objects to translate, 0 means no limit, for example 10")] = 10,
+                workers: Annotated[int, typer.Option(
+                    min=1, help="Number of objects translated at the same time")] = 4,
                 model_name: Annotated[str, typer.Option(
                     help="The name of the AI model, such as gemini/gemini-1.5-flash")] = None,
                 api_url: Annotated[str, typer.Option(
@@ -255,7 +260,7 @@ def batch_trans(input_url: Annotated[
     setup_result = settings.setup_translation_env(github_token, model_name, api_url, api_key, proxy_url)
     if not setup_result:
         return
-    asyncio.run(trans.batch_trans(input_url, query_filter, query_limit))
+    asyncio.run(trans.batch_trans(input_url, query_filter, query_limit, workers))
 
 
 @app.command("review_commit", help="Review a specific commit")
@@ -350,7 +355,12 @@ def make_project_index(repo_url: Annotated[str, typer.Option(
                            help="The url of the http proxy used when requesting the model's API, "
                                 "for example, http://127.0.0.1:8118")] = None,
                        exclude_dirs: Annotated[str, typer.Option(
-                           help="Exclude directories, for example, tests,docs")] = None
+                           help="Exclude directories, for example, tests,docs")] = None,
+                       jobs: Annotated[int, typer.Option(
+                           help="Number of processes used to analyze files, 0 means the number of CPU cores")] = 0,
+                       incremental: Annotated[bool, typer.Option(
+                           help="Only re-analyze changed files and purge deleted files instead of rebuilding "
+                                "the whole index")] = False
                        ):
     setup_result = settings.setup_review_env(github_token, model_name, api_url, api_key, proxy_url)
     if not setup_result:
@@ -358,7 +368,9 @@ def make_project_index(repo_url: Annotated[str, typer.Option(
     analyzer = CodeAnalyzer(repo_url, settings.get_milvus_uri())
     if exclude_dirs:
         exclude_dirs = exclude_dirs.split(",")
-    asyncio.run(analyzer.make_full_index(exclude_dirs))
+    if jobs <= 0:
+        jobs = os.cpu_count() or 1
+    asyncio.run(analyzer.make_full_index(exclude_dirs, jobs, incremental))
 
 
 @app.command("update_project_index", help="Update project index")
@@ -401,6 +413,32 @@ def start_bot_webhook(command: Annotated[str, typer.Argument(help="start/stop/re
         console.print("Invalid command", style="bold red")
 
 
+@app.command("webhook_events", help="List or replay webhook events recorded in the journal")
+def webhook_events(status: Annotated[str, typer.Option(
+    help="Only list events with this status: pending/running/done/failed")] = None,
+                   limit: Annotated[int, typer.Option(help="Number of recent events to list")] = 50,
+                   replay: Annotated[List[str], typer.Option(
+                       help="Delivery id of the event to replay, can be specified multiple times")] = None
+                   ):
+    """
+    查看或重放webhook事件
+    :return:
+    """
+    from rich.table import Table
+    from apps.webhook import handles
+    if replay:
+        settings.init_translation_model()
+        settings.init_review_model()
+        asyncio.run(handles.replay_events(replay))
+        return
+    table = Table("Delivery", "Event", "Repository", "Status", "Attempts", "Received", "Error")
+    for entry in handles.get_webhook_journal().list_events(status, limit):
+        table.add_row(entry["delivery_id"], entry["event"], entry["repo_key"], entry["status"],
+                      str(entry["attempts"]), time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entry["created_at"])),
+                      entry["error"] or "")
+    console.print(table)
+
+
 if __name__ == "__main__":
     system.check_env()
     install_panel()
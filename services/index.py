@@ -0,0 +1,120 @@
+# -*- coding:utf-8 -*-
+#  Copyright (c) 2016-present The ZLMediaKit project authors. All Rights Reserved.
+#  This file is part of ZLMediaKit(https://github.com/ZLMediaKit/Github-AI-Assistant).
+#  Use of this source code is governed by MIT-like license that can be found in the
+#  LICENSE file in the root of the source tree. All contributing project authors
+#  may be found in the AUTHORS file in the root of the source tree.
+#
+"""
+独立的索引进程, 多worker模式下由webhook主进程启动, 唯一持有向量模型, Milvus连接和索引数据
+"""
+__author__ = 'alex'
+
+import asyncio
+import json
+import os
+import signal
+from typing import Any, Dict
+
+from core import settings
+from core.analyze import scheduler, warmup
+from core.analyze.base import CodeAnalyzer, milvus_manager
+from core.analyze.remote import MESSAGE_LIMIT
+from core.log import init_logging, logger
+from core.utils import asyncio_utls
+
+
+async def handle_request(method: str, params: Dict[str, Any]) -> Any:
+    if method == "ping":
+        return "pong"
+    if method == "status":
+        return warmup.get_status()
+    if method not in ("get_review_contexts", "schedule_reindex"):
+        raise ValueError(f"Unknown method {method}")
+    repo_name = params.get("repo_name")
+    if not repo_name:
+        raise ValueError(f"Method {method} requires repo_name")
+    if method == "get_review_contexts":
+        analyzer = CodeAnalyzer(repo_name, settings.get_milvus_uri())
+        return await analyzer.get_review_contexts(params["patches"])
+    if method == "schedule_reindex":
+        scheduler.get_reindex_scheduler().schedule(repo_name)
+        return None
+
+
+def parse_request(line: bytes) -> tuple[str, Dict[str, Any]]:
+    """
+    解析一行请求, 格式错误时抛出ValueError(包括json.JSONDecodeError)
+    """
+    request = json.loads(line)
+    if not isinstance(request, dict) or not isinstance(request.get("method"), str):
+        raise ValueError("Invalid request, method is required")
+    params = request.get("params") or {}
+    if not isinstance(params, dict):
+        raise ValueError("Invalid request, params must be an object")
+    return request["method"], params
+
+
+async def handle_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        while True:
+            try:
+                line = await reader.readline()
+            except ValueError as e:
+                # 单条消息超过MESSAGE_LIMIT, 连接中剩余的数据已无法按行解析, 返回错误后关闭连接
+                logger.warning(f"Index service received an oversized request, {e}")
+                writer.write(json.dumps({"error": "Request is too large"}).encode() + b"\n")
+                await writer.drain()
+                break
+            if not line:
+                break
+            method = None
+            try:
+                method, params = parse_request(line)
+                response = {"result": await handle_request(method, params)}
+            except Exception as e:
+                if method is None:
+                    logger.warning(f"Index service received an invalid request, {e}")
+                else:
+                    logger.exception(f"Index service {method} failed, {e}")
+                response = {"error": str(e)}
+            writer.write(json.dumps(response).encode() + b"\n")
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(socket_path: str):
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    if not os.path.exists(os.path.dirname(socket_path)):
+        os.makedirs(os.path.dirname(socket_path))
+    server = await asyncio.start_unix_server(handle_connection, path=socket_path, limit=MESSAGE_LIMIT)
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop_event.set)
+    logger.info(f"Index service is listening on {socket_path}")
+    # 保持对任务的引用, 避免预热过程中被回收
+    warmup_task = asyncio.create_task(warmup.warm_up()) if settings.get_embedding_preload() else None
+    async with server:
+        await stop_event.wait()
+    if warmup_task:
+        warmup_task.cancel()
+        # 等待预热任务退出, 避免关闭Milvus时还有正在执行的load_collection
+        await asyncio.gather(warmup_task, return_exceptions=True)
+    await scheduler.get_reindex_scheduler().stop()
+    # 写入缓冲区中尚未提交的向量数据
+    await milvus_manager.close()
+    logger.info("Index service stopped")
+
+
+def run_index_service():
+    """
+    索引进程入口, 由Sanic的进程管理器启动
+    """
+    init_logging("Index", logger_path=None, logger_level=settings.LOGGER_LEVEL)
+    asyncio_utls.use_uvloop()
+    asyncio.run(serve(settings.get_index_socket_path()))
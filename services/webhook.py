@@ -5,6 +5,7 @@
 #  LICENSE file in the root of the source tree. All contributing project authors
 #  may be found in the AUTHORS file in the root of the source tree.
 #
+import asyncio
 from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 
@@ -13,12 +14,12 @@ from sanic.log import logger
 from sanic.worker.loader import AppLoader
 from sanic_ext import Extend, Config
 
-from core import settings
+from core import settings, llm
 from core.application import BaseApplication
 from core.console import console
 from core.discover import autodiscover
 from core.log import LOGGING_CONFIG_DEFAULTS
-from core.utils import asyncio_utls
+from core.utils import asyncio_utls, github
 
 asyncio_utls.use_uvloop()
 
@@ -55,17 +56,44 @@ class WebhookService(BaseApplication):
 
         self.sanic_app.static("/static", settings.STATIC_ROOT, name="static")
         self.sanic_app.static("/media", settings.MEDIA_ROOT, name="media")
+        if settings.WEB_HOOK_WORKERS > 1:
+            self.sanic_app.register_listener(self.main_process_ready, "main_process_ready")
         self.sanic_app.register_listener(self.before_server_start, "before_server_start")
         self.sanic_app.register_listener(self.after_server_stop, "after_server_stop")
         self._setup_system_signals()
 
+    async def main_process_ready(self, app, _):
+        from services.index import run_index_service
+        # 多worker模式下只在独立的索引进程中加载向量模型和索引
+        app.manager.manage("IndexService", run_index_service, {})
+
     async def before_server_start(self, app, loop):
         logger.setLevel(settings.LOGGER_LEVEL)
+        if settings.WEB_HOOK_WORKERS > 1:
+            # 各worker共享模型接口的限流额度, 向量检索和索引交给索引进程
+            settings.API_LIMITER.enable_shared(settings.get_shared_limiter_path())
+            settings.INDEX_SERVICE_ENABLED = True
         settings.init_translation_model()
         settings.init_review_model()
+        github.init_github_client()
+        if settings.get_embedding_preload() and not settings.INDEX_SERVICE_ENABLED:
+            from core.analyze import warmup
+            # 在后台预热, 完成前/api/v1/health返回503
+            app.add_task(warmup.warm_up(), name="warmup")
 
     async def after_server_stop(self, app, loop):
-        pass
+        from core.analyze import scheduler
+        from core.analyze.base import milvus_manager
+        warmup_task = app.get_task("warmup", raise_exception=False)
+        if warmup_task:
+            warmup_task.cancel()
+            # 等待预热任务退出, 避免关闭Milvus时还有正在执行的load_collection
+            await asyncio.gather(warmup_task, return_exceptions=True)
+        await scheduler.get_reindex_scheduler().stop()
+        # 写入缓冲区中尚未提交的向量数据
+        await milvus_manager.close()
+        await github.close_github_client()
+        await llm.close_llm_clients()
 
     def run(self, *args, **kwargs):
         console.print("Starting Webhook services", style="bold green")